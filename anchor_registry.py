@@ -0,0 +1,186 @@
+# Anchors of a mesh live in a collection of their own. Deleting an anchor
+# unlinks it from the collection, so the collection is always the list of
+# existing anchors and the scene never needs to be scanned.
+# Vertex indices of anchors are cached as an array and anchor positions
+# are read with a single bulk call.
+
+import bpy
+import numpy as np
+
+
+# Collection "session_uid" -> (anchor session uids, vertex indices).
+_vert_inds_cache = {}
+
+
+
+def get_anchor_collection( mesh, create=True ):
+    """
+    The collection holding anchors of "mesh". If "create" is set, makes one
+    when missing and moves anchors listed by older versions into it.
+    """
+    collection = mesh.get( "anchor_collection", None )
+    if (collection is not None) or (not create):
+        return collection
+
+    collection = bpy.data.collections.new( "ARAP anchors " + mesh.name )
+    bpy.context.scene.collection.children.link( collection )
+    mesh["anchor_collection"] = collection
+
+    # Anchors used to be stored as a list of objects in the mesh.
+    if 'anchors' in mesh:
+        for anchor in mesh['anchors']:
+            if (anchor is not None) and (anchor.name in bpy.context.scene.objects):
+                collection.objects.link( anchor )
+        del mesh['anchors']
+
+    return collection
+
+
+
+def get_anchors( mesh ):
+    """
+    Anchor objects of the mesh in the order all arrays below use.
+    """
+    collection = get_anchor_collection( mesh, create=False )
+    if collection is None:
+        return []
+
+    return list( collection.objects )
+
+
+
+def get_anchors_qty( mesh ):
+    collection = get_anchor_collection( mesh, create=False )
+    if collection is None:
+        return 0
+
+    return len( collection.objects )
+
+
+
+def add_anchor( mesh, location, vert_ind, name="Anchor", size=0.01 ):
+    """
+    Creates an empty attached to vertex "vert_ind" at world space "location"
+    and makes it the only selected and the active object.
+    """
+    collection = get_anchor_collection( mesh )
+
+    anchor = bpy.data.objects.new( name, None )
+    anchor.empty_display_type = 'PLAIN_AXES'
+    anchor.location = location
+    anchor.scale = (size, size, size)
+    anchor['mirror'] = None
+    anchor['symmetry'] = 'NONE'
+    anchor['vert_ind'] = int( vert_ind )
+    collection.objects.link( anchor )
+
+    view_layer = bpy.context.view_layer
+    for obj in view_layer.objects.selected:
+        obj.select_set( False )
+    anchor.select_set( True )
+    view_layer.objects.active = anchor
+
+    return anchor
+
+
+
+def add_anchors( mesh, locations, vert_inds, name="Anchor", size=0.01 ):
+    """
+    Creates many anchors at once: no operators, positions written with bulk 
+    calls and the vertex index cache filled right away. Selection is left alone.
+    Returns the number of anchors created.
+    """
+    collection = get_anchor_collection( mesh )
+    objects = collection.objects
+    old_qty = len(objects)
+    new_qty = len(vert_inds)
+    old_vert_inds = get_anchor_vert_inds( mesh )
+
+    # Linked objects go to the end of the collection.
+    for vert_ind in vert_inds:
+        anchor = bpy.data.objects.new( name, None )
+        anchor.empty_display_type = 'PLAIN_AXES'
+        anchor['mirror'] = None
+        anchor['symmetry'] = 'NONE'
+        anchor['vert_ind'] = int( vert_ind )
+        objects.link( anchor )
+
+    # Everything after the anchors which were already there.
+    all_locations = np.empty( (old_qty + new_qty) * 3, dtype=np.float32 )
+    objects.foreach_get( "location", all_locations )
+    all_locations[old_qty*3:] = np.asarray( locations, dtype=np.float32 ).ravel()
+    objects.foreach_set( "location", all_locations )
+
+    all_scales = np.empty( (old_qty + new_qty) * 3, dtype=np.float32 )
+    objects.foreach_get( "scale", all_scales )
+    all_scales[old_qty*3:] = size
+    objects.foreach_set( "scale", all_scales )
+
+    # The vertex indices are known, don't read them back one by one.
+    uids = np.empty( old_qty + new_qty, dtype=np.int32 )
+    objects.foreach_get( "session_uid", uids )
+    all_vert_inds = np.concatenate( (old_vert_inds, np.asarray( vert_inds, dtype=np.int64 )) )
+    _vert_inds_cache[collection.session_uid] = (uids, all_vert_inds)
+
+    return new_qty
+
+
+
+def remove_anchors( mesh ):
+    """
+    Deletes all anchors of the mesh in one call.
+    """
+    collection = get_anchor_collection( mesh, create=False )
+    if collection is None:
+        return
+
+    bpy.data.batch_remove( list( collection.objects ) )
+    _vert_inds_cache.pop( collection.session_uid, None )
+
+
+
+def get_anchor_vert_inds( mesh ):
+    """
+    Vertex indices of anchors as int array. Only re-read from the anchors
+    when anchors were added or deleted since the last call.
+    """
+    collection = get_anchor_collection( mesh, create=False )
+    if collection is None:
+        return np.zeros( 0, dtype=np.int64 )
+
+    objects = collection.objects
+    uids = np.empty( len(objects), dtype=np.int32 )
+    objects.foreach_get( "session_uid", uids )
+
+    cached = _vert_inds_cache.get( collection.session_uid, None )
+    if (cached is not None) and np.array_equal( cached[0], uids ):
+        return cached[1]
+
+    vert_inds = np.array( [ anchor['vert_ind'] for anchor in objects ], dtype=np.int64 )
+    _vert_inds_cache[collection.session_uid] = (uids, vert_inds)
+
+    return vert_inds
+
+
+
+def get_anchor_positions( mesh, dtype=np.float64 ):
+    """
+    World space anchor positions as (anchors_qty, 3) array read with one call.
+    """
+    collection = get_anchor_collection( mesh, create=False )
+    if collection is None:
+        return np.zeros( (0, 3), dtype=dtype )
+
+    objects = collection.objects
+    matrices = np.empty( len(objects)*16, dtype=np.float32 )
+    objects.foreach_get( "matrix_world", matrices )
+
+    # Matrices come column by column, translation is the last column.
+    return matrices.reshape( (-1, 16) )[:, 12:15].astype( dtype )
+
+
+
+def invalidate( mesh ):
+    collection = get_anchor_collection( mesh, create=False )
+    if collection is not None:
+        _vert_inds_cache.pop( collection.session_uid, None )
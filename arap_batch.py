@@ -0,0 +1,397 @@
+# Batch ARAP fitting without the UI.
+#
+#     python arap_batch.py manifest.json --workers 8
+#     blender -b --python arap_batch.py -- manifest.json
+#
+# OBJ and PLY inputs need only NumPy, SciPy and libigl. .blend inputs need
+# Blender, there each listed object's mesh is read in the Blender process
+# and solved by plain Python workers.
+#
+# A JSON manifest is a list of jobs, or an object with "jobs" and "defaults"
+# applied to every job:
+#
+#     {
+#         "defaults": { "backend": "DIRECT" },
+#         "jobs": [
+#             { "mesh": "head.obj", "output": "head_fit.obj",
+#               "anchor_inds": [12, 40], "targets": [[0, 0, 1], [0, 1, 1]] },
+#             { "mesh": "scene.blend", "object": "Body", "output": "body_fit.ply",
+#               "anchors": "body_anchors.npz", "fixed_inds": [3, 4, 5] }
+#         ]
+#     }
+#
+# Anchors may be given inline or as a landmark file read by mesh_io.read_landmarks().
+# NPZ landmark files may also hold "fixed_inds". Relative paths are relative 
+# to the manifest.
+#
+# An NPZ manifest holds the same jobs column wise: "mesh" and "output" string
+# arrays, "anchor_counts" per job and "anchor_inds", "targets" of all jobs
+# concatenated. Optionally "object" strings and "fixed_counts", "fixed_inds".
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Blender doesn't put the script's directory on the path.
+dir = os.path.dirname( os.path.abspath( __file__ ) )
+if not dir in sys.path:
+    sys.path.append( dir )
+
+import mesh_io
+import execution_config
+import shared_arrays
+import solver_planner
+
+
+# Job options and their defaults. "backend" "AUTO" lets solver_planner pick
+# the backend and preconditioner per mesh.
+JOB_DEFAULTS = { "backend": "IGL",
+                 "preconditioner": "ILU",
+                 "tolerance": 1.0e-6,
+                 "precision": "FLOAT64",
+                 # Merge vertices closer than this before solving, 0 doesn't weld.
+                 "weld_distance": 0.0 }
+
+
+
+def load_manifest( file_path ):
+    """
+    List of job dictionaries with absolute paths and anchors as arrays.
+    """
+    base_dir = os.path.dirname( os.path.abspath( file_path ) )
+
+    if file_path.lower().endswith( '.npz' ):
+        jobs = _load_npz_manifest( file_path )
+        defaults = {}
+
+    else:
+        with open( file_path, 'r' ) as f:
+            data = json.load( f )
+
+        if isinstance( data, list ):
+            jobs, defaults = data, {}
+        else:
+            jobs, defaults = data["jobs"], data.get( "defaults", {} )
+
+    result = []
+    for job_ind, job in enumerate( jobs ):
+        job = { **JOB_DEFAULTS, **defaults, **job }
+        job["ind"] = job_ind
+
+        for key in ("mesh", "output", "anchors"):
+            if key in job:
+                job[key] = os.path.join( base_dir, job[key] )
+
+        if "anchors" in job:
+            anchors_path = job.pop( "anchors" )
+            job["anchor_inds"], job["targets"] = mesh_io.read_landmarks( anchors_path )
+            if anchors_path.lower().endswith( '.npz' ):
+                with np.load( anchors_path ) as anchors:
+                    if "fixed_inds" in anchors:
+                        job["fixed_inds"] = anchors["fixed_inds"]
+
+        job["anchor_inds"] = np.asarray( job.get( "anchor_inds", [] ), dtype=np.int64 ).ravel()
+        job["targets"]     = np.asarray( job.get( "targets", [] ), dtype=np.float64 ).reshape( (-1, 3) )
+        job["fixed_inds"]  = np.asarray( job.get( "fixed_inds", [] ), dtype=np.int64 ).ravel()
+
+        if job["anchor_inds"].shape[0] != job["targets"].shape[0]:
+            raise ValueError( "Job %d: %d anchors but %d targets" %
+                              (job_ind, job["anchor_inds"].shape[0], job["targets"].shape[0]) )
+
+        result.append( job )
+
+    return result
+
+
+
+def _load_npz_manifest( file_path ):
+    with np.load( file_path ) as data:
+        meshes  = [ str(v) for v in data["mesh"] ]
+        outputs = [ str(v) for v in data["output"] ]
+        anchor_bounds = np.concatenate( ([0], np.cumsum( data["anchor_counts"] )) )
+        anchor_inds = data["anchor_inds"]
+        targets     = data["targets"].reshape( (-1, 3) )
+
+        objects = [ str(v) for v in data["object"] ] if ("object" in data) else None
+
+        if "fixed_counts" in data:
+            fixed_bounds = np.concatenate( ([0], np.cumsum( data["fixed_counts"] )) )
+            fixed_inds   = data["fixed_inds"]
+        else:
+            fixed_bounds = None
+
+    jobs = []
+    for job_ind in range( len(meshes) ):
+        job = { "mesh": meshes[job_ind], "output": outputs[job_ind] }
+        a, b = anchor_bounds[job_ind], anchor_bounds[job_ind+1]
+        job["anchor_inds"] = anchor_inds[a:b]
+        job["targets"]     = targets[a:b]
+
+        if fixed_bounds is not None:
+            a, b = fixed_bounds[job_ind], fixed_bounds[job_ind+1]
+            job["fixed_inds"] = fixed_inds[a:b]
+
+        if objects and objects[job_ind]:
+            job["object"] = objects[job_ind]
+
+        jobs.append( job )
+
+    return jobs
+
+
+
+def load_blend_mesh( file_path, object_name ):
+    """
+    World space (Vs, Fs) of an object in a .blend file. Only works inside Blender.
+    """
+    try:
+        import bpy
+    except ImportError:
+        raise RuntimeError( ".blend inputs need Blender: blender -b --python arap_batch.py -- manifest.json" )
+
+    import ui_panel
+
+    with bpy.data.libraries.load( file_path, link=False ) as (data_from, data_to):
+        if object_name not in data_from.objects:
+            raise ValueError( "No object \"%s\" in %s" % (object_name, file_path) )
+        data_to.objects = [ object_name ]
+
+    obj = data_to.objects[0]
+    Vs = ui_panel.get_rest_positions( obj, np.float64 )
+    Fs = ui_panel.mesh_2_faces( obj )
+
+    # Don't let loaded data pile up over thousands of jobs.
+    mesh_data = obj.data
+    bpy.data.objects.remove( obj )
+    if mesh_data.users == 0:
+        bpy.data.meshes.remove( mesh_data )
+
+    return (Vs, Fs)
+
+
+
+def run_job( job, Vs=None, Fs=None ):
+    """
+    Loads the mesh unless given, solves and writes the result.
+    Returns a short summary which is all the parent process keeps.
+    """
+    import arap_solver
+
+    t0 = time.perf_counter()
+
+    if Vs is None:
+        # Binary meshes are mapped, the solver copies only what it needs.
+        Vs, Fs = mesh_io.read_mesh( job["mesh"], mmap=True )
+
+    dtype = np.float32 if (job["precision"] == "FLOAT32") else np.float64
+    Vs = Vs.astype( dtype, copy=False )
+    t_load = time.perf_counter() - t0
+
+    Vs_in, Fs_out = Vs, Fs
+    anchor_inds = job["anchor_inds"]
+    fixed_inds  = job["fixed_inds"]
+    weld = None
+    if job["weld_distance"] > 0.0:
+        import mesh_topology
+        weld = mesh_topology.weld_vertices( Vs, Fs, job["weld_distance"] )
+        Vs, Fs = weld.weld_positions( Vs ), weld.Fs
+        anchor_inds = weld.weld_inds( anchor_inds )
+        fixed_inds  = np.unique( weld.weld_inds( fixed_inds ) )
+
+    islands_qty, labels = arap_solver.island_labels( Fs, Vs.shape[0] )
+    default_inds = arap_solver.island_default_inds( Vs, labels, islands_qty )
+    vert_inds, targets = arap_solver.assemble_constraints( Vs, labels, default_inds,
+                                                           anchor_inds, job["targets"],
+                                                           fixed_inds )
+
+    backend, preconditioner = job["backend"], job["preconditioner"]
+    if backend == "AUTO":
+        stats = solver_planner.ProblemStats( Vs.shape[0], Fs.shape[0], islands_qty, vert_inds.shape[0] )
+        options = solver_planner.plan( stats ).options
+        backend, preconditioner = options["backend"], options["preconditioner"]
+
+    solver = arap_solver.get_solver( None, Vs, Fs, vert_inds,
+                                     backend=backend,
+                                     preconditioner=preconditioner,
+                                     tolerance=job["tolerance"] )
+    Vs_new = solver.solve( targets, Vs )
+    if weld is not None:
+        Vs_new = weld.unweld_positions( Vs_new )
+    # Meshes differ from job to job, only solvers shared by topology are worth keeping.
+    arap_solver.invalidate( None )
+    t_solve = time.perf_counter() - t0 - t_load
+
+    output_dir = os.path.dirname( job["output"] )
+    if output_dir:
+        os.makedirs( output_dir, exist_ok=True )
+    mesh_io.write_mesh( job["output"], Vs_new, Fs_out )
+
+    import distortion
+    strain, residual, rest_areas = distortion.face_distortion( Vs_in, Vs_new, Fs_out )
+    residual_stats = distortion.summarize( residual, rest_areas )
+
+    return { "ind":        job["ind"],
+             "mesh":       job["mesh"],
+             "output":     job["output"],
+             "verts_qty":  int( Vs_new.shape[0] ),
+             "solved_verts_qty": int( Vs.shape[0] ),
+             "islands_qty": int( islands_qty ),
+             "backend":    solver_planner.strategy_name( backend, preconditioner ),
+             "shared":     bool( solver.shared ),
+             "converged":  bool( solver.converged ),
+             "residual_mean": residual_stats["mean"],
+             "residual_max":  residual_stats["max"],
+             "load_s":     t_load,
+             "solve_s":    t_solve,
+             "total_s":    time.perf_counter() - t0 }
+
+
+
+def run_batch( jobs, workers=1, max_in_flight=None, stop_on_error=False, threads=None ):
+    """
+    Runs jobs in "workers" processes with at most "threads" native threads 
+    each, by default the cores split between workers. At most "max_in_flight" 
+    jobs are submitted at a time so that memory stays bounded no matter how 
+    many jobs there are. Results are yielded in completion order.
+    """
+    config = execution_config.ExecutionConfig( workers, threads )
+
+    if config.workers <= 1:
+        with execution_config.limit_threads( config.threads_per_worker ):
+            for job in jobs:
+                yield _run_job_safe( job, stop_on_error )
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    if max_in_flight is None:
+        max_in_flight = 2 * config.workers
+
+    # In Blender sys.executable is Blender's bundled Python, workers don't import bpy.
+    # Meshes read here go to the workers in shared memory, a block lives until 
+    # its job is done, or until the pool has stopped if the batch is cancelled.
+    with shared_arrays.SharedArrays() as shared, execution_config.process_pool( config ) as pool:
+        pending = {}
+        jobs = iter( jobs )
+        exhausted = False
+
+        while True:
+            while (not exhausted) and (len(pending) < max_in_flight):
+                job = next( jobs, None )
+                if job is None:
+                    exhausted = True
+                    break
+
+                mesh_arrays = ()
+                if job["mesh"].lower().endswith( '.blend' ):
+                    # bpy only lives in this process, send the arrays.
+                    try:
+                        Vs, Fs = load_blend_mesh( job["mesh"], job.get( "object" ) )
+                    except Exception as e:
+                        if stop_on_error:
+                            raise
+                        yield _error_summary( job, e )
+                        continue
+                    mesh_arrays = (shared.put( Vs ), shared.put( Fs ))
+                    del Vs, Fs
+                future = pool.submit( _run_job_safe, job, stop_on_error, *mesh_arrays )
+                pending[future] = mesh_arrays
+
+            if len(pending) == 0:
+                break
+
+            done, _ = wait( pending, return_when=FIRST_COMPLETED )
+            for future in done:
+                shared.release( pending.pop( future ) )
+                yield future.result()
+
+
+
+def _run_job_safe( job, stop_on_error, Vs=None, Fs=None ):
+    try:
+        if (Vs is None) and job["mesh"].lower().endswith( '.blend' ):
+            Vs, Fs = load_blend_mesh( job["mesh"], job.get( "object" ) )
+
+        with shared_arrays.attached( (Vs, Fs) ) as mesh_arrays:
+            summary = run_job( job, *mesh_arrays )
+            # No view may outlive its block.
+            del mesh_arrays
+
+        return summary
+
+    except Exception as e:
+        if stop_on_error:
+            raise
+        return _error_summary( job, e )
+
+
+
+def _error_summary( job, e ):
+    return { "ind": job["ind"], "mesh": job["mesh"], "error": "%s: %s" % (type(e).__name__, e) }
+
+
+
+def _in_blender():
+    return "bpy" in sys.modules
+
+
+
+def _script_args():
+    # Blender passes script arguments after "--".
+    if "--" in sys.argv:
+        return sys.argv[sys.argv.index( "--" )+1:]
+    if _in_blender():
+        return []
+    return sys.argv[1:]
+
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description="Batch ARAP fitting" )
+    parser.add_argument( "manifest", help="JSON or NPZ manifest" )
+    parser.add_argument( "--workers", type=int, default=0,
+                         help="worker processes, 1 solves in this process (default a worker per core)" )
+    parser.add_argument( "--threads-per-worker", type=int, default=0,
+                         help="BLAS/OpenMP threads of each worker (default cores / workers)" )
+    parser.add_argument( "--max-in-flight", type=int, default=None,
+                         help="jobs submitted at a time, bounds memory (default 2 per worker)" )
+    parser.add_argument( "--report", default=None, help="write per job summaries to this JSON file" )
+    parser.add_argument( "--stop-on-error", action="store_true" )
+
+    args = parser.parse_args( _script_args() if argv is None else argv )
+
+    jobs = load_manifest( args.manifest )
+    config = execution_config.auto_config( len(jobs), args.workers, args.threads_per_worker )
+    print( "%d workers, %d threads each" % (config.workers, config.threads_per_worker) )
+
+    t0 = time.perf_counter()
+    summaries = []
+    failed_qty = 0
+    for summary in run_batch( jobs, config.workers, args.max_in_flight, args.stop_on_error, 
+                              config.threads_per_worker ):
+        summaries.append( summary )
+        if "error" in summary:
+            failed_qty += 1
+            print( "[%d/%d] %s FAILED %s" % (len(summaries), len(jobs), summary["mesh"], summary["error"]) )
+        else:
+            print( "[%d/%d] %s %d verts %.3f s%s" % (len(summaries), len(jobs), summary["mesh"],
+                                                    summary["verts_qty"], summary["total_s"], 
+                                                    "" if summary["converged"] else ", CG didn't converge") )
+
+    print( "%d jobs, %d failed, %.3f s" % (len(jobs), failed_qty, time.perf_counter() - t0) )
+
+    if args.report is not None:
+        summaries.sort( key=lambda s: s["ind"] )
+        with open( args.report, 'w' ) as f:
+            json.dump( summaries, f, indent=1 )
+
+    return 1 if failed_qty > 0 else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,966 @@
+# ARAP solving helpers which do not depend on Blender.
+# The add-on imports this module lazily, only after numpy and libigl
+# are known to be installed.
+
+import collections
+import hashlib
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+import igl
+
+import mesh_topology
+
+
+# Solvers precomputed for a fixed set of constrained vertices, with the 
+# solver options they were built for. Key is whatever the caller uses to 
+# identify the mesh. The most recently used last.
+_solvers = collections.OrderedDict()
+SOLVERS_MAX_QTY = 16
+
+# The same solvers by topology: faces, constrained vertices and solver options.
+# Meshes with the same topology and similar rest poses share one of them.
+# The most recently used last.
+_shared_solvers = collections.OrderedDict()
+SHARED_SOLVERS_MAX_QTY = 16
+
+
+
+class ArapSolver:
+    """
+    Wraps igl.ARAP precomputation so that it is done once for
+    a fixed set of constrained vertices and reused for any number of solves.
+
+    Positions are kept in the precision of "Vs" (float32 or float64). 
+    libigl works in double precision only, so inputs are promoted right 
+    before calling it and results are converted back.
+    """
+
+    # Precomputation of another mesh, see AlignedSolver.
+    shared = False
+
+    def __init__( self, Vs, Fs, vert_inds ):
+        self.Vs        = np.ascontiguousarray( Vs )
+        self.Fs        = np.ascontiguousarray( Fs, dtype=np.int32 )
+        self.vert_inds = np.ascontiguousarray( vert_inds, dtype=np.int32 )
+        self.dtype     = self.Vs.dtype
+        # What it takes to build the same solver in another process.
+        self.args      = (self.Vs, self.Fs, self.vert_inds)
+
+        # igl.ARAP runs a fixed number of iterations with a direct solver.
+        self.converged = True
+
+        # IGL precomputation
+        self.arap = igl.ARAP( self.Vs.astype( np.float64 ), self.Fs, 3, self.vert_inds )
+
+
+    def solve( self, target_positions, initial_guess=None ):
+        """
+        Solve for the constrained vertices moved to "target_positions".
+        If "initial_guess" is provided (for example, the previous frame solution)
+        ARAP iterations start from it instead of the rest pose.
+        Afterwards "converged" is False if an iterative global step stopped 
+        at its iteration limit short of its tolerance.
+        """
+        if initial_guess is None:
+            initial_guess = self.Vs
+
+        bc = np.ascontiguousarray( target_positions, dtype=np.float64 )
+        initial_guess = np.ascontiguousarray( initial_guess, dtype=np.float64 )
+
+        # IGL solve
+        Vs_new = self.arap.solve( bc, initial_guess )
+        return Vs_new.astype( self.dtype, copy=False )
+
+
+
+class LocalGlobalSolver:
+    """
+    ARAP (Sorkine and Alexa, "As-rigid-as-possible surface modeling") with the local 
+    step vectorized in NumPy and the global step done with SciPy. The energy is 
+    the spokes and rims one with cotangent weights igl.ARAP uses for triangle 
+    meshes: the rotation of a vertex fits every edge of the faces around it, 
+    not only the edges leaving it. Both solvers give the same result.
+
+    The global step is either a sparse direct factorization ("DIRECT") or 
+    preconditioned conjugate gradients ("CG") warm started from the previous 
+    iterate. CG memory stays linear in the mesh size, which matters for meshes 
+    whose factorization doesn't fit in RAM. Preconditioners are "JACOBI", 
+    "ILU" (incomplete factorization, SciPy has no incomplete Cholesky) and 
+    "MULTIGRID" (needs the optional pyamg package, falls back to "JACOBI").
+
+    Unlike igl.ARAP, it can solve one half of a mirror symmetric mesh: "seam_inds" 
+    are vertices on the mirror plane "seam_axis" = 0. They keep that coordinate 
+    at zero while the two other coordinates are free, and their rotations account 
+    for the mirrored half which isn't part of the mesh.
+    """
+
+    shared = False
+
+    def __init__( self, Vs, Fs, vert_inds, seam_inds=None, seam_axis=0, max_iter=10, 
+                  global_step='DIRECT', preconditioner='JACOBI', tolerance=1.0e-6 ):
+        self.Vs        = np.ascontiguousarray( Vs )
+        self.Fs        = np.ascontiguousarray( Fs, dtype=np.int32 )
+        self.vert_inds = np.ascontiguousarray( vert_inds, dtype=np.int32 )
+        self.dtype     = self.Vs.dtype
+        self.max_iter  = max_iter
+        if seam_inds is None:
+            seam_inds = np.zeros( 0, dtype=np.int32 )
+        self.seam_inds = np.ascontiguousarray( seam_inds, dtype=np.int32 )
+        self.seam_axis = seam_axis
+        self.global_step    = global_step
+        self.preconditioner = preconditioner
+        self.tolerance      = tolerance
+        self.args      = (self.Vs, self.Fs, self.vert_inds, self.seam_inds, seam_axis, max_iter, 
+                          global_step, preconditioner, tolerance)
+        self.converged = True
+
+        verts_qty = self.Vs.shape[0]
+        Vs_rest = self.Vs.astype( np.float64 )
+
+        # Every face edge (i, j) with half cotangent of the opposite angle.
+        # Summed over the two faces sharing an edge it gives the usual ARAP weight.
+        edge_i, edge_j, edge_w = mesh_topology.face_edge_weights( Vs_rest, self.Fs )
+        edges_qty = edge_i.shape[0]
+        faces_qty = self.Fs.shape[0]
+        self.edge_i = edge_i
+        self.edge_j = edge_j
+        self.edge_w = edge_w
+        # Vertex opposite to the edge, face_edge_weights() goes over the corners in order.
+        self.edge_o = self.Fs.T.ravel()
+        # Rest edge vectors.
+        self.rest_edges = Vs_rest[edge_i] - Vs_rest[edge_j]
+
+        # Signed edge to vertex incidence for the right hand side.
+        rows = np.concatenate( (edge_i, edge_j) )
+        cols = np.concatenate( (np.arange( edges_qty ), np.arange( edges_qty )) )
+        signs = np.concatenate( (np.ones( edges_qty ), -np.ones( edges_qty )) )
+        self.signed_incidence = scipy.sparse.csr_matrix( (signs, (rows, cols)), shape=(verts_qty, edges_qty) )
+        # Vertex to face incidence to sum face covariances around vertices.
+        face_cols = np.repeat( np.arange( faces_qty ), 3 )
+        self.face_incidence = scipy.sparse.csr_matrix( (np.ones( 3*faces_qty ), (self.Fs.ravel(), face_cols)), 
+                                                       shape=(verts_qty, faces_qty) )
+
+        # L_ii = sum_j w_ij, L_ij = -w_ij.
+        self.L = mesh_topology.laplacian( verts_qty, edge_i, edge_j, edge_w )
+
+        # Vertices not used by any face have nothing to keep them in place.
+        degree = np.asarray( self.face_incidence.sum( axis=1 ) ).ravel()
+        self.loose_inds = np.flatnonzero( degree == 0 ).astype( np.int32 )
+
+        # Constrained vertices per axis. All axes share anchors and loose 
+        # vertices, the seam axis additionally has seam vertices.
+        common_inds = np.unique( np.concatenate( (self.vert_inds, self.loose_inds) ) )
+        common_system = self._make_global_system( common_inds )
+        self.axis_systems = [common_system, common_system, common_system]
+
+        seam_inds = np.unique( np.concatenate( (common_inds, self.seam_inds) ) )
+        if seam_inds.shape[0] > common_inds.shape[0]:
+            self.axis_systems[self.seam_axis] = self._make_global_system( seam_inds )
+
+
+    def _make_global_system( self, known_inds ):
+        verts_qty = self.Vs.shape[0]
+        is_known = np.zeros( verts_qty, dtype=bool )
+        is_known[known_inds] = True
+        free_inds = np.flatnonzero( ~is_known )
+
+        L = self.L.tocsr()
+        L_f  = L[free_inds]
+        L_ff = L_f[:, free_inds]
+        L_fk = L_f[:, known_inds].tocsr()
+
+        if self.global_step == 'CG':
+            return IterativeSystem( known_inds, free_inds, L_fk, L_ff.tocsr(), self.preconditioner, self.tolerance )
+
+        factor = scipy.sparse.linalg.splu( L_ff.tocsc(), permc_spec='MMD_AT_PLUS_A' )
+        return GlobalSystem( known_inds, free_inds, L_fk, factor )
+
+
+    def solve( self, target_positions, initial_guess=None ):
+        """
+        Same as ArapSolver.solve().
+        """
+        if initial_guess is None:
+            initial_guess = self.Vs
+
+        bc = np.asarray( target_positions, dtype=np.float64 )
+        Vs_new = np.array( initial_guess, dtype=np.float64 )
+
+        # Known values: anchors at their targets, loose vertices where they are, seam at zero.
+        known = np.zeros( Vs_new.shape, dtype=np.float64 )
+        known[self.loose_inds] = self.Vs[self.loose_inds]
+        known[self.seam_inds, self.seam_axis] = 0.0
+        known[self.vert_inds] = bc
+
+        for axis in range(3):
+            system = self.axis_systems[axis]
+            Vs_new[system.known_inds, axis] = known[system.known_inds, axis]
+
+        self.converged = True
+        for iteration in range(self.max_iter):
+            R = self._local_step( Vs_new )
+            self._global_step( R, known, Vs_new )
+            self.converged = self.converged and all( system.converged for system in self.axis_systems )
+
+        return Vs_new.astype( self.dtype, copy=False )
+
+
+    def _local_step( self, Vs_new ):
+        # Per face covariance of rest and deformed edges, summed over the faces around each vertex.
+        edges = Vs_new[self.edge_i] - Vs_new[self.edge_j]
+        outer = self.edge_w[:, None, None] * self.rest_edges[:, :, None] * edges[:, None, :]
+        face_S = outer.reshape( (3, -1, 9) ).sum( axis=0 )
+        S = ( self.face_incidence @ face_S ).reshape( (-1, 3, 3) )
+
+        # Seam vertices also have mirrored edges: S + M S M with M the mirror.
+        if self.seam_inds.shape[0] > 0:
+            mirror = np.ones( 3 )
+            mirror[self.seam_axis] = -1.0
+            S_seam = S[self.seam_inds]
+            S[self.seam_inds] = S_seam + S_seam * np.outer( mirror, mirror )
+
+        return best_rotations( S )
+
+
+    def _global_step( self, R, known, Vs_new ):
+        # A face edge (i, j) is fitted by the rotations of all three face corners:
+        # b_i = sum w_ij/3 (R_i + R_j + R_o) (p_i - p_j)
+        R_edges = R[self.edge_i] + R[self.edge_j] + R[self.edge_o]
+        rotated = np.einsum( 'eab,eb->ea', R_edges, self.rest_edges )
+        rotated *= self.edge_w[:, None] / 3.0
+        rhs = self.signed_incidence @ rotated
+
+        for axis in range(3):
+            system = self.axis_systems[axis]
+            b = rhs[system.free_inds, axis] - system.L_fk @ known[system.known_inds, axis]
+            # The current values are the previous iterate.
+            x0 = Vs_new[system.free_inds, axis]
+            Vs_new[system.free_inds, axis] = system.solve( b, x0 )
+
+
+
+class GlobalSystem:
+    """
+    Global step system for one set of known vertices: L_ff x_f = b_f - L_fk x_k.
+    """
+    def __init__( self, known_inds, free_inds, L_fk, factor ):
+        self.known_inds = known_inds
+        self.free_inds  = free_inds
+        self.L_fk       = L_fk
+        self.factor     = factor
+        self.converged  = True
+
+
+    def solve( self, b, x0 ):
+        return self.factor.solve( b )
+
+
+
+class IterativeSystem:
+    """
+    Same as GlobalSystem but solved with preconditioned conjugate gradients.
+    """
+    def __init__( self, known_inds, free_inds, L_fk, L_ff, preconditioner, tolerance, max_iter=2000 ):
+        self.known_inds = known_inds
+        self.free_inds  = free_inds
+        self.L_fk       = L_fk
+        self.L_ff       = L_ff
+        self.tolerance  = tolerance
+        self.max_iter   = max_iter
+        self.precondition = make_preconditioner( L_ff, preconditioner )
+        # Iterations the last solve took and whether it reached the tolerance.
+        self.iterations = 0
+        self.converged  = True
+
+
+    def solve( self, b, x0 ):
+        x, self.iterations, self.converged = pcg( self.L_ff, b, x0, self.precondition, self.tolerance, self.max_iter )
+        return x
+
+
+
+def make_preconditioner( A, kind ):
+    """
+    Returns a function applying preconditioner "kind" to a residual.
+    """
+    if kind == 'ILU':
+        # Threshold dropping only and no pivoting: for a symmetric positive definite 
+        # matrix this stays close to incomplete Cholesky. SuperLU's fill limiting 
+        # "area" rule spoils the factors badly enough for CG to stall.
+        ilu = scipy.sparse.linalg.spilu( A.tocsc(), drop_tol=1.0e-3, drop_rule='basic', 
+                                         permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.0 )
+        return ilu.solve
+
+    if kind == 'MULTIGRID':
+        try:
+            import pyamg
+        except ImportError:
+            pyamg = None
+
+        if pyamg is not None:
+            ml = pyamg.smoothed_aggregation_solver( A.tocsr() )
+            M = ml.aspreconditioner( cycle='V' )
+            return M.matvec
+
+    # Jacobi
+    diagonal = A.diagonal()
+    inv_diagonal = np.divide( 1.0, diagonal, out=np.ones_like( diagonal ), where=(diagonal != 0.0) )
+    return lambda r: inv_diagonal * r
+
+
+
+def pcg( A, b, x0, precondition, tolerance, max_iter ):
+    """
+    Preconditioned conjugate gradients for a symmetric positive definite "A" 
+    starting from "x0". Stops when the residual norm drops below "tolerance" 
+    relative to the norm of "b". Returns (x, iterations, converged), 
+    "converged" is False if "max_iter" iterations didn't get there.
+    """
+    x = np.array( x0, dtype=np.float64 )
+    r = b - A @ x
+
+    b_norm = np.linalg.norm( b )
+    if b_norm == 0.0:
+        b_norm = 1.0
+    stop_norm = tolerance * b_norm
+
+    if np.linalg.norm( r ) <= stop_norm:
+        return (x, 0, True)
+
+    z = precondition( r )
+    p = z.copy()
+    rz = np.dot( r, z )
+
+    converged = False
+    iteration = -1
+    for iteration in range(max_iter):
+        Ap = A @ p
+        alpha = rz / np.dot( p, Ap )
+        x += alpha * p
+        r -= alpha * Ap
+
+        if np.linalg.norm( r ) <= stop_norm:
+            converged = True
+            break
+
+        z = precondition( r )
+        rz_new = np.dot( r, z )
+        p *= rz_new / rz
+        p += z
+        rz = rz_new
+
+    return (x, iteration+1, converged)
+
+
+
+def best_rotations( S ):
+    """
+    Rotations closest to covariance matrices S of shape (N, 3, 3) 
+    in the sense of ARAP local step: R = V U^T with S = U Sigma V^T.
+    """
+    U, sigma, Vt = np.linalg.svd( S )
+    R = np.transpose( U @ Vt, (0, 2, 1) )
+
+    # Fix reflections flipping the column of U with the smallest singular value.
+    reflected = np.linalg.det( R ) < 0.0
+    if np.any( reflected ):
+        U[reflected, :, 2] *= -1.0
+        R[reflected] = np.transpose( U[reflected] @ Vt[reflected], (0, 2, 1) )
+
+    return R
+
+
+
+
+class SymmetricSolver:
+    """
+    Solves only one half of a mirror symmetric mesh and mirrors the result.
+    The kept half is the positive side of "axis" plus the vertices on the plane.
+    Vertices on the plane are constrained to stay on it. Constraints on the 
+    negative side are moved to their mirror vertices.
+
+    Only valid if anchors move symmetrically, which is the case for anchors 
+    created with symmetry enabled.
+    """
+
+    shared = False
+
+    def __init__( self, Vs, Fs, vert_inds, mirror_inds, axis, max_iter=10, 
+                  global_step='DIRECT', preconditioner='JACOBI', tolerance=1.0e-6 ):
+        self.Vs          = np.ascontiguousarray( Vs )
+        self.Fs          = np.ascontiguousarray( Fs, dtype=np.int32 )
+        self.vert_inds   = np.ascontiguousarray( vert_inds, dtype=np.int32 )
+        self.mirror_inds = np.ascontiguousarray( mirror_inds, dtype=np.int32 )
+        self.axis        = axis
+        self.dtype       = self.Vs.dtype
+        self.args        = (self.Vs, self.Fs, self.vert_inds, self.mirror_inds, axis, max_iter, 
+                            global_step, preconditioner, tolerance)
+
+        verts_qty = self.Vs.shape[0]
+        coord = self.Vs[:, axis].astype( np.float64 )
+        diagonal = np.linalg.norm( np.ptp( self.Vs.astype( np.float64 ), axis=0 ) )
+        plane_tolerance = 1.0e-4 * max( diagonal, 1.0e-12 )
+
+        on_plane = np.abs( coord ) <= plane_tolerance
+        positive = (coord > plane_tolerance)
+        negative = (coord < -plane_tolerance)
+
+        # Faces crossing the plane without a vertex on it would be lost.
+        face_pos = positive[self.Fs].any( axis=1 )
+        face_neg = negative[self.Fs].any( axis=1 )
+        if np.any( face_pos & face_neg ):
+            raise ValueError( "Mesh faces cross the mirror plane" )
+
+        kept = positive | on_plane
+        self.half_inds = np.flatnonzero( kept ).astype( np.int32 )
+        half_map = -np.ones( verts_qty, dtype=np.int32 )
+        half_map[self.half_inds] = np.arange( self.half_inds.shape[0], dtype=np.int32 )
+        self.half_map = half_map
+
+        # Negative side vertices take their positions from their mirrors.
+        self.negative_inds = np.flatnonzero( negative ).astype( np.int32 )
+        negative_sources = half_map[self.mirror_inds[self.negative_inds]]
+        if np.any( negative_sources < 0 ):
+            raise ValueError( "Mirror map doesn't map the negative side onto the positive one" )
+        self.negative_sources = negative_sources
+
+        half_faces = self.Fs[kept[self.Fs].all( axis=1 )]
+        half_faces = half_map[half_faces]
+
+        # Move constraints to the kept side, mirrored ones keep the first occurrence.
+        flip = negative[self.vert_inds]
+        half_vert_inds = np.where( flip, self.mirror_inds[self.vert_inds], self.vert_inds )
+        half_vert_inds = half_map[half_vert_inds]
+        _, first = np.unique( half_vert_inds, return_index=True )
+        self.constraint_sel  = np.sort( first )
+        self.constraint_flip = flip[self.constraint_sel]
+        half_vert_inds = half_vert_inds[self.constraint_sel]
+
+        # Plane vertices which aren't anchors stay on the plane.
+        seam_inds = half_map[np.flatnonzero( on_plane )]
+
+        self.half_solver = LocalGlobalSolver( self.Vs[self.half_inds], half_faces, half_vert_inds, 
+                                              seam_inds, axis, max_iter, 
+                                              global_step, preconditioner, tolerance )
+
+
+    @property
+    def converged( self ):
+        return self.half_solver.converged
+
+
+    def solve( self, target_positions, initial_guess=None ):
+        """
+        Same as ArapSolver.solve().
+        """
+        if initial_guess is None:
+            initial_guess = self.Vs
+
+        bc = np.array( target_positions, dtype=np.float64 )[self.constraint_sel]
+        bc[self.constraint_flip, self.axis] = -bc[self.constraint_flip, self.axis]
+
+        half_guess = np.asarray( initial_guess )[self.half_inds]
+        Vs_half = self.half_solver.solve( bc, half_guess )
+
+        Vs_new = np.empty( self.Vs.shape, dtype=self.dtype )
+        Vs_new[self.half_inds] = Vs_half
+        mirrored = Vs_half[self.negative_sources]
+        mirrored[:, self.axis] = -mirrored[:, self.axis]
+        Vs_new[self.negative_inds] = mirrored
+
+        return Vs_new
+
+
+
+def get_solver( key, Vs, Fs, vert_inds, symmetry=None, backend='IGL', 
+                preconditioner='JACOBI', tolerance=1.0e-6 ):
+    """
+    Returns a solver precomputed for the constraint set provided.
+    Precomputation is done only if the constraint set, the mesh size or 
+    solver options have changed since the last call with the same key.
+
+    "symmetry" is either None or (axis, mirror_inds). In the latter case 
+    only one half of the mesh is solved.
+
+    "backend" is "IGL" for igl.ARAP, "DIRECT" or "CG" for LocalGlobalSolver 
+    with the corresponding global step. "preconditioner" and "tolerance" 
+    are used by "CG" only.
+
+    Meshes with identical faces and constraints whose rest poses differ only 
+    by rotation, translation and uniform scale (instances, per-shot copies) 
+    share one precomputation whatever their keys are. ARAP commutes with 
+    such transforms, so the shared solver works in its own frame and results 
+    are transformed back. A mirror plane isn't preserved by them, symmetric 
+    solvers are never shared.
+    """
+    vert_inds = np.asarray( vert_inds, dtype=np.int32 )
+    if backend != 'CG':
+        preconditioner = None
+        tolerance = None
+
+    mode = (backend, preconditioner, tolerance)
+    if symmetry is not None:
+        mode = mode + ('SYMMETRIC', symmetry[0])
+
+    cached = _solvers.get( key, None )
+    if cached is not None:
+        solver_mode, solver = cached
+        same_mesh = (solver.Vs.shape == Vs.shape) and (solver.Fs.shape == Fs.shape) and (solver.dtype == Vs.dtype)
+        same_constraints = np.array_equal( solver.vert_inds, vert_inds )
+        same_mode = (solver_mode == mode)
+        if same_mesh and same_constraints and same_mode:
+            if np.array_equal( solver.Fs, Fs ) and np.array_equal( solver.Vs, Vs ):
+                _solvers.move_to_end( key )
+                return solver
+
+    topology_key = None
+    if symmetry is None:
+        topology_key = get_topology_key( Vs, Fs, vert_inds, mode )
+        solver = _find_shared_solver( topology_key, Vs )
+        if solver is not None:
+            _keep_solver( key, mode, solver )
+            return solver
+
+    # igl.ARAP can't constrain the mirror plane, symmetric solves use the direct backend instead.
+    global_step = 'CG' if (backend == 'CG') else 'DIRECT'
+
+    if symmetry is not None:
+        axis, mirror_inds = symmetry
+        solver = SymmetricSolver( Vs, Fs, vert_inds, mirror_inds, axis, 
+                                  global_step=global_step, preconditioner=preconditioner, tolerance=tolerance )
+    elif backend == 'IGL':
+        solver = ArapSolver( Vs, Fs, vert_inds )
+    else:
+        solver = LocalGlobalSolver( Vs, Fs, vert_inds, global_step=global_step, 
+                                    preconditioner=preconditioner, tolerance=tolerance )
+
+    _keep_solver( key, mode, solver )
+    if topology_key is not None:
+        _shared_solvers.setdefault( topology_key, [] ).append( solver )
+        _shared_solvers.move_to_end( topology_key )
+        _trim_shared_solvers()
+
+    return solver
+
+
+
+def get_topology_key( Vs, Fs, vert_inds, mode ):
+    """
+    Everything except the rest pose a precomputation depends on.
+    """
+    h = hashlib.blake2b( digest_size=16 )
+    h.update( np.ascontiguousarray( Fs, dtype=np.int32 ).tobytes() )
+    h.update( np.ascontiguousarray( vert_inds, dtype=np.int32 ).tobytes() )
+    key = (h.hexdigest(), Vs.shape[0], np.dtype( Vs.dtype ).name, mode)
+    return key
+
+
+
+def _find_shared_solver( topology_key, Vs ):
+    solvers = _shared_solvers.get( topology_key, None )
+    if solvers is None:
+        return None
+
+    for solver in solvers:
+        scale, rotation, translation, error = find_similarity( solver.Vs, Vs )
+        if error > 1.0e-6:
+            continue
+
+        _shared_solvers.move_to_end( topology_key )
+        if np.array_equal( solver.Vs, Vs ):
+            return solver
+
+        return AlignedSolver( type(solver), solver.args, scale, rotation, translation, Vs, solver )
+
+    return None
+
+
+
+def _keep_solver( key, mode, solver ):
+    _solvers[key] = (mode, solver)
+    _solvers.move_to_end( key )
+    # Least recently used meshes go first.
+    while len(_solvers) > SOLVERS_MAX_QTY:
+        _solvers.popitem( last=False )
+
+
+
+def _trim_shared_solvers():
+    solvers_qty = 0
+    for solvers in _shared_solvers.values():
+        solvers_qty += len(solvers)
+
+    # Least recently used topologies go first.
+    while (solvers_qty > SHARED_SOLVERS_MAX_QTY) and (len(_shared_solvers) > 1):
+        _, solvers = _shared_solvers.popitem( last=False )
+        solvers_qty -= len(solvers)
+
+
+
+def find_similarity( Vs_from, Vs_to ):
+    """
+    Least squares similarity transform Vs_to ~ scale * Vs_from @ rotation.T + translation 
+    (Umeyama). Returns (scale, rotation, translation, error), "error" is the largest 
+    vertex deviation relative to the bounding box diagonal of "Vs_to".
+    """
+    A = np.asarray( Vs_from, dtype=np.float64 )
+    B = np.asarray( Vs_to, dtype=np.float64 )
+    verts_qty = A.shape[0]
+
+    mean_a = A.mean( axis=0 )
+    mean_b = B.mean( axis=0 )
+    A0 = A - mean_a
+    B0 = B - mean_b
+
+    var_a = (A0 * A0).sum() / verts_qty
+    if var_a == 0.0:
+        return (1.0, np.eye( 3 ), mean_b - mean_a, 0.0)
+
+    cov = (B0.T @ A0) / verts_qty
+    U, D, Vt = np.linalg.svd( cov )
+    signs = np.ones( 3 )
+    if np.linalg.det( U ) * np.linalg.det( Vt ) < 0.0:
+        signs[2] = -1.0
+
+    rotation = (U * signs) @ Vt
+    scale = (D * signs).sum() / var_a
+    translation = mean_b - scale * (rotation @ mean_a)
+
+    diagonal = np.linalg.norm( B.max( axis=0 ) - B.min( axis=0 ) )
+    deviation = np.abs( scale * (A @ rotation.T) + translation - B ).max()
+    error = deviation / max( diagonal, 1.0e-12 )
+
+    return (scale, rotation, translation, error)
+
+
+
+class AlignedSolver:
+    """
+    Solver precomputed for another mesh whose rest pose maps onto "Vs" with 
+    a similarity transform. Targets are moved into that mesh's frame, solved 
+    there and the result is moved back.
+    """
+
+    shared = True
+
+    def __init__( self, solver_type, solver_args, scale, rotation, translation, Vs, solver=None ):
+        if solver is None:
+            solver = solver_type( *solver_args )
+
+        self.solver      = solver
+        self.scale       = scale
+        self.rotation    = rotation
+        self.translation = translation
+        self.Vs          = Vs
+        self.Fs          = solver.Fs
+        self.vert_inds   = solver.vert_inds
+        self.dtype       = solver.dtype
+        self.args        = (solver_type, solver_args, scale, rotation, translation, Vs)
+
+
+    @property
+    def converged( self ):
+        return self.solver.converged
+
+
+    def solve( self, target_positions, initial_guess=None ):
+        """
+        Same as ArapSolver.solve().
+        """
+        if initial_guess is None:
+            initial_guess = self.Vs
+
+        bc = self._to_solver_frame( target_positions )
+        guess = self._to_solver_frame( initial_guess )
+        Vs_new = self.solver.solve( bc, guess )
+
+        Vs_new = self.scale * (np.asarray( Vs_new, dtype=np.float64 ) @ self.rotation.T) + self.translation
+        return Vs_new.astype( self.dtype, copy=False )
+
+
+    def _to_solver_frame( self, Vs ):
+        Vs = np.asarray( Vs, dtype=np.float64 ) - self.translation
+        return (Vs @ self.rotation) / self.scale
+
+
+
+class HarmonicPreview:
+    """
+    Fast approximation of a solve for interactive dragging: anchor displacements
+    spread over the mesh with harmonic weights, one sparse matrix product per 
+    update. Constrained vertices which aren't anchors, islands defaults and fixed 
+    vertices, stay in place.
+    """
+
+    # Weights below this are dropped to keep the weight matrix sparse.
+    WEIGHT_THRESHOLD = 1.0e-4
+    # Right hand sides solved at a time, bounds the dense intermediate.
+    BLOCK_SIZE = 32
+
+    def __init__( self, Vs, Fs, vert_inds, anchors_qty ):
+        self.dtype = np.asarray( Vs ).dtype
+        self.Vs = np.asarray( Vs, dtype=np.float64 )
+        verts_qty = self.Vs.shape[0]
+        vert_inds = np.asarray( vert_inds, dtype=np.int64 )
+        self.anchor_inds = vert_inds[:anchors_qty]
+
+        topology = mesh_topology.MeshTopology( Fs, verts_qty )
+        L = topology.cotangent_laplacian( self.Vs )
+
+        # Vertices in no face have nothing to be harmonic with, they stay.
+        known = np.zeros( verts_qty, dtype=bool )
+        known[vert_inds] = True
+        known[topology.loose_inds()] = True
+        free_inds = np.flatnonzero( ~known )
+
+        # Several anchors on one vertex share its displacement.
+        counts = np.bincount( self.anchor_inds, minlength=verts_qty )[self.anchor_inds]
+        scales = 1.0 / counts
+
+        blocks = []
+        if free_inds.shape[0] > 0:
+            L_free = L[free_inds]
+            factor = scipy.sparse.linalg.splu( L_free[:, free_inds].tocsc() )
+            L_fa = L_free[:, self.anchor_inds].tocsc()
+
+            for start in range( 0, anchors_qty, self.BLOCK_SIZE ):
+                end = min( start + self.BLOCK_SIZE, anchors_qty )
+                W_block = factor.solve( -L_fa[:, start:end].toarray() ) * scales[start:end]
+                W_block[np.abs( W_block ) < self.WEIGHT_THRESHOLD] = 0.0
+                W_block = scipy.sparse.coo_matrix( W_block )
+                blocks.append( (free_inds[W_block.row], W_block.col + start, W_block.data) )
+
+        # Anchored vertices follow their anchors exactly.
+        blocks.append( (self.anchor_inds, np.arange( anchors_qty ), scales) )
+
+        rows = np.concatenate( [ b[0] for b in blocks ] )
+        cols = np.concatenate( [ b[1] for b in blocks ] )
+        vals = np.concatenate( [ b[2] for b in blocks ] ).astype( np.float32 )
+        self.W = scipy.sparse.csr_matrix( (vals, (rows, cols)), shape=(verts_qty, anchors_qty) )
+
+
+    def deform( self, anchor_targets ):
+        """
+        Positions with anchors moved to "anchor_targets", (anchors_qty, 3).
+        """
+        displacements = np.asarray( anchor_targets, dtype=np.float64 ) - self.Vs[self.anchor_inds]
+        Vs_new = self.Vs + self.W @ displacements
+        return Vs_new.astype( self.dtype, copy=False )
+
+
+
+
+def island_labels( Fs, verts_qty ):
+    """
+    Connected components of the face graph.
+    Returns (islands_qty, labels) with an island index per vertex.
+    Vertices in no face are islands of their own.
+    """
+    return mesh_topology.MeshTopology( Fs, verts_qty ).island_labels()
+
+
+
+def island_default_inds( Vs, labels, islands_qty ):
+    """
+    Three vertices per island far from each other, used to keep islands
+    without anchors in place. Returns an (islands_qty, 3) array.
+    An island with fewer than three vertices repeats some of them.
+    """
+    Vs = np.asarray( Vs, dtype=np.float64 )
+    verts_qty = Vs.shape[0]
+
+    # Start from the first vertex of every island.
+    first_inds = np.full( islands_qty, verts_qty, dtype=np.int64 )
+    np.minimum.at( first_inds, labels, np.arange( verts_qty ) )
+
+    dist_0 = np.linalg.norm( Vs - Vs[first_inds][labels], axis=1 )
+    inds_a = _argmax_per_island( dist_0, labels, islands_qty )
+    dist_a = np.linalg.norm( Vs - Vs[inds_a][labels], axis=1 )
+    inds_b = _argmax_per_island( dist_a, labels, islands_qty )
+    dist_b = np.linalg.norm( Vs - Vs[inds_b][labels], axis=1 )
+    inds_c = _argmax_per_island( dist_a + dist_b, labels, islands_qty )
+
+    return np.stack( (inds_a, inds_b, inds_c), axis=1 ).astype( np.int32 )
+
+
+
+def _argmax_per_island( values, labels, islands_qty ):
+    order = np.lexsort( (-values, labels) )
+    starts = np.searchsorted( labels[order], np.arange( islands_qty ) )
+    return order[starts]
+
+
+
+def assemble_constraint_inds( labels, default_inds, anchor_inds, fixed_inds=None ):
+    """
+    Constrained vertex indices: anchors first, anchors on fixed vertices are 
+    dropped. They are followed by default vertices of islands without anchors 
+    and by fixed vertices, all of which stay at their rest positions.
+    If a vertex has several anchors the first one wins.
+    Returns (anchor_sel, vert_inds), "anchor_sel" are indices of the anchors
+    kept, vert_inds[:len(anchor_sel)] are their vertices.
+    """
+    anchor_inds = np.asarray( anchor_inds, dtype=np.int64 ).ravel()
+    if fixed_inds is None:
+        fixed_inds = np.zeros( 0, dtype=np.int64 )
+    fixed_inds = np.unique( np.asarray( fixed_inds, dtype=np.int64 ) )
+
+    # Anchors attached to fixed vertices can't move them.
+    movable = ~np.isin( anchor_inds, fixed_inds )
+    _, first = np.unique( np.where( movable, anchor_inds, -1 ), return_index=True )
+    anchor_sel = np.sort( first[movable[first]] )
+    anchor_inds = anchor_inds[anchor_sel]
+
+    islands_qty = default_inds.shape[0]
+    free_islands = np.ones( islands_qty, dtype=bool )
+    free_islands[labels[anchor_inds]] = False
+    defaults = np.unique( default_inds[free_islands].ravel() )
+    defaults = defaults[~np.isin( defaults, fixed_inds )]
+
+    vert_inds = np.concatenate( (anchor_inds, defaults, fixed_inds) )
+    return (anchor_sel, vert_inds)
+
+
+
+def assemble_constraints( Vs, labels, default_inds, anchor_inds, anchor_targets, fixed_inds=None ):
+    """
+    The same as assemble_constraint_inds() but with target positions.
+    Returns (vert_inds, targets).
+    """
+    Vs = np.asarray( Vs )
+    anchor_targets = np.asarray( anchor_targets, dtype=Vs.dtype ).reshape( (-1, 3) )
+
+    anchor_sel, vert_inds = assemble_constraint_inds( labels, default_inds, anchor_inds, fixed_inds )
+    anchors_qty = anchor_sel.shape[0]
+    targets = np.concatenate( (anchor_targets[anchor_sel], Vs[vert_inds[anchors_qty:]]), axis=0 )
+
+    return (vert_inds, targets)
+
+
+
+
+def invalidate( key ):
+    """
+    Drop a cached solver, for example, when a mesh is picked again
+    and its rest pose might have changed.
+    Solvers shared by topology stay available for other meshes.
+    """
+    _solvers.pop( key, None )
+
+
+
+
+def solve_frames( solver, targets, chunks=1, threads=None ):
+    """
+    Solve a sequence of frames. "targets" is a (frames_qty, constraints_qty, 3) array.
+    Each frame is warm started from the previous frame's solution.
+
+    If "chunks" is more than 1, frames are split into contiguous chunks solved in
+    parallel worker processes. The first chunk reuses "solver", every other chunk
+    pays one precomputation in its own worker and starts from the rest pose.
+    Every process uses at most "threads" native threads, by default the cores 
+    are split between chunks. Solver arrays, targets and results are passed
+    in shared memory, workers write their frames in place.
+
+    Returns ((frames_qty, verts_qty, 3) array, converged), "converged" is
+    False if an iterative global step of any frame stopped short of its tolerance.
+    """
+    import execution_config
+    import shared_arrays
+
+    frames_qty = targets.shape[0]
+    chunks = max( 1, min( chunks, frames_qty ) )
+    config = execution_config.ExecutionConfig( chunks, threads )
+
+    if chunks == 1:
+        with execution_config.limit_threads( config.threads_per_worker ):
+            return _solve_chunk( solver, targets )
+
+    bounds = np.linspace( 0, frames_qty, chunks+1 ).astype( int )
+    verts_qty = solver.Vs.shape[0]
+
+    worker_config = execution_config.ExecutionConfig( chunks-1, config.threads_per_worker )
+    # Blocks are unlinked only after the pool has waited for its workers.
+    with shared_arrays.SharedArrays() as shared:
+        result_handle, result = shared.empty( (frames_qty, verts_qty, 3), solver.dtype )
+        args_handle    = shared.share( solver.args )
+        targets_handle = shared.share( targets )
+
+        with execution_config.process_pool( worker_config ) as pool:
+            futures = []
+            for chunk_ind in range( 1, chunks ):
+                chunk = (int( bounds[chunk_ind] ), int( bounds[chunk_ind+1] ))
+                future = pool.submit( _solve_chunk_in_worker, type(solver), args_handle, 
+                                      targets_handle, result_handle, chunk )
+                futures.append( future )
+
+            # Meanwhile solve the first chunk in this process.
+            with execution_config.limit_threads( config.threads_per_worker ):
+                _, converged = _solve_chunk( solver, targets[bounds[0]:bounds[1]], result[bounds[0]:bounds[1]] )
+            for future in futures:
+                converged = future.result() and converged
+
+        result = result.copy()
+
+    return (result, converged)
+
+
+
+def _solve_chunk( solver, targets, out=None ):
+    frames_qty = targets.shape[0]
+    verts_qty  = solver.Vs.shape[0]
+    if out is None:
+        out = np.empty( (frames_qty, verts_qty, 3), dtype=solver.dtype )
+
+    converged = True
+    Vs_prev = solver.Vs
+    for frame_ind in range(frames_qty):
+        Vs_prev = solver.solve( targets[frame_ind], Vs_prev )
+        out[frame_ind] = Vs_prev
+        converged = converged and solver.converged
+
+    return (out, converged)
+
+
+
+def _solve_chunk_in_worker( solver_type, args, targets, result, chunk ):
+    import shared_arrays
+
+    with shared_arrays.attached( (args, targets, result) ) as views:
+        converged = _solve_shared_chunk( solver_type, views, chunk )
+        # No view may outlive its block.
+        del views
+
+    return converged
+
+
+
+def _solve_shared_chunk( solver_type, views, chunk ):
+    args, targets, result = views
+    start, end = chunk
+    solver = solver_type( *args )
+    return _solve_chunk( solver, targets[start:end], result[start:end] )[1]
+
+
+
+
+def measure_precision_error( Vs, Fs, vert_inds, target_positions ):
+    """
+    Solves the same problem keeping positions in float32 and in float64.
+    Returns the largest vertex deviation between the two relative to 
+    the bounding box diagonal.
+    """
+    Vs = np.asarray( Vs, dtype=np.float64 )
+    target_positions = np.asarray( target_positions, dtype=np.float64 )
+
+    solver_64 = ArapSolver( Vs, Fs, vert_inds )
+    Vs_64 = solver_64.solve( target_positions )
+
+    solver_32 = ArapSolver( Vs.astype( np.float32 ), Fs, vert_inds )
+    Vs_32 = solver_32.solve( target_positions.astype( np.float32 ) )
+
+    diagonal = np.linalg.norm( Vs.max( axis=0 ) - Vs.min( axis=0 ) )
+    error = np.linalg.norm( Vs_32.astype( np.float64 ) - Vs_64, axis=1 ).max()
+    return error / diagonal
@@ -0,0 +1,267 @@
+# Benchmarks of the solver pipeline on generated meshes. Doesn't need Blender.
+#
+#     python benchmark.py precision --sizes 50 100 200
+#     python benchmark.py symmetry --sizes 40 80 160
+#     python benchmark.py backends --sizes 50 100 200 --calibrate
+#     python benchmark.py io --sizes 100 300 1000
+#     python benchmark.py threads --size 150 --tasks 16
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import arap_solver
+import execution_config
+import mesh_io
+import mesh_topology
+import sample_meshes
+import solver_planner
+
+
+
+def bench_precision( sizes ):
+    """
+    Peak memory of the position arrays, solve time and deviation of 
+    the float32 pipeline from the float64 one.
+    """
+    print( "%10s %8s %10s %10s %10s %12s" % ("verts", "dtype", "kept MB", "peak MB", "solve s", "rel error") )
+
+    for size in sizes:
+        for dtype in (np.float64, np.float32):
+            tracemalloc.start()
+
+            Vs, Fs = sample_meshes.make_cylinder( size, size, dtype=dtype )
+            vert_inds, targets = sample_meshes.make_bend_problem( Vs )
+
+            t0 = time.perf_counter()
+            solver = arap_solver.ArapSolver( Vs, Fs, vert_inds )
+            Vs_new = solver.solve( targets )
+            dt = time.perf_counter() - t0
+
+            # Memory held in NumPy arrays, libigl internals aren't traced.
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # What the pipeline keeps alive: rest pose, targets and the solution.
+            kept = Vs.nbytes + targets.nbytes + Vs_new.nbytes
+
+            if dtype == np.float32:
+                error = arap_solver.measure_precision_error( Vs, Fs, vert_inds, targets )
+                error = "%.3e" % error
+            else:
+                error = "-"
+
+            print( "%10d %8s %10.2f %10.2f %10.3f %12s" % (Vs.shape[0], np.dtype(dtype).name, kept / 1.0e6, peak / 1.0e6, dt, error) )
+
+
+
+def bench_symmetry( sizes ):
+    """
+    Whole mesh solve with igl.ARAP versus solving one half of a symmetric mesh.
+    Both minimize the same energy, the difference should be at the level of 
+    floating point noise.
+    """
+    print( "%10s %12s %12s %12s" % ("verts", "full s", "half s", "max diff") )
+
+    for size in sizes:
+        Vs, Fs = sample_meshes.make_cylinder( size, size - size % 4, mirror_faces=True )
+        vert_inds, targets = sample_meshes.make_bend_problem( Vs )
+        # Bend along Y so that the problem stays symmetric with respect to X = 0.
+        targets = Vs[vert_inds].copy()
+        targets[targets[:, 2] > 0.0, 1] += 0.5
+        mirror_inds = mesh_topology.find_mirror_map( Vs, 0 )
+
+        t0 = time.perf_counter()
+        Vs_full = arap_solver.ArapSolver( Vs, Fs, vert_inds ).solve( targets )
+        t1 = time.perf_counter()
+        Vs_half = arap_solver.SymmetricSolver( Vs, Fs, vert_inds, mirror_inds, 0 ).solve( targets )
+        t2 = time.perf_counter()
+
+        diff = np.abs( Vs_full - Vs_half ).max()
+        print( "%10d %12.3f %12.3f %12.3e" % (Vs.shape[0], t1 - t0, t2 - t1, diff) )
+
+
+
+def bench_backends( sizes, calibrate=None ):
+    """
+    Precompute plus solve time of every solver backend. Differences are 
+    measured against igl.ARAP, all backends minimize the same energy.
+    With "calibrate" set, times and the factor fill-in are fitted by the 
+    solver planner and written to that file.
+    """
+    backends = [ ("IGL", None), ("DIRECT", None), 
+                 ("CG", "JACOBI"), ("CG", "ILU"), ("CG", "MULTIGRID") ]
+    print( "%10s %10s %12s %10s %12s" % ("verts", "backend", "precond", "time s", "max diff") )
+
+    strategies = None
+    timings = {}
+    fills = []
+
+    for size in sizes:
+        Vs, Fs = sample_meshes.make_cylinder( size, size )
+        vert_inds, targets = sample_meshes.make_bend_problem( Vs )
+        free_qty = Vs.shape[0] - vert_inds.shape[0]
+        if strategies is None:
+            strategies = solver_planner.available_strategies( solver_planner.ProblemStats( Vs.shape[0] ) )
+
+        reference = None
+        for backend, preconditioner in backends:
+            t0 = time.perf_counter()
+            solver = arap_solver.get_solver( None, Vs, Fs, vert_inds, backend=backend, 
+                                             preconditioner=preconditioner, tolerance=1.0e-8 )
+            Vs_new = solver.solve( targets )
+            dt = time.perf_counter() - t0
+            arap_solver.invalidate( None )
+
+            strategy = solver_planner.strategy_name( backend, preconditioner )
+            # Multigrid falls back to Jacobi without pyamg, that is not worth a fit.
+            if strategy in strategies:
+                timings.setdefault( strategy, [] ).append( (free_qty, dt) )
+
+            if backend == "IGL":
+                reference = Vs_new
+
+            if backend == "DIRECT":
+                factor = solver.axis_systems[0].factor
+                fills.append( (solver.axis_systems[0].free_inds.shape[0], factor.L.nnz + factor.U.nnz) )
+
+            if backend == "IGL":
+                diff = "-"
+            else:
+                diff = "%.3e" % np.abs( Vs_new - reference ).max()
+
+            print( "%10d %10s %12s %10.3f %12s" % (Vs.shape[0], backend, preconditioner or "-", dt, diff) )
+
+    if calibrate is not None:
+        calibration = solver_planner.fit_calibration( timings, fills )
+        solver_planner.save_calibration( calibration, calibrate )
+        print( "fill %.2f n log2 n" % calibration["fill"] )
+        for strategy, (a, p) in calibration["time"].items():
+            print( "%14s %.3e * n^%.2f" % (strategy, a, p) )
+        print( "Calibration written to %s" % calibrate )
+
+
+
+def bench_io( sizes ):
+    """
+    Write and read times of mesh file formats. Mapped reads also touch 
+    every coordinate once, as a solve would.
+    """
+    print( "%10s %12s %10s %10s %10s" % ("verts", "format", "MB", "write s", "read s") )
+
+    formats = [ ("OBJ", ".obj", False), ("PLY", ".ply", False), ("PLY mmap", ".ply", True), 
+                ("NPZ", ".npz", False), ("NPZ mmap", ".npz", True) ]
+
+    with tempfile.TemporaryDirectory() as dir_name:
+        for size in sizes:
+            Vs, Fs = sample_meshes.make_grid( size )
+
+            for name, ext, mmap in formats:
+                file_path = os.path.join( dir_name, "mesh" + ext )
+
+                t0 = time.perf_counter()
+                mesh_io.write_mesh( file_path, Vs, Fs )
+                t_write = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                Vs_read, Fs_read = mesh_io.read_mesh( file_path, mmap )
+                Vs_read.sum()
+                Fs_read.max()
+                t_read = time.perf_counter() - t0
+                del Vs_read, Fs_read
+
+                mb = os.path.getsize( file_path ) / 1.0e6
+                print( "%10d %12s %10.2f %10.3f %10.3f" % (Vs.shape[0], name, mb, t_write, t_read) )
+
+
+
+def bench_threads( size, tasks_qty ):
+    """
+    Throughput of independent solves for worker counts from 1 to the number 
+    of cores, the cores split into threads between workers.
+    """
+    cpus = execution_config.cpu_count()
+    workers_list = sorted( set( [ 2**k for k in range( cpus.bit_length() ) if 2**k <= cpus ] + [cpus] ) )
+
+    print( "%d cores, %d solves of %d vertices" % (cpus, tasks_qty, size*size) )
+    print( "%8s %8s %10s %10s %10s" % ("workers", "threads", "wall s", "solves/s", "speedup") )
+
+    base_rate = None
+    for workers in workers_list:
+        config = execution_config.ExecutionConfig( workers )
+
+        with execution_config.process_pool( config ) as pool:
+            # Start the workers before timing.
+            list( pool.map( _warm_up, range( workers ) ) )
+
+            t0 = time.perf_counter()
+            list( pool.map( _solve_generated, [size] * tasks_qty ) )
+            dt = time.perf_counter() - t0
+
+        rate = tasks_qty / dt
+        if base_rate is None:
+            base_rate = rate
+        print( "%8d %8d %10.3f %10.2f %10.2f" % (workers, config.threads_per_worker, dt, rate, rate / base_rate) )
+
+
+
+def _warm_up( ind ):
+    return ind
+
+
+
+def _solve_generated( size ):
+    Vs, Fs = sample_meshes.make_cylinder( size, size )
+    vert_inds, targets = sample_meshes.make_bend_problem( Vs )
+    solver = arap_solver.ArapSolver( Vs, Fs, vert_inds )
+    solver.solve( targets )
+
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description="ARAP pipeline benchmarks" )
+    subparsers = parser.add_subparsers( dest="command", required=True )
+
+    precision_parser = subparsers.add_parser( "precision", help="float32 versus float64 pipeline" )
+    precision_parser.add_argument( "--sizes", type=int, nargs="+", default=[50, 100, 200] )
+
+    symmetry_parser = subparsers.add_parser( "symmetry", help="whole mesh versus half mesh solve" )
+    symmetry_parser.add_argument( "--sizes", type=int, nargs="+", default=[40, 80, 160] )
+
+    backends_parser = subparsers.add_parser( "backends", help="igl.ARAP, direct and CG global steps" )
+    backends_parser.add_argument( "--sizes", type=int, nargs="+", default=[50, 100, 200] )
+    backends_parser.add_argument( "--calibrate", nargs="?", const=solver_planner.CALIBRATION_PATH, default=None, 
+                                  help="fit the solver planner to the timings and write them (default next to the add-on)" )
+
+    io_parser = subparsers.add_parser( "io", help="mesh file formats" )
+    io_parser.add_argument( "--sizes", type=int, nargs="+", default=[100, 300, 1000] )
+
+    threads_parser = subparsers.add_parser( "threads", help="worker processes versus BLAS/OpenMP threads" )
+    threads_parser.add_argument( "--size", type=int, default=100 )
+    threads_parser.add_argument( "--tasks", type=int, default=None, help="solves per configuration (default 2 per core, at least 4)" )
+
+    args = parser.parse_args( argv )
+
+    if args.command == "precision":
+        bench_precision( args.sizes )
+
+    elif args.command == "symmetry":
+        bench_symmetry( args.sizes )
+
+    elif args.command == "backends":
+        bench_backends( args.sizes, args.calibrate )
+
+    elif args.command == "io":
+        bench_io( args.sizes )
+
+    elif args.command == "threads":
+        tasks_qty = args.tasks or max( 4, 2 * execution_config.cpu_count() )
+        bench_threads( args.size, tasks_qty )
+
+
+
+if __name__ == "__main__":
+    main()
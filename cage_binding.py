@@ -0,0 +1,162 @@
+# Carrying a deformation of a light cage mesh onto dense meshes. ARAP is
+# solved on the cage only. Every dense vertex is bound once to the closest
+# cage triangle: barycentric coordinates of its projection and its offset
+# in the triangle's local frame. Both are linear in the cage vertices and
+# the frame axes, so one sparse matrix moves all dense vertices at once.
+
+import numpy as np
+import scipy.sparse
+import scipy.spatial
+
+
+# Nearest triangles by centroid tried per vertex.
+CANDIDATES_QTY = 8
+
+
+
+class CageBinding:
+    """
+    Binding of "verts_qty" target vertices to a cage with faces "Fs".
+    Per target vertex: cage face, barycentric coordinates and offset
+    along the face frame axes (edge, in-plane normal to it, face normal).
+    """
+
+    def __init__( self, cage_verts_qty, Fs, face_inds, bary, local ):
+        self.cage_verts_qty = cage_verts_qty
+        self.Fs        = np.ascontiguousarray( Fs, dtype=np.int32 )
+        self.face_inds = face_inds.astype( np.int32 )
+        self.bary      = bary.astype( np.float32 )
+        self.local     = local.astype( np.float32 )
+        self.verts_qty = face_inds.shape[0]
+
+        # Columns: cage vertices, then three frame axes per face.
+        rows = np.repeat( np.arange( self.verts_qty, dtype=np.int32 ), 6 )
+        cols = np.empty( (self.verts_qty, 6), dtype=np.int32 )
+        cols[:, :3] = self.Fs[self.face_inds]
+        cols[:, 3:] = cage_verts_qty + 3*self.face_inds[:, None] + np.arange( 3, dtype=np.int32 )
+        weights = np.concatenate( (self.bary, self.local), axis=1 )
+        shape = (self.verts_qty, cage_verts_qty + 3*self.Fs.shape[0])
+        self.W = scipy.sparse.csr_matrix( (weights.ravel(), (rows, cols.ravel())), shape=shape )
+
+
+    def deform( self, cage_Vs ):
+        """
+        Target vertex positions for cage positions "cage_Vs".
+        """
+        frames = face_frames( cage_Vs, self.Fs )
+        stacked = np.concatenate( (cage_Vs, frames.reshape( (-1, 3) )), axis=0 )
+        return np.asarray( self.W @ stacked, dtype=cage_Vs.dtype )
+
+
+    @property
+    def nbytes( self ):
+        return self.W.data.nbytes + self.W.indices.nbytes + self.W.indptr.nbytes + \
+               self.face_inds.nbytes + self.bary.nbytes + self.local.nbytes
+
+
+
+def face_frames( Vs, Fs ):
+    """
+    (faces_qty, 3, 3) orthonormal frames, rows are the first edge direction,
+    the in-plane direction normal to it and the face normal.
+    """
+    V0 = Vs[Fs[:, 0]]
+    E1 = Vs[Fs[:, 1]] - V0
+    E2 = Vs[Fs[:, 2]] - V0
+
+    N = np.cross( E1, E2 )
+    E1 = E1 / np.maximum( np.linalg.norm( E1, axis=1 ), 1.0e-30 )[:, None]
+    N  = N  / np.maximum( np.linalg.norm( N,  axis=1 ), 1.0e-30 )[:, None]
+    T  = np.cross( N, E1 )
+
+    return np.stack( (E1, T, N), axis=1 )
+
+
+
+def bind( cage_Vs, cage_Fs, target_Vs ):
+    """
+    Binds target vertices to the closest of the cage triangles nearest to
+    them by centroid. Both meshes are in the same space, rest pose.
+    """
+    cage_Vs   = np.asarray( cage_Vs, dtype=np.float64 )
+    cage_Fs   = np.asarray( cage_Fs, dtype=np.int64 ).reshape( (-1, 3) )
+    target_Vs = np.asarray( target_Vs, dtype=np.float64 )
+
+    centroids = cage_Vs[cage_Fs].mean( axis=1 )
+    k = min( CANDIDATES_QTY, cage_Fs.shape[0] )
+    _, candidates = scipy.spatial.cKDTree( centroids ).query( target_Vs, k=k )
+    candidates = candidates.reshape( (target_Vs.shape[0], k) )
+
+    # Closest point on every candidate, keep the nearest one.
+    A = cage_Vs[cage_Fs[candidates, 0]]
+    B = cage_Vs[cage_Fs[candidates, 1]]
+    C = cage_Vs[cage_Fs[candidates, 2]]
+    P = target_Vs[:, None, :]
+    bary = closest_point_bary( P, A, B, C )
+    closest = bary[..., 0:1]*A + bary[..., 1:2]*B + bary[..., 2:3]*C
+    dists = np.einsum( 'ijk,ijk->ij', P - closest, P - closest )
+
+    best = np.argmin( dists, axis=1 )
+    rows = np.arange( target_Vs.shape[0] )
+    face_inds = candidates[rows, best]
+    bary      = bary[rows, best]
+    closest   = closest[rows, best]
+
+    frames = face_frames( cage_Vs, cage_Fs )[face_inds]
+    local = np.einsum( 'iak,ik->ia', frames, target_Vs - closest )
+
+    return CageBinding( cage_Vs.shape[0], cage_Fs, face_inds, bary, local )
+
+
+
+def closest_point_bary( P, A, B, C ):
+    """
+    Barycentric coordinates of the points of triangles (A, B, C) closest
+    to "P". All arrays broadcast, the last axis is xyz.
+    """
+    AB = B - A
+    AC = C - A
+    AP = P - A
+
+    # Projection onto the plane.
+    d00 = np.einsum( '...k,...k', AB, AB )
+    d01 = np.einsum( '...k,...k', AB, AC )
+    d11 = np.einsum( '...k,...k', AC, AC )
+    d20 = np.einsum( '...k,...k', AP, AB )
+    d21 = np.einsum( '...k,...k', AP, AC )
+    denom = d00*d11 - d01*d01
+    denom = np.where( np.abs( denom ) > 1.0e-30, denom, 1.0e-30 )
+    v = (d11*d20 - d01*d21) / denom
+    w = (d00*d21 - d01*d20) / denom
+    bary = np.stack( (1.0 - v - w, v, w), axis=-1 )
+
+    # Outside of the triangle the closest point is on one of the edges.
+    outside = np.any( bary < 0.0, axis=-1 )
+    if np.any( outside ):
+        best_bary = None
+        best_dist = None
+        for a, b, ia, ib in ((A, B, 0, 1), (B, C, 1, 2), (C, A, 2, 0)):
+            t = _segment_param( P, a, b )
+            edge_bary = np.zeros( bary.shape )
+            edge_bary[..., ia] = 1.0 - t
+            edge_bary[..., ib] = t
+            diff = P - (a + t[..., None]*(b - a))
+            dist = np.einsum( '...k,...k', diff, diff )
+            if best_bary is None:
+                best_bary, best_dist = edge_bary, dist
+            else:
+                closer = dist < best_dist
+                best_bary = np.where( closer[..., None], edge_bary, best_bary )
+                best_dist = np.where( closer, dist, best_dist )
+
+        bary = np.where( outside[..., None], best_bary, bary )
+
+    return bary
+
+
+
+def _segment_param( P, A, B ):
+    AB = B - A
+    length_sq = np.maximum( np.einsum( '...k,...k', AB, AB ), 1.0e-30 )
+    t = np.einsum( '...k,...k', P - A, AB ) / length_sq
+    return np.clip( t, 0.0, 1.0 )
@@ -0,0 +1,105 @@
+# How far a solve is from rigid, per face and per vertex. Everything is a
+# handful of whole-array NumPy operations on the rest and the solved
+# positions, cheap enough to run after every solve of a big mesh.
+
+import numpy as np
+
+
+
+def face_distortion( Vs_rest, Vs_new, Fs ):
+    """
+    Returns per face arrays (strain, residual, rest_areas).
+
+    "strain" is the largest relative change of an edge length of the face.
+    "residual" is the distance of the face deformation gradient to the closest
+    rotation, sqrt( (s1 - 1)^2 + (s2 - 1)^2 ) for its singular values s1, s2.
+    It is 0 for rigid motion, ARAP minimizes its area weighted square.
+    Faces with zero rest area get zeros.
+    """
+    Fs = np.asarray( Fs )
+    V0 = Vs_rest[Fs[:, 0]]
+    E1 = Vs_rest[Fs[:, 1]] - V0
+    E2 = Vs_rest[Fs[:, 2]] - V0
+    W0 = Vs_new[Fs[:, 0]]
+    D1 = Vs_new[Fs[:, 1]] - W0
+    D2 = Vs_new[Fs[:, 2]] - W0
+
+    rest_lengths = np.stack( (_norm( E1 ), _norm( E2 ), _norm( E2 - E1 )), axis=1 )
+    new_lengths  = np.stack( (_norm( D1 ), _norm( D2 ), _norm( D2 - D1 )), axis=1 )
+    valid_edges = rest_lengths > 0.0
+    ratios = np.divide( new_lengths, rest_lengths, out=np.ones_like( new_lengths ), where=valid_edges )
+    strain = np.abs( ratios - 1.0 ).max( axis=1 )
+
+    # Rest triangle in its own plane: E1 = (l1, 0), E2 = (a, b).
+    l1 = rest_lengths[:, 0]
+    safe_l1 = np.where( l1 > 0.0, l1, 1.0 )
+    a = _dot( E2, E1 ) / safe_l1
+    b = np.sqrt( np.maximum( rest_lengths[:, 1]**2 - a**2, 0.0 ) )
+    rest_areas = 0.5 * l1 * b
+
+    valid = rest_areas > 0.0
+    safe_b = np.where( valid, b, 1.0 )
+
+    # Columns of the 3x2 deformation gradient [D1 D2] [[l1 a] [0 b]]^-1.
+    C1 = D1 / safe_l1[:, None]
+    C2 = (D2 - (a / safe_l1)[:, None] * D1) / safe_b[:, None]
+
+    # Singular values from the eigenvalues of the 2x2 Gram matrix.
+    g11 = _dot( C1, C1 )
+    g12 = _dot( C1, C2 )
+    g22 = _dot( C2, C2 )
+    half_trace = 0.5 * (g11 + g22)
+    root = np.sqrt( np.maximum( half_trace**2 - (g11*g22 - g12**2), 0.0 ) )
+    s1 = np.sqrt( half_trace + root )
+    s2 = np.sqrt( np.maximum( half_trace - root, 0.0 ) )
+    residual = np.sqrt( (s1 - 1.0)**2 + (s2 - 1.0)**2 )
+
+    strain[~valid]   = 0.0
+    residual[~valid] = 0.0
+
+    return (strain, residual, rest_areas)
+
+
+
+def vertex_values( face_values, Fs, rest_areas, verts_qty ):
+    """
+    Per vertex averages of per face values weighted by face area.
+    Vertices in no face get 0.
+    """
+    corners = np.asarray( Fs ).ravel()
+    weights = np.repeat( rest_areas, 3 )
+    sums  = np.bincount( corners, weights=np.repeat( face_values * rest_areas, 3 ), minlength=verts_qty )
+    total = np.bincount( corners, weights=weights, minlength=verts_qty )
+
+    return np.divide( sums, total, out=np.zeros( verts_qty ), where=total > 0.0 )
+
+
+
+def summarize( face_values, rest_areas ):
+    """
+    Area weighted mean, 95th percentile over faces and maximum as a dictionary.
+    """
+    if face_values.shape[0] == 0:
+        return { "mean": 0.0, "p95": 0.0, "max": 0.0 }
+
+    total_area = rest_areas.sum()
+    if total_area > 0.0:
+        mean = float( np.dot( face_values, rest_areas ) / total_area )
+    else:
+        mean = float( face_values.mean() )
+
+    # Partial sort, no need to sort a million values for one of them.
+    k = int( 0.95 * (face_values.shape[0] - 1) )
+    p95 = float( np.partition( face_values, k )[k] )
+
+    return { "mean": mean, "p95": p95, "max": float( face_values.max() ) }
+
+
+
+def _norm( V ):
+    return np.sqrt( _dot( V, V ) )
+
+
+
+def _dot( A, B ):
+    return np.einsum( 'ij,ij->i', A, B )
@@ -0,0 +1,153 @@
+# Worker processes and native thread pools decided in one place.
+# NumPy's BLAS, SciPy and libigl's OpenMP each start a thread per core in
+# every process. With several worker processes that is cores times cores
+# threads fighting for the cores, so each worker gets cores / workers
+# threads instead, and a single solve in Blender gets all of them.
+
+import contextlib
+import os
+
+
+# Read by OpenMP, OpenBLAS, MKL, BLIS, Accelerate and numexpr when they load.
+THREAD_ENV_VARS = ( "OMP_NUM_THREADS",
+                    "OPENBLAS_NUM_THREADS",
+                    "MKL_NUM_THREADS",
+                    "BLIS_NUM_THREADS",
+                    "VECLIB_MAXIMUM_THREADS",
+                    "NUMEXPR_NUM_THREADS" )
+
+
+
+def cpu_count():
+    """
+    Cores this process may run on, respecting affinity masks of job schedulers.
+    """
+    try:
+        return len( os.sched_getaffinity( 0 ) )
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+
+class ExecutionConfig:
+    """
+    "workers" processes with "threads_per_worker" native threads each.
+    """
+
+    def __init__( self, workers=1, threads_per_worker=None ):
+        self.workers = max( 1, int( workers ) )
+        if not threads_per_worker:
+            threads_per_worker = max( 1, cpu_count() // self.workers )
+        self.threads_per_worker = int( threads_per_worker )
+
+
+    def __repr__( self ):
+        return "ExecutionConfig(workers=%d, threads_per_worker=%d)" % (self.workers, self.threads_per_worker)
+
+
+
+def auto_config( tasks_qty=1, workers=None, threads=None ):
+    """
+    Configuration for "tasks_qty" independent solves: a worker per core up
+    to the number of tasks, cores left over become threads of the workers.
+    Explicit "workers" and "threads" win, None or 0 means automatic.
+    """
+    if not workers:
+        workers = max( 1, min( tasks_qty, cpu_count() ) )
+
+    return ExecutionConfig( workers, threads )
+
+
+
+def thread_environment( threads ):
+    return { name: str( threads ) for name in THREAD_ENV_VARS }
+
+
+
+@contextlib.contextmanager
+def thread_env( threads ):
+    """
+    Thread limits in os.environ for the duration of the block. Processes
+    started meanwhile inherit them and their libraries load already limited.
+    """
+    saved = { name: os.environ.get( name, None ) for name in THREAD_ENV_VARS }
+    os.environ.update( thread_environment( threads ) )
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop( name, None )
+            else:
+                os.environ[name] = value
+
+
+
+def can_limit_threads():
+    """
+    True if thread pools of loaded libraries can be limited, which needs
+    threadpoolctl. Without it only processes started later are limited.
+    """
+    try:
+        import threadpoolctl
+    except ImportError:
+        return False
+
+    return True
+
+
+
+@contextlib.contextmanager
+def limit_threads( threads ):
+    """
+    Limits thread pools of libraries already loaded in this process for the
+    duration of the block. Needs the optional threadpoolctl package, without
+    it libraries keep the pools they started with.
+    """
+    try:
+        import threadpoolctl
+    except ImportError:
+        threadpoolctl = None
+
+    if threadpoolctl is None:
+        yield
+        return
+
+    with threadpoolctl.threadpool_limits( limits=threads ):
+        yield
+
+
+
+def init_worker( threads ):
+    """
+    ProcessPoolExecutor initializer, catches libraries the worker loaded
+    before the environment could matter.
+    """
+    os.environ.update( thread_environment( threads ) )
+
+    try:
+        import threadpoolctl
+    except ImportError:
+        return
+
+    threadpoolctl.threadpool_limits( limits=threads )
+
+
+
+@contextlib.contextmanager
+def process_pool( config ):
+    """
+    ProcessPoolExecutor with "config.workers" spawned workers limited to
+    "config.threads_per_worker" threads each. "spawn" doesn't depend on the
+    state of the parent, which may be Blender. The executor starts workers
+    on demand, so the limits stay in the environment while it is open.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    context = multiprocessing.get_context( "spawn" )
+    with thread_env( config.threads_per_worker ):
+        with ProcessPoolExecutor( max_workers=config.workers, mp_context=context,
+                                  initializer=init_worker,
+                                  initargs=(config.threads_per_worker,) ) as pool:
+            yield pool
@@ -30,6 +30,8 @@ def install_needed_packages():
     subprocess.call([python_exe, '-m', 'pip', 'install', '--upgrade', 'numpy', '-t', target])
     subprocess.call([python_exe, '-m', 'pip', 'install', '--upgrade', 'scipy', '-t', target])
     subprocess.call([python_exe, '-m', 'pip', 'install', '--upgrade', 'libigl', '-t', target])
+    # Optional, lets the Threads setting limit native thread pools of solves in Blender.
+    subprocess.call([python_exe, '-m', 'pip', 'install', '--upgrade', 'threadpoolctl', '-t', target])
      
     print('DONE')
 
@@ -0,0 +1,536 @@
+# Reading and writing mesh data files without Blender.
+
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+
+
+def write_pc2( file_path, frames, start_frame=0.0, sample_rate=1.0 ):
+    """
+    Write point cache in PC2 format which is read by Blender "Mesh Cache" modifier.
+    "frames" is a (frames_qty, verts_qty, 3) array of object space vertex coordinates.
+    """
+    frames = np.ascontiguousarray( frames, dtype='<f4' )
+    frames_qty, verts_qty, _ = frames.shape
+
+    with open( file_path, 'wb' ) as f:
+        f.write( b'POINTCACHE2\0' )
+        np.array( [1, verts_qty], dtype='<i4' ).tofile( f )
+        np.array( [start_frame, sample_rate], dtype='<f4' ).tofile( f )
+        np.array( [frames_qty], dtype='<i4' ).tofile( f )
+        frames.tofile( f )
+
+
+
+def read_pc2( file_path ):
+    """
+    Returns (frames, start_frame, sample_rate), "frames" is a
+    (frames_qty, verts_qty, 3) float32 array.
+    """
+    with open( file_path, 'rb' ) as f:
+        signature = f.read( 12 )
+        if signature != b'POINTCACHE2\0':
+            raise ValueError( "Not a PC2 file: " + str(file_path) )
+
+        version, verts_qty = np.fromfile( f, dtype='<i4', count=2 )
+        start_frame, sample_rate = np.fromfile( f, dtype='<f4', count=2 )
+        frames_qty = int( np.fromfile( f, dtype='<i4', count=1 )[0] )
+
+        frames = np.fromfile( f, dtype='<f4', count=frames_qty*verts_qty*3 )
+
+    frames = frames.reshape( (frames_qty, verts_qty, 3) )
+    return (frames, float(start_frame), float(sample_rate))
+
+
+
+
+
+def read_mesh( file_path, mmap=False ):
+    """
+    Reads (Vs, Fs) from an OBJ, PLY or NPZ file. Polygons are triangulated as fans.
+    With "mmap" binary PLY and NPZ arrays are memory mapped when their layout allows,
+    only the pages touched are read.
+    """
+    ext = os.path.splitext( file_path )[1].lower()
+    if ext == '.obj':
+        return read_obj( file_path )
+
+    if ext == '.ply':
+        return read_ply( file_path, mmap )
+
+    if ext == '.npz':
+        return read_npz( file_path, mmap )
+
+    raise ValueError( "Unsupported mesh file: " + str(file_path) )
+
+
+
+def write_mesh( file_path, Vs, Fs ):
+    """
+    Writes (Vs, Fs) to an OBJ, PLY or NPZ file. PLY files are binary.
+    """
+    ext = os.path.splitext( file_path )[1].lower()
+    if ext == '.obj':
+        return write_obj( file_path, Vs, Fs )
+
+    if ext == '.ply':
+        return write_ply( file_path, Vs, Fs )
+
+    if ext == '.npz':
+        return write_npz( file_path, Vs, Fs )
+
+    raise ValueError( "Unsupported mesh file: " + str(file_path) )
+
+
+
+def fan_triangulate( corner_verts, starts, counts ):
+    """
+    Triangles of polygons as (faces_qty, 3) int32 array. Polygon i has
+    vertices corner_verts[starts[i]:starts[i]+counts[i]] and is split
+    into triangles (0, 1, 2), (0, 2, 3), ...
+    """
+    # A polygon with n corners gives n-2 triangles.
+    tris_per_poly = np.maximum( counts - 2, 0 )
+    poly_inds = np.repeat( np.arange( len(counts) ), tris_per_poly )
+    first_tri_inds = np.cumsum( tris_per_poly ) - tris_per_poly
+    # Index of the triangle within its polygon.
+    corner_inds = np.arange( poly_inds.shape[0] ) - first_tri_inds[poly_inds]
+
+    starts = starts[poly_inds]
+    Fs = np.stack( (corner_verts[starts], 
+                    corner_verts[starts + corner_inds + 1], 
+                    corner_verts[starts + corner_inds + 2]), axis=1 )
+
+    return Fs.astype( np.int32 )
+
+
+
+def read_landmarks( file_path ):
+    """
+    Vertex index to target position correspondences. Returns (vert_inds, targets) 
+    with an int64 (K,) and a float64 (K, 3) array.
+
+    NPZ files hold "anchor_inds" and "targets" arrays. JSON files hold the same 
+    two lists or a list of {"vert_ind": i, "target": [x, y, z]} items. 
+    CSV and text files have "vert_ind, x, y, z" rows and may have a header.
+    """
+    ext = os.path.splitext( file_path )[1].lower()
+    if ext == '.npz':
+        with np.load( file_path ) as data:
+            vert_inds, targets = data["anchor_inds"], data["targets"]
+
+    elif ext == '.json':
+        with open( file_path, 'r' ) as f:
+            data = json.load( f )
+
+        if isinstance( data, list ):
+            vert_inds = [ item["vert_ind"] for item in data ]
+            targets   = [ item["target"] for item in data ]
+        else:
+            vert_inds, targets = data["anchor_inds"], data["targets"]
+
+    elif ext in ('.csv', '.txt'):
+        delimiter = ',' if (ext == '.csv') else None
+        with open( file_path, 'r' ) as f:
+            first_line = f.readline()
+        # Skip a header made of column names.
+        has_header = any( c.isalpha() for c in first_line )
+        data = np.loadtxt( file_path, delimiter=delimiter, skiprows=1 if has_header else 0, ndmin=2 )
+        vert_inds, targets = data[:, 0], data[:, 1:4]
+
+    else:
+        raise ValueError( "Unsupported landmark file: " + str(file_path) )
+
+    vert_inds = np.asarray( vert_inds ).astype( np.int64 ).ravel()
+    targets   = np.asarray( targets, dtype=np.float64 ).reshape( (-1, 3) )
+    if vert_inds.shape[0] != targets.shape[0]:
+        raise ValueError( "%d vertex indices but %d targets: %s" % (vert_inds.shape[0], targets.shape[0], file_path) )
+
+    return (vert_inds, targets)
+
+
+
+def read_obj( file_path ):
+    """
+    Vertex positions and faces of an OBJ file. Texture coordinates, 
+    normals, groups and materials are ignored.
+    """
+    verts = []
+    faces = []
+
+    with open( file_path, 'r' ) as f:
+        for line in f:
+            if line.startswith( 'v ' ):
+                verts.append( line.split()[1:4] )
+
+            elif line.startswith( 'f ' ):
+                corners = [ int( token.split( '/' )[0] ) for token in line.split()[1:] ]
+                # Negative indices are relative to the end of the vertex list so far.
+                corners = [ (c - 1) if (c > 0) else (len(verts) + c) for c in corners ]
+                for k in range( 1, len(corners)-1 ):
+                    faces.append( (corners[0], corners[k], corners[k+1]) )
+
+    Vs = np.array( verts, dtype=np.float64 ).reshape( (-1, 3) )
+    Fs = np.array( faces, dtype=np.int32 ).reshape( (-1, 3) )
+    return (Vs, Fs)
+
+
+
+def write_obj( file_path, Vs, Fs ):
+    with open( file_path, 'w' ) as f:
+        np.savetxt( f, Vs, fmt='v %.9g %.9g %.9g' )
+        np.savetxt( f, np.asarray( Fs ) + 1, fmt='f %d %d %d' )
+
+
+
+def read_ply( file_path, mmap=False ):
+    """
+    Vertex positions and faces of an ASCII or binary PLY file.
+    """
+    with open( file_path, 'rb' ) as f:
+        header = _read_ply_header( f )
+        if header.format == 'ascii':
+            return _read_ply_ascii( f, header )
+
+    if header.format not in ('binary_little_endian', 'binary_big_endian'):
+        raise ValueError( "Unknown PLY format \"%s\": %s" % (header.format, file_path) )
+
+    return _read_ply_binary( file_path, header, mmap )
+
+
+
+def _read_ply_ascii( f, header ):
+    lines = f.read().decode( 'ascii' ).split( '\n' )
+
+    Vs = None
+    Fs = np.zeros( (0, 3), dtype=np.int32 )
+    line_ind = 0
+    for element in header.elements:
+        rows = lines[line_ind:line_ind+element.count]
+        line_ind += element.count
+
+        if element.name == 'vertex':
+            values = np.array( ' '.join( rows ).split(), dtype=np.float64 )
+            values = values.reshape( (element.count, -1) )
+            Vs = values[:, element.property_inds( ('x', 'y', 'z') )]
+
+        elif element.name == 'face':
+            faces = []
+            for row in rows:
+                values = row.split()
+                corners_qty = int( values[0] )
+                corners = [ int(v) for v in values[1:1+corners_qty] ]
+                for k in range( 1, corners_qty-1 ):
+                    faces.append( (corners[0], corners[k], corners[k+1]) )
+            Fs = np.array( faces, dtype=np.int32 ).reshape( (-1, 3) )
+
+    return (Vs, Fs)
+
+
+
+def _read_ply_binary( file_path, header, mmap ):
+    byte_order = '<' if (header.format == 'binary_little_endian') else '>'
+    file_size = os.path.getsize( file_path )
+
+    Vs = None
+    Fs = np.zeros( (0, 3), dtype=np.int32 )
+    offset = header.data_offset
+    for element in header.elements:
+        if element.name == 'face':
+            Fs, offset = _read_ply_faces( file_path, element, byte_order, offset, file_size, mmap )
+            continue
+
+        dtype = element.record_dtype( byte_order )
+        if element.name == 'vertex':
+            records = _read_records( file_path, dtype, offset, element.count, mmap )
+            # A view if x, y, z have the same type and are evenly spaced.
+            Vs = structured_to_unstructured( records[['x', 'y', 'z']] )
+        offset += dtype.itemsize * element.count
+
+    return (Vs, Fs)
+
+
+
+def _read_ply_faces( file_path, element, byte_order, offset, file_size, mmap ):
+    """
+    Returns (Fs, offset after the element).
+    """
+    list_inds = [ i for i, p in enumerate( element.properties ) if isinstance( p[1], tuple ) ]
+    if len(list_inds) != 1:
+        raise ValueError( "Faces need exactly one list property: " + str(file_path) )
+    list_ind = list_inds[0]
+    count_type, item_type = element.properties[list_ind][1]
+    count_dtype = np.dtype( byte_order + PLY_TYPES[count_type] )
+    item_dtype  = np.dtype( byte_order + PLY_TYPES[item_type] )
+
+    before = element.properties[:list_ind]
+    after  = element.properties[list_ind+1:]
+    before_size = sum( np.dtype( PLY_TYPES[p[1]] ).itemsize for p in before )
+    after_size  = sum( np.dtype( PLY_TYPES[p[1]] ).itemsize for p in after )
+
+    if element.count == 0:
+        return (np.zeros( (0, 3), dtype=np.int32 ), offset)
+
+    # Usually every face has the same number of corners. Then faces are 
+    # fixed size records which can be mapped.
+    corners_qty = int( np.fromfile( file_path, dtype=count_dtype, count=1, offset=offset+before_size )[0] )
+    fields = [ ('before', 'V%d' % before_size), 
+               ('qty', count_dtype), 
+               ('corners', item_dtype, (corners_qty,)), 
+               ('after', 'V%d' % after_size) ]
+    dtype = np.dtype( [ field for field in fields if field[1] != 'V0' ] )
+
+    if offset + dtype.itemsize * element.count <= file_size:
+        # Counts are checked on a map, a mixed file is not read as records first.
+        records = _read_records( file_path, dtype, offset, element.count, True )
+        if np.all( records['qty'] == corners_qty ):
+            if not mmap:
+                records = np.array( records )
+            corners = records['corners']
+            if corners_qty == 3:
+                Fs = corners.astype( np.int32, copy=False )
+            else:
+                qty = element.count
+                starts = np.arange( qty ) * corners_qty
+                counts = np.full( qty, corners_qty )
+                Fs = fan_triangulate( corners.reshape( -1 ), starts, counts )
+            return (Fs, offset + dtype.itemsize * element.count)
+        del records
+
+    # Mixed polygons. Where a record starts depends on the corner counts of 
+    # all records before it. Within a chunk every byte is taken as a possible 
+    # record start and linked to where the next record would begin, the 
+    # records are the chain of links from the first one.
+    import scipy.sparse
+    import scipy.sparse.csgraph
+
+    if mmap:
+        data = np.memmap( file_path, dtype=np.uint8, mode='r', offset=offset )
+    else:
+        data = np.fromfile( file_path, dtype=np.uint8, offset=offset )
+
+    header_size = before_size + count_dtype.itemsize + after_size
+    item_size = item_dtype.itemsize
+    # Last byte a record header fits after.
+    last_start = data.shape[0] - header_size
+
+    Fs_parts = []
+    pos = 0
+    faces_left = element.count
+    while faces_left > 0:
+        chunk_end = min( pos + PLY_FACES_CHUNK_SIZE, last_start + 1 )
+        if chunk_end <= pos:
+            raise ValueError( "PLY faces end early: " + str(file_path) )
+
+        starts_qty = chunk_end - pos
+        counts = np.ndarray( (starts_qty,), dtype=count_dtype, buffer=data, 
+                             offset=pos+before_size, strides=(1,) )
+        counts = np.maximum( counts.astype( np.int64 ), 0 )
+        next_starts = np.arange( starts_qty ) + header_size + counts * item_size
+        linked = next_starts < starts_qty
+        indptr = np.zeros( starts_qty + 1, dtype=np.int64 )
+        np.cumsum( linked, out=indptr[1:] )
+        links = scipy.sparse.csr_matrix( (np.ones( indptr[-1], dtype=np.int8 ), next_starts[linked], indptr), 
+                                         shape=(starts_qty, starts_qty) )
+        # Every byte links to at most one other, so breadth first is chain order.
+        chain = scipy.sparse.csgraph.breadth_first_order( links, 0, return_predecessors=False )
+        chain = chain[:faces_left]
+
+        counts = counts[chain]
+        starts = pos + chain
+        pos += int( next_starts[chain[-1]] )
+        if pos > data.shape[0]:
+            raise ValueError( "PLY faces end early: " + str(file_path) )
+        faces_left -= chain.shape[0]
+
+        # Corners of faces with the same count are a strided view at their starts.
+        corner_starts = np.cumsum( counts ) - counts
+        corner_verts = np.empty( int( counts.sum() ), dtype=item_dtype )
+        for corners_qty in np.unique( counts ):
+            corners_qty = int( corners_qty )
+            sel = np.flatnonzero( counts == corners_qty )
+            corners = np.ndarray( (data.shape[0] - corners_qty * item_size + 1, corners_qty), dtype=item_dtype, 
+                                  buffer=data, strides=(1, item_size) )
+            corners = corners[starts[sel] + before_size + count_dtype.itemsize]
+            corner_verts[(corner_starts[sel, None] + np.arange( corners_qty )).ravel()] = corners.ravel()
+
+        Fs_parts.append( fan_triangulate( corner_verts, corner_starts, counts ) )
+
+    Fs = np.concatenate( Fs_parts )
+    return (Fs, offset + pos)
+
+
+
+def _read_records( file_path, dtype, offset, count, mmap ):
+    if mmap:
+        return np.memmap( file_path, dtype=dtype, mode='r', offset=offset, shape=(count,) )
+
+    return np.fromfile( file_path, dtype=dtype, count=count, offset=offset )
+
+
+
+def write_ply( file_path, Vs, Fs, binary=True ):
+    """
+    Writes a binary little endian or an ASCII PLY file.
+    Binary files keep float64 positions as double.
+    """
+    Vs = np.asarray( Vs )
+    Fs = np.asarray( Fs )
+    double = binary and (Vs.dtype == np.float64)
+    coord_type = 'double' if double else 'float'
+
+    header = "ply\nformat %s 1.0\n" % ('binary_little_endian' if binary else 'ascii')
+    header += "element vertex %d\n" % len(Vs)
+    header += "property %s x\nproperty %s y\nproperty %s z\n" % (coord_type, coord_type, coord_type)
+    header += "element face %d\n" % len(Fs)
+    header += "property list uchar int vertex_indices\n"
+    header += "end_header\n"
+
+    if not binary:
+        with open( file_path, 'w' ) as f:
+            f.write( header )
+            np.savetxt( f, Vs, fmt='%.9g %.9g %.9g' )
+            np.savetxt( f, Fs, fmt='3 %d %d %d' )
+        return
+
+    faces = np.empty( len(Fs), dtype=[ ('qty', 'u1'), ('corners', '<i4', (3,)) ] )
+    faces['qty'] = 3
+    faces['corners'] = Fs
+
+    with open( file_path, 'wb' ) as f:
+        f.write( header.encode( 'ascii' ) )
+        np.ascontiguousarray( Vs, dtype='<f8' if double else '<f4' ).tofile( f )
+        faces.tofile( f )
+
+
+
+def write_npz( file_path, Vs, Fs ):
+    """
+    Stores "Vs" and "Fs" uncompressed, so that read_npz() can map them.
+    """
+    np.savez( file_path, Vs=np.ascontiguousarray( Vs ), Fs=np.ascontiguousarray( Fs, dtype=np.int32 ) )
+
+
+
+def read_npz( file_path, mmap=False ):
+    """
+    Returns (Vs, Fs) written by write_npz(). np.load() can't map arrays inside
+    an archive, but uncompressed members are stored as is, so with "mmap"
+    they are mapped directly at their offsets in the file.
+    """
+    if not mmap:
+        with np.load( file_path ) as data:
+            return (data["Vs"], data["Fs"])
+
+    return (_map_npz_member( file_path, "Vs" ), _map_npz_member( file_path, "Fs" ))
+
+
+
+def _map_npz_member( file_path, name ):
+    with zipfile.ZipFile( file_path ) as archive:
+        info = archive.getinfo( name + ".npy" )
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError( "Compressed member \"%s\" can't be mapped: %s" % (name, file_path) )
+
+    with open( file_path, 'rb' ) as f:
+        # Local file header: 30 bytes, then the file name and the extra field.
+        f.seek( info.header_offset )
+        local_header = f.read( 30 )
+        name_len, extra_len = struct.unpack( '<HH', local_header[26:30] )
+        f.seek( info.header_offset + 30 + name_len + extra_len )
+
+        version = np.lib.format.read_magic( f )
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0( f )
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0( f )
+        offset = f.tell()
+
+    return np.memmap( file_path, dtype=dtype, mode='r', offset=offset, shape=shape, 
+                      order='F' if fortran_order else 'C' )
+
+
+
+# PLY property types as NumPy type codes.
+PLY_TYPES = { 'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1', 
+              'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2', 
+              'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4', 
+              'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8' }
+
+# Bytes of mixed polygon faces scanned at once, temporaries are about 40 times that.
+PLY_FACES_CHUNK_SIZE = 1 << 20
+
+
+
+class PlyElement:
+    def __init__( self, name, count ):
+        self.name  = name
+        self.count = count
+        # (name, type) for scalar properties, (name, (count type, item type)) for lists.
+        self.properties = []
+
+
+    def property_inds( self, names ):
+        prop_names = [ p[0] for p in self.properties ]
+        return [ prop_names.index( name ) for name in names ]
+
+
+    def record_dtype( self, byte_order ):
+        """
+        NumPy dtype of one binary record, only for elements without lists.
+        """
+        fields = []
+        for name, prop_type in self.properties:
+            if isinstance( prop_type, tuple ):
+                raise ValueError( "Element \"%s\" has variable size records" % self.name )
+            fields.append( (name, byte_order + PLY_TYPES[prop_type]) )
+
+        return np.dtype( fields )
+
+
+
+class PlyHeader:
+    def __init__( self ):
+        self.format   = None
+        self.elements = []
+        # Where the data begins in the file.
+        self.data_offset = 0
+
+
+
+def _read_ply_header( f ):
+    if f.readline().strip() != b'ply':
+        raise ValueError( "Not a PLY file" )
+
+    header = PlyHeader()
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError( "Unexpected end of PLY header" )
+
+        tokens = line.decode( 'ascii' ).split()
+        if len(tokens) == 0:
+            continue
+
+        if tokens[0] == 'end_header':
+            header.data_offset = f.tell()
+            break
+
+        if tokens[0] == 'format':
+            header.format = tokens[1]
+
+        elif tokens[0] == 'element':
+            header.elements.append( PlyElement( tokens[1], int( tokens[2] ) ) )
+
+        elif tokens[0] == 'property':
+            if tokens[1] == 'list':
+                header.elements[-1].properties.append( (tokens[4], (tokens[2], tokens[3])) )
+            else:
+                header.elements[-1].properties.append( (tokens[2], tokens[1]) )
+
+    return header
@@ -0,0 +1,373 @@
+# Connectivity of a triangle mesh in compressed sparse row form, built once
+# from the face array and shared by everything which needs neighbours:
+# island labelling, k-ring expansion, Laplacian assembly, mirror mapping.
+# Welding merges coincident vertices split by UV or normal seams, so that
+# the solver sees one connected surface instead of pseudo-islands.
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+
+
+class MeshTopology:
+    """
+    Vertex adjacency and vertex to face incidence of (verts_qty, Fs).
+    Neighbours of vertex i are adj_indices[adj_indptr[i]:adj_indptr[i+1]],
+    faces containing it are face_indices[face_indptr[i]:face_indptr[i+1]].
+    Parts are built on first use.
+    """
+
+    def __init__( self, Fs, verts_qty ):
+        self.Fs = np.ascontiguousarray( Fs, dtype=np.int32 ).reshape( (-1, 3) )
+        self.verts_qty = verts_qty
+        self._adjacency  = None
+        self._vert_faces = None
+        self._islands    = None
+
+
+    @property
+    def adjacency( self ):
+        """
+        Symmetric CSR matrix with a 1 for every mesh edge.
+        """
+        if self._adjacency is None:
+            Fs = self.Fs
+            edge_i = Fs.ravel()
+            edge_j = Fs[:, [1, 2, 0]].ravel()
+            rows = np.concatenate( (edge_i, edge_j) )
+            cols = np.concatenate( (edge_j, edge_i) )
+            ones = np.ones( rows.shape[0], dtype=np.int8 )
+            A = scipy.sparse.csr_matrix( (ones, (rows, cols)), shape=(self.verts_qty, self.verts_qty) )
+            # Edges shared by two faces were summed.
+            A.data[:] = 1
+            self._adjacency = A
+
+        return self._adjacency
+
+
+    @property
+    def adj_indptr( self ):
+        return self.adjacency.indptr
+
+
+    @property
+    def adj_indices( self ):
+        return self.adjacency.indices
+
+
+    @property
+    def vert_faces( self ):
+        """
+        CSR matrix with a 1 at (vertex, face) for every face corner.
+        """
+        if self._vert_faces is None:
+            faces_qty = self.Fs.shape[0]
+            rows = self.Fs.ravel()
+            cols = np.repeat( np.arange( faces_qty, dtype=np.int32 ), 3 )
+            ones = np.ones( rows.shape[0], dtype=np.int8 )
+            self._vert_faces = scipy.sparse.csr_matrix( (ones, (rows, cols)), shape=(self.verts_qty, faces_qty) )
+
+        return self._vert_faces
+
+
+    @property
+    def face_indptr( self ):
+        return self.vert_faces.indptr
+
+
+    @property
+    def face_indices( self ):
+        return self.vert_faces.indices
+
+
+    def edges( self ):
+        """
+        Unique undirected edges as (edges_qty, 2) array with i < j.
+        """
+        A = scipy.sparse.triu( self.adjacency, k=1 ).tocoo()
+        return np.stack( (A.row, A.col), axis=1 )
+
+
+    def degrees( self ):
+        return np.diff( self.adj_indptr )
+
+
+    def loose_inds( self ):
+        """
+        Vertices which are in no face.
+        """
+        return np.flatnonzero( np.diff( self.face_indptr ) == 0 )
+
+
+    def island_labels( self ):
+        """
+        Returns (islands_qty, island index per vertex). Vertices in no face are
+        islands of their own.
+        """
+        if self._islands is None:
+            islands_qty, labels = scipy.sparse.csgraph.connected_components( self.adjacency, directed=False )
+            self._islands = (islands_qty, labels.astype( np.int32 ))
+
+        return self._islands
+
+
+    def k_ring( self, vert_inds, k ):
+        """
+        Sorted indices of vertices at most "k" edges away from "vert_inds".
+        """
+        selected = np.zeros( self.verts_qty, dtype=bool )
+        selected[np.asarray( vert_inds, dtype=np.int64 )] = True
+        front = selected.copy()
+
+        A = self.adjacency
+        for ring in range( k ):
+            # Neighbours of the last ring which aren't selected yet.
+            front = (A @ front.astype( np.int8 )).astype( bool ) & ~selected
+            if not front.any():
+                break
+            selected |= front
+
+        return np.flatnonzero( selected )
+
+
+    def cotangent_laplacian( self, Vs ):
+        """
+        Positive semi-definite cotangent Laplacian of the mesh with positions "Vs".
+        """
+        edge_i, edge_j, edge_w = face_edge_weights( Vs, self.Fs )
+        return laplacian( self.verts_qty, edge_i, edge_j, edge_w )
+
+
+    def uniform_laplacian( self ):
+        """
+        Graph Laplacian D - A, doesn't depend on positions.
+        """
+        A = self.adjacency.astype( np.float64 )
+        return scipy.sparse.diags( np.asarray( A.sum( axis=1 ) ).ravel() ) - A
+
+
+    def mirror_map( self, Vs, axis, tolerance=1.0e-4 ):
+        """
+        Mirror vertex per vertex with respect to the plane "axis" = 0 or None.
+        Positions have to match within "tolerance", the map has to be its own
+        inverse and take connected vertices to connected ones. Triangulated 
+        quads may mirror to the other diagonal, so an edge may also map to 
+        two vertices with a common neighbour.
+        """
+        mirror_inds = find_mirror_map( Vs, axis, tolerance )
+        if mirror_inds is None:
+            return None
+
+        if not np.array_equal( mirror_inds[mirror_inds], np.arange( self.verts_qty ) ):
+            return None
+
+        edges = self.edges()
+        if edges.shape[0] == 0:
+            return mirror_inds
+
+        A = self.adjacency
+        inds_i = mirror_inds[edges[:, 0]]
+        inds_j = mirror_inds[edges[:, 1]]
+        connected = np.asarray( A[inds_i, inds_j] ).ravel() > 0
+
+        inds_i, inds_j = inds_i[~connected], inds_j[~connected]
+        if inds_i.shape[0] > 0:
+            common = np.asarray( A[inds_i].multiply( A[inds_j] ).sum( axis=1 ) ).ravel()
+            if np.any( common == 0 ):
+                return None
+
+        return mirror_inds
+
+
+
+def face_edge_weights( Vs, Fs ):
+    """
+    For every face edge returns its vertex indices (i, j) and half of 
+    the cotangent of the angle opposite to it.
+    """
+    Vs = np.asarray( Vs, dtype=np.float64 )
+    edge_i = []
+    edge_j = []
+    edge_w = []
+    for k in range(3):
+        i = Fs[:, (k+1) % 3]
+        j = Fs[:, (k+2) % 3]
+        o = Fs[:, k]
+        u = Vs[i] - Vs[o]
+        v = Vs[j] - Vs[o]
+        cross = np.linalg.norm( np.cross( u, v ), axis=1 )
+        dot = np.einsum( 'ij,ij->i', u, v )
+        # Degenerate faces don't contribute.
+        cot = np.divide( dot, cross, out=np.zeros_like( dot ), where=(cross > 1.0e-20) )
+        edge_i.append( i )
+        edge_j.append( j )
+        edge_w.append( 0.5*cot )
+
+    return (np.concatenate( edge_i ), np.concatenate( edge_j ), np.concatenate( edge_w ))
+
+
+
+def laplacian( verts_qty, edge_i, edge_j, edge_w ):
+    """
+    Positive semi-definite cotangent Laplacian assembled from face edges.
+    """
+    rows = np.concatenate( (edge_i, edge_j, edge_i, edge_j) )
+    cols = np.concatenate( (edge_j, edge_i, edge_i, edge_j) )
+    vals = np.concatenate( (-edge_w, -edge_w, edge_w, edge_w) )
+    L = scipy.sparse.csr_matrix( (vals, (rows, cols)), shape=(verts_qty, verts_qty) )
+    return L
+
+
+
+def find_mirror_map( Vs, axis, tolerance=1.0e-4 ):
+    """
+    For every vertex finds the vertex closest to its mirror image with respect to 
+    the plane "axis" = 0. "tolerance" is relative to the bounding box diagonal.
+    Returns an int32 array or None if the mesh isn't mirror symmetric.
+    """
+    import scipy.spatial
+
+    Vs = np.asarray( Vs, dtype=np.float64 )
+    if Vs.shape[0] == 0:
+        return None
+
+    diagonal = np.linalg.norm( Vs.max( axis=0 ) - Vs.min( axis=0 ) )
+    max_dist = tolerance * max( diagonal, 1.0e-12 )
+
+    mirrored = Vs.copy()
+    mirrored[:, axis] = -mirrored[:, axis]
+
+    tree = scipy.spatial.cKDTree( Vs )
+    dists, mirror_inds = tree.query( mirrored, k=1 )
+    if np.any( dists > max_dist ):
+        return None
+
+    return mirror_inds.astype( np.int32 )
+
+
+
+class WeldMap:
+    """
+    Correspondence between a mesh and its welded copy used for solving.
+    Welded vertex k stands for all original vertices i with weld_map[i] == k,
+    rep_inds[k] is the first of them.
+    """
+
+    def __init__( self, weld_map, rep_inds, Fs ):
+        self.weld_map = weld_map
+        self.rep_inds = rep_inds
+        self.verts_qty = rep_inds.shape[0]
+
+        # Faces collapsed by welding are dropped.
+        Fs_welded = weld_map[Fs]
+        collapsed = (Fs_welded[:, 0] == Fs_welded[:, 1]) | \
+                    (Fs_welded[:, 1] == Fs_welded[:, 2]) | \
+                    (Fs_welded[:, 2] == Fs_welded[:, 0])
+        self.Fs = Fs_welded[~collapsed].astype( np.int32 )
+        self.topology = MeshTopology( self.Fs, self.verts_qty )
+
+
+    def weld_positions( self, Vs ):
+        return Vs[self.rep_inds]
+
+
+    def unweld_positions( self, Vs_welded ):
+        """
+        Original vertices take positions of their welded vertex.
+        Works for (..., verts_qty, 3) arrays, for example baked frames.
+        """
+        return Vs_welded[..., self.weld_map, :]
+
+
+    def weld_inds( self, vert_inds ):
+        return self.weld_map[np.asarray( vert_inds, dtype=np.int64 )]
+
+
+
+def weld_vertices( Vs, Fs, distance ):
+    """
+    Merges vertices closer than "distance", for example duplicates along UV
+    or normal seams. Chains of close vertices are merged into one.
+    """
+    Vs = np.asarray( Vs, dtype=np.float64 )
+    Fs = np.asarray( Fs, dtype=np.int64 )
+    verts_qty = Vs.shape[0]
+
+    pairs = close_pairs( Vs, distance )
+    A = scipy.sparse.coo_matrix( (np.ones( pairs.shape[0], dtype=np.int8 ), (pairs[:, 0], pairs[:, 1])), 
+                                 shape=(verts_qty, verts_qty) )
+    _, weld_map = scipy.sparse.csgraph.connected_components( A, directed=False )
+
+    # Number welded vertices in the order of their first original vertex.
+    _, rep_inds, weld_map = np.unique( weld_map, return_index=True, return_inverse=True )
+    order = np.argsort( rep_inds )
+    renumber = np.empty_like( order )
+    renumber[order] = np.arange( order.shape[0] )
+
+    return WeldMap( renumber[weld_map.ravel()], rep_inds[order], Fs )
+
+
+
+# The cell itself and half of its 26 neighbours, the other half is 
+# covered from the neighbours' side.
+NEIGHBOUR_CELL_OFFSETS = np.array( [ (i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1) 
+                                     if (i, j, k) >= (0, 0, 0) ], dtype=np.int64 )
+
+
+
+def close_pairs( Vs, distance ):
+    """
+    Pairs (i, j) with i < j of vertices at most "distance" apart as (pairs_qty, 2) array.
+    Vertices are hashed into grid cells at least "distance" wide, so only 
+    vertices in the same or neighbouring cells are compared.
+    """
+    Vs = np.asarray( Vs, dtype=np.float64 )
+    if Vs.shape[0] < 2:
+        return np.zeros( (0, 2), dtype=np.int64 )
+
+    # Coarser cells keep the cell keys in int64 for tiny distances.
+    origin = Vs.min( axis=0 )
+    extent = (Vs.max( axis=0 ) - origin).max()
+    cell_size = max( distance, extent * 2.0**-20 )
+    if cell_size <= 0.0:
+        cell_size = 1.0
+
+    # One cell of margin so that neighbour keys don't wrap around.
+    cells = np.floor( (Vs - origin) / cell_size ).astype( np.int64 ) + 1
+    dims = cells.max( axis=0 ) + 2
+    cell_keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    keys, cell_inds, cell_counts = np.unique( cell_keys, return_inverse=True, return_counts=True )
+    cell_inds = cell_inds.ravel()
+    # Vertices sorted by cell, those of cell c are order[cell_starts[c]:cell_starts[c]+cell_counts[c]].
+    order = np.argsort( cell_inds, kind='stable' )
+    cell_starts = np.cumsum( cell_counts ) - cell_counts
+    key_offsets = (NEIGHBOUR_CELL_OFFSETS[:, 0] * dims[1] + NEIGHBOUR_CELL_OFFSETS[:, 1]) * dims[2] + \
+                  NEIGHBOUR_CELL_OFFSETS[:, 2]
+
+    pairs = []
+    for key_offset in key_offsets:
+        neighbour_keys = keys + key_offset
+        neighbours = np.minimum( np.searchsorted( keys, neighbour_keys ), keys.shape[0] - 1 )
+        cells_a = np.flatnonzero( keys[neighbours] == neighbour_keys )
+        cells_b = neighbours[cells_a]
+
+        # Every vertex of cell a with every vertex of cell b.
+        qty_a = cell_counts[cells_a]
+        qty_b = cell_counts[cells_b]
+        pairs_qty = qty_a * qty_b
+        cell_pairs = np.repeat( np.arange( cells_a.shape[0] ), pairs_qty )
+        local = np.arange( cell_pairs.shape[0] ) - np.repeat( np.cumsum( pairs_qty ) - pairs_qty, pairs_qty )
+        inds_a = order[cell_starts[cells_a][cell_pairs] + local // qty_b[cell_pairs]]
+        inds_b = order[cell_starts[cells_b][cell_pairs] + local % qty_b[cell_pairs]]
+
+        if key_offset == 0:
+            keep = inds_a < inds_b
+            inds_a, inds_b = inds_a[keep], inds_b[keep]
+
+        close = np.einsum( 'ij,ij->i', Vs[inds_a] - Vs[inds_b], Vs[inds_a] - Vs[inds_b] ) <= distance * distance
+        inds_a, inds_b = inds_a[close], inds_b[close]
+        pairs.append( np.stack( (np.minimum( inds_a, inds_b ), np.maximum( inds_a, inds_b )), axis=1 ) )
+
+    return np.concatenate( pairs )
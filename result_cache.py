@@ -0,0 +1,146 @@
+# Solved poses of recently used anchor configurations.
+# Toggling between a few configurations, undo and redo of anchor moves
+# solve the same problems again. Results are kept in one least recently
+# used cache for all meshes, bounded by memory. Keys hash the rest pose,
+# the constraint set and target positions rounded to a small fraction
+# of the mesh size, so that float noise in anchor locations still hits.
+
+import collections
+import hashlib
+
+import numpy as np
+
+
+# Targets are rounded to this fraction of the bounding box diagonal.
+TARGET_QUANTUM = 1.0e-6
+
+
+_cache = None
+
+
+
+class ResultCache:
+    """
+    Keeps solved poses until "budget_bytes" is exceeded, then drops the least
+    recently used ones. Poses bigger than the budget aren't kept at all.
+    """
+
+    def __init__( self, budget_bytes ):
+        self.budget_bytes = budget_bytes
+        self.entries      = collections.OrderedDict()
+        self.hits         = 0
+        self.misses       = 0
+        self._nbytes      = 0
+
+
+    def get( self, key ):
+        """
+        Pose stored for "key", read only, or None.
+        """
+        Vs = self.entries.get( key, None )
+        if Vs is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end( key )
+        self.hits += 1
+        return Vs
+
+
+    def put( self, key, Vs_solved ):
+        if Vs_solved.nbytes > self.budget_bytes:
+            return
+
+        # The caller's array is kept as it is, just protected from changes.
+        Vs_solved = np.asarray( Vs_solved )
+        Vs_solved.flags.writeable = False
+
+        previous = self.entries.pop( key, None )
+        if previous is not None:
+            self._nbytes -= previous.nbytes
+        self.entries[key] = Vs_solved
+        self._nbytes += Vs_solved.nbytes
+        self.trim()
+
+
+    def nbytes( self ):
+        return self._nbytes
+
+
+    def trim( self ):
+        while self._nbytes > self.budget_bytes:
+            _, Vs = self.entries.popitem( last=False )
+            self._nbytes -= Vs.nbytes
+
+
+    def drop( self, mesh_key ):
+        """
+        Drops every pose of the mesh "mesh_key".
+        """
+        for key in [ key for key in self.entries if key[0] == mesh_key ]:
+            self._nbytes -= self.entries.pop( key ).nbytes
+
+
+    def clear( self ):
+        self.entries.clear()
+        self._nbytes = 0
+
+
+
+def make_key( mesh_key, Vs_rest, vert_inds, targets, mode=None ):
+    """
+    Key of the solve of the mesh "mesh_key" with rest pose "Vs_rest",
+    constrained vertices "vert_inds" moved to "targets". "mode" is anything
+    hashable else the result depends on, solver options for instance.
+    """
+    Vs_rest = np.ascontiguousarray( Vs_rest )
+    diagonal = float( np.linalg.norm( np.ptp( Vs_rest, axis=0 ) ) ) if Vs_rest.shape[0] > 0 else 0.0
+    step = TARGET_QUANTUM * (diagonal if diagonal > 0.0 else 1.0)
+    quantized = np.round( np.asarray( targets, dtype=np.float64 ) / step ).astype( np.int64 )
+
+    h = hashlib.blake2b( digest_size=16 )
+    h.update( Vs_rest.dtype.str.encode() )
+    h.update( Vs_rest )
+    rest_digest = h.hexdigest()
+
+    h = hashlib.blake2b( digest_size=16 )
+    h.update( np.ascontiguousarray( vert_inds, dtype=np.int32 ).tobytes() )
+    h.update( quantized.tobytes() )
+
+    return (mesh_key, rest_digest, h.hexdigest(), mode)
+
+
+
+def get_cache( budget_bytes ):
+    """
+    The cache, with the latest budget.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ResultCache( budget_bytes )
+
+    _cache.budget_bytes = budget_bytes
+    _cache.trim()
+
+    return _cache
+
+
+
+def find_cache():
+    """
+    The cache as it is or None if nothing was cached yet, for display.
+    """
+    return _cache
+
+
+
+def set_budget( budget_bytes ):
+    if _cache is not None:
+        _cache.budget_bytes = budget_bytes
+        _cache.trim()
+
+
+
+def drop_mesh( mesh_key ):
+    if _cache is not None:
+        _cache.drop( mesh_key )
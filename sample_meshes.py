@@ -0,0 +1,74 @@
+# Generated meshes for benchmarks and tests.
+
+import numpy as np
+
+
+
+def make_grid( n, size=1.0, dtype=np.float64 ):
+    """
+    Flat n by n vertex grid in XY plane centered at the origin.
+    Returns (Vs, Fs).
+    """
+    coords = np.linspace( -0.5*size, 0.5*size, n, dtype=dtype )
+    x, y = np.meshgrid( coords, coords )
+    Vs = np.stack( (x.ravel(), y.ravel(), np.zeros( n*n, dtype=dtype )), axis=1 )
+
+    inds = np.arange( n*n, dtype=np.int32 ).reshape( (n, n) )
+    a = inds[:-1, :-1].ravel()
+    b = inds[:-1, 1:].ravel()
+    c = inds[1:, 1:].ravel()
+    d = inds[1:, :-1].ravel()
+    Fs = np.concatenate( (np.stack( (a, b, c), axis=1 ), np.stack( (a, c, d), axis=1 )), axis=0 )
+
+    return (Vs, Fs)
+
+
+
+def make_cylinder( rings_qty, segments_qty, radius=0.5, height=2.0, dtype=np.float64, mirror_faces=False ):
+    """
+    Open cylinder along Z centered at the origin, symmetric with respect to 
+    XY, YZ and XZ planes if "segments_qty" is a multiple of 4. Quads are split 
+    along the same diagonal everywhere, with "mirror_faces" the split on the 
+    negative X side mirrors the positive one, so that the triangulation 
+    itself is symmetric with respect to YZ as well.
+    Returns (Vs, Fs).
+    """
+    angles = np.linspace( 0.0, 2.0*np.pi, segments_qty, endpoint=False )
+    z = np.linspace( -0.5*height, 0.5*height, rings_qty )
+
+    a, zz = np.meshgrid( angles, z )
+    Vs = np.stack( (radius*np.cos(a).ravel(), radius*np.sin(a).ravel(), zz.ravel()), axis=1 ).astype( dtype )
+
+    inds = np.arange( rings_qty*segments_qty, dtype=np.int32 ).reshape( (rings_qty, segments_qty) )
+    nxt = np.roll( inds, -1, axis=1 )
+    a = inds[:-1].ravel()
+    b = nxt[:-1].ravel()
+    c = nxt[1:].ravel()
+    d = inds[1:].ravel()
+    Fs = np.concatenate( (np.stack( (a, b, c), axis=1 ), np.stack( (a, c, d), axis=1 )), axis=0 )
+
+    if mirror_faces:
+        positive = (Vs[a, 0] + Vs[b, 0] + Vs[c, 0] + Vs[d, 0]) > 0.0
+        Fs = np.concatenate( (np.stack( (a, b, c), axis=1 )[positive], np.stack( (a, c, d), axis=1 )[positive], 
+                              np.stack( (a, b, d), axis=1 )[~positive], np.stack( (b, c, d), axis=1 )[~positive]), axis=0 )
+
+    return (Vs, Fs)
+
+
+
+def make_bend_problem( Vs, axis=2 ):
+    """
+    Typical test problem: the lowest ring of vertices along "axis" is fixed, 
+    the highest one is shifted sideways. Returns (vert_inds, target_positions).
+    """
+    coord = Vs[:, axis]
+    low  = np.flatnonzero( coord <= coord.min() + 1.0e-6 )
+    high = np.flatnonzero( coord >= coord.max() - 1.0e-6 )
+
+    vert_inds = np.concatenate( (low, high) ).astype( np.int32 )
+    target_positions = Vs[vert_inds].copy()
+    side_axis = (axis + 1) % 3
+    extent = coord.max() - coord.min()
+    target_positions[low.shape[0]:, side_axis] += 0.25 * extent
+
+    return (vert_inds, target_positions)
@@ -0,0 +1,186 @@
+# Picking mesh vertices in a 3D view region without Blender's per vertex calls.
+# Vertices are projected to region pixels in one NumPy pass and bucketed
+# into a grid of square cells, so that nearest vertex queries are cheap
+# enough to run on every mouse move.
+
+import numpy as np
+
+
+
+class ProjectionCache:
+    """
+    Region coordinates of mesh vertices facing the viewer. Projection is
+    redone only if the view, the object transform or the geometry changes.
+    """
+
+    def __init__( self, cell_size=32.0 ):
+        # Grid cell size in pixels.
+        self.cell_size = cell_size
+        self.view_key  = None
+
+        # Object space geometry.
+        self.Vs      = None
+        self.normals = None
+        self.allowed = None
+
+        # Visible vertex indices sorted by grid cell and their region coordinates.
+        self.vert_inds = np.zeros( 0, dtype=np.int64 )
+        self.coords    = np.zeros( (0, 2) )
+        # Grid: vertices in cell (i, j) are vert_inds[cell_starts[c]:cell_starts[c+1]],
+        # c = j * cells_x + i.
+        self.cells_x     = 0
+        self.cells_y     = 0
+        self.cell_starts = np.zeros( 1, dtype=np.int64 )
+
+
+    def set_geometry( self, Vs, normals, allowed_inds=None ):
+        """
+        Object space vertex positions and normals. If "allowed_inds" is
+        given, only these vertices can be picked.
+        """
+        self.Vs      = np.asarray( Vs, dtype=np.float64 )
+        self.normals = np.asarray( normals, dtype=np.float64 )
+
+        if allowed_inds is None:
+            self.allowed = None
+        else:
+            self.allowed = np.zeros( self.Vs.shape[0], dtype=bool )
+            self.allowed[np.asarray( allowed_inds, dtype=np.int64 )] = True
+
+        self.view_key = None
+
+
+    def update( self, matrix_world, perspective_matrix, view_matrix, is_perspective, region_size ):
+        """
+        Projects vertices unless nothing has changed since the last call.
+        Matrices are 4x4 arrays, "region_size" is (width, height) in pixels.
+        Returns True if vertices were projected.
+        """
+        matrix_world       = np.asarray( matrix_world, dtype=np.float64 )
+        perspective_matrix = np.asarray( perspective_matrix, dtype=np.float64 )
+        view_matrix        = np.asarray( view_matrix, dtype=np.float64 )
+
+        view_key = (matrix_world.tobytes(), perspective_matrix.tobytes(), view_matrix.tobytes(),
+                    bool(is_perspective), tuple(region_size))
+        if view_key == self.view_key:
+            return False
+
+        self.view_key = view_key
+        self._project( matrix_world, perspective_matrix, view_matrix, is_perspective, region_size )
+        return True
+
+
+    def _project( self, matrix_world, perspective_matrix, view_matrix, is_perspective, region_size ):
+        width, height = region_size
+
+        Vs_world = self.Vs @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+
+        # Normals transform with the inverse transpose.
+        normal_mat = np.linalg.inv( matrix_world[:3, :3] ).T
+        normals_world = self.normals @ normal_mat.T
+
+        # Rows of the view rotation are camera axes in world space,
+        # the camera looks along its -Z.
+        if is_perspective:
+            camera_pos = np.linalg.inv( view_matrix )[:3, 3]
+            view_dirs = Vs_world - camera_pos
+        else:
+            view_dirs = -view_matrix[2, :3]
+        facing = np.einsum( 'ij,ij->i', normals_world, np.broadcast_to( view_dirs, normals_world.shape ) ) < 0.0
+
+        clip = Vs_world @ perspective_matrix[:3, :3].T + perspective_matrix[:3, 3]
+        w = Vs_world @ perspective_matrix[3, :3] + perspective_matrix[3, 3]
+
+        # Behind the camera, the same as location_3d_to_region_2d() returning None.
+        visible = facing & (w > 0.0)
+        if self.allowed is not None:
+            visible &= self.allowed
+
+        vert_inds = np.flatnonzero( visible )
+        w = w[vert_inds]
+        coords = np.empty( (vert_inds.shape[0], 2) )
+        coords[:, 0] = (0.5 * width)  * (1.0 + clip[vert_inds, 0] / w)
+        coords[:, 1] = (0.5 * height) * (1.0 + clip[vert_inds, 1] / w)
+
+        # Vertices outside of the region can still be the nearest ones,
+        # they go to the border cells.
+        self.cells_x = max( 1, int( np.ceil( width  / self.cell_size ) ) )
+        self.cells_y = max( 1, int( np.ceil( height / self.cell_size ) ) )
+        cell_inds = self._cell_inds( coords )
+
+        order = np.argsort( cell_inds, kind='stable' )
+        self.vert_inds = vert_inds[order]
+        self.coords    = coords[order]
+        cells_qty = self.cells_x * self.cells_y
+        self.cell_starts = np.searchsorted( cell_inds[order], np.arange( cells_qty+1 ) )
+
+
+    def _cell_inds( self, coords ):
+        i = np.clip( (coords[:, 0] // self.cell_size).astype( np.int64 ), 0, self.cells_x-1 )
+        j = np.clip( (coords[:, 1] // self.cell_size).astype( np.int64 ), 0, self.cells_y-1 )
+        return j * self.cells_x + i
+
+
+    def find_closest( self, x, y, max_dist=float('inf') ):
+        """
+        Vertex closest to region coordinates (x, y) within "max_dist" pixels.
+        Returns (vert_ind, dist), vert_ind is -1 if there is none.
+        """
+        if self.vert_inds.shape[0] == 0:
+            return (-1, float('inf'))
+
+        at = np.array( [[x, y]], dtype=np.float64 )
+        cell_ind = self._cell_inds( at )[0]
+        ci = cell_ind % self.cells_x
+        cj = cell_ind // self.cells_x
+
+        best_ind  = -1
+        best_dist = float('inf')
+        rings_qty = max( self.cells_x, self.cells_y )
+        for ring in range( rings_qty ):
+            # Anything in this ring and beyond is at least this far away.
+            covered = max( ring-1, 0 ) * self.cell_size
+            if covered > min( best_dist, max_dist ):
+                break
+
+            inds = self._ring_entries( ci, cj, ring )
+            if inds.shape[0] == 0:
+                continue
+
+            dists = np.linalg.norm( self.coords[inds] - at, axis=1 )
+            k = np.argmin( dists )
+            if dists[k] < best_dist:
+                best_dist = float( dists[k] )
+                best_ind  = int( self.vert_inds[inds[k]] )
+
+        if best_dist > max_dist:
+            return (-1, float('inf'))
+
+        return (best_ind, best_dist)
+
+
+    def _ring_entries( self, ci, cj, ring ):
+        i0, i1 = max( ci-ring, 0 ), min( ci+ring, self.cells_x-1 )
+        j0, j1 = max( cj-ring, 0 ), min( cj+ring, self.cells_y-1 )
+
+        cells = []
+        for j in range( j0, j1+1 ):
+            if (j == cj-ring) or (j == cj+ring):
+                # Full row of the ring.
+                cells.extend( range( j*self.cells_x + i0, j*self.cells_x + i1 + 1 ) )
+            else:
+                if ci-ring >= 0:
+                    cells.append( j*self.cells_x + ci - ring )
+                if (ring > 0) and (ci+ring < self.cells_x):
+                    cells.append( j*self.cells_x + ci + ring )
+
+        if len(cells) == 0:
+            return np.zeros( 0, dtype=np.int64 )
+
+        cells = np.array( cells )
+        starts = self.cell_starts[cells]
+        ends   = self.cell_starts[cells+1]
+        counts = ends - starts
+        # Concatenated ranges starts[k]:ends[k].
+        offsets = np.repeat( starts - (np.cumsum( counts ) - counts), counts )
+        return offsets + np.arange( counts.sum() )
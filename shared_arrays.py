@@ -0,0 +1,174 @@
+# NumPy arrays in multiprocessing.shared_memory blocks, so that worker
+# processes read big inputs and write their results without pickling them.
+#
+# The parent owns every block: SharedArrays creates them, hands out small
+# picklable SharedArray handles and unlinks the blocks when it is closed,
+# also when a solve is cancelled or raises. Workers attach by name for the
+# duration of a call. If the parent dies, the multiprocessing resource
+# tracker it shares with its spawned workers unlinks what is left.
+
+import collections
+import contextlib
+import weakref
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# Smaller arrays are cheaper to pickle than to map.
+MIN_SHARED_BYTES = 1 << 16
+
+
+# What a worker needs to attach to an array, pickles to a few bytes.
+SharedArray = collections.namedtuple( "SharedArray", ["name", "shape", "dtype"] )
+
+
+# Blocks a worker could not close because views of them were still alive.
+_lingering = []
+
+
+
+class SharedArrays:
+    """
+    Owner of shared memory blocks. Use as a context manager or call close().
+    """
+
+    def __init__( self ):
+        self._blocks = {}
+        # Unlinks the blocks if the owner is dropped without close().
+        self._finalizer = weakref.finalize( self, _release_blocks, self._blocks )
+
+
+    def empty( self, shape, dtype ):
+        """
+        Returns (handle, array) of a new uninitialized shared array.
+        """
+        dtype = np.dtype( dtype )
+        nbytes = int( np.prod( shape, dtype=np.int64 ) ) * dtype.itemsize
+        # Zero sized blocks are not allowed.
+        block = shared_memory.SharedMemory( create=True, size=max( nbytes, 1 ) )
+        self._blocks[block.name] = block
+
+        handle = SharedArray( block.name, tuple( int(d) for d in shape ), dtype.str )
+        return (handle, _view( block, handle ))
+
+
+    def put( self, array ):
+        """
+        Copies "array" to a new shared array, returns its handle.
+        """
+        array = np.asarray( array )
+        handle, view = self.empty( array.shape, array.dtype )
+        view[...] = array
+        return handle
+
+
+    def share( self, args ):
+        """
+        "args" with every array of at least MIN_SHARED_BYTES replaced by a
+        handle, nested tuples and lists included. Inverse of attached().
+        """
+        if isinstance( args, np.ndarray ):
+            if args.nbytes >= MIN_SHARED_BYTES and args.dtype != object:
+                return self.put( args )
+            return args
+        if isinstance( args, (tuple, list) ) and not isinstance( args, SharedArray ):
+            return type(args)( self.share( arg ) for arg in args )
+        return args
+
+
+    def release( self, handles ):
+        """
+        Unlinks the blocks of "handles", a handle or nested tuples of them.
+        Anything else in "handles" is ignored.
+        """
+        for handle in _iter_handles( handles ):
+            block = self._blocks.pop( handle.name, None )
+            if block is not None:
+                _release_blocks( { handle.name: block } )
+
+
+    def close( self ):
+        self._finalizer()
+
+
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, *exc_info ):
+        self.close()
+
+
+
+@contextlib.contextmanager
+def attached( args ):
+    """
+    "args" with every handle replaced by an array view of its block, for
+    the duration of the block. Writes go straight to the block, views must
+    not outlive it. Inverse of SharedArrays.share().
+    """
+    _close_lingering()
+
+    blocks = []
+    try:
+        yield _resolve( args, blocks )
+    finally:
+        for block in blocks:
+            _close( block )
+
+
+
+def _resolve( args, blocks ):
+    if isinstance( args, SharedArray ):
+        # Attaching registers the name with the resource tracker again, the
+        # tracker is the parent's and the parent unregisters it on unlink.
+        block = shared_memory.SharedMemory( name=args.name )
+        blocks.append( block )
+        return _view( block, args )
+    if isinstance( args, (tuple, list) ):
+        return type(args)( _resolve( arg, blocks ) for arg in args )
+    return args
+
+
+
+def _view( block, handle ):
+    return np.ndarray( handle.shape, dtype=np.dtype( handle.dtype ), buffer=block.buf )
+
+
+
+def _iter_handles( args ):
+    if isinstance( args, SharedArray ):
+        yield args
+    elif isinstance( args, (tuple, list) ):
+        for arg in args:
+            yield from _iter_handles( arg )
+
+
+
+def _close( block ):
+    try:
+        block.close()
+    except BufferError:
+        # A view is still referenced, e.g. by a traceback. Keep the block
+        # mapped and try again later, the parent may unlink it meanwhile.
+        _lingering.append( block )
+
+
+
+def _close_lingering():
+    blocks = list( _lingering )
+    del _lingering[:]
+    for block in blocks:
+        _close( block )
+
+
+
+def _release_blocks( blocks ):
+    for block in blocks.values():
+        _close( block )
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+    blocks.clear()
@@ -0,0 +1,166 @@
+# Bounded history of solved poses.
+# Each pose is stored as a float32 delta against the rest pose. Deltas are
+# byte shuffled and zlib compressed, optionally only for vertices which moved.
+
+import zlib
+import numpy as np
+
+
+# Histories per mesh.
+_histories = {}
+
+
+
+class HistoryEntry:
+    def __init__( self, label, verts_qty, vert_inds, deltas ):
+        self.label     = label
+        self.verts_qty = verts_qty
+        # Compressed int32 indices of moved vertices or None if all vertices are stored.
+        self.vert_inds = vert_inds
+        # Compressed float32 deltas.
+        self.deltas    = deltas
+
+
+    def nbytes( self ):
+        sz = len( self.deltas )
+        if self.vert_inds is not None:
+            sz += len( self.vert_inds )
+
+        return sz
+
+
+
+class SolveHistory:
+    """
+    Keeps solved poses until "budget_bytes" is exceeded, then drops the oldest ones.
+    If "sparse" is set, only vertices moved by more than "threshold" are stored.
+    """
+
+    def __init__( self, budget_bytes, sparse=True, threshold=1.0e-6 ):
+        self.budget_bytes = budget_bytes
+        self.sparse       = sparse
+        self.threshold    = threshold
+        self.entries      = []
+        # Number of entries ever pushed, used for labels.
+        self.pushed_qty   = 0
+
+
+    def push( self, Vs_rest, Vs_solved, label="" ):
+        deltas = np.asarray( Vs_solved, dtype=np.float32 ) - np.asarray( Vs_rest, dtype=np.float32 )
+        verts_qty = deltas.shape[0]
+
+        vert_inds = None
+        if self.sparse:
+            moved = np.abs( deltas ).max( axis=1 ) > self.threshold
+            # Indices cost as much as a coordinate, not worth it if most vertices moved.
+            if np.count_nonzero( moved ) * 4 < verts_qty * 3:
+                inds   = np.flatnonzero( moved ).astype( np.int32 )
+                deltas = deltas[inds]
+                # Indices are increasing, their differences compress much better.
+                vert_inds = _compress( np.diff( inds, prepend=0 ).astype( np.int32 ) )
+
+        entry = HistoryEntry( label, verts_qty, vert_inds, _compress( deltas ) )
+        self.entries.append( entry )
+        self.pushed_qty += 1
+        self.trim()
+
+        return entry
+
+
+    def restore( self, Vs_rest, entry_ind ):
+        """
+        Returns the pose stored in the entry "entry_ind" applied to the rest pose "Vs_rest".
+        """
+        entry = self.entries[entry_ind]
+
+        Vs = np.array( Vs_rest, dtype=np.float32 )
+        deltas = _decompress( entry.deltas, np.float32 ).reshape( (-1, 3) )
+
+        if entry.vert_inds is None:
+            Vs += deltas
+
+        else:
+            inds = np.cumsum( _decompress( entry.vert_inds, np.int32 ) )
+            Vs[inds] += deltas
+
+        return Vs
+
+
+    def nbytes( self ):
+        sz = 0
+        for entry in self.entries:
+            sz += entry.nbytes()
+
+        return sz
+
+
+    def trim( self ):
+        # Always keep the latest entry, even if it alone exceeds the budget.
+        while (len(self.entries) > 1) and (self.nbytes() > self.budget_bytes):
+            self.entries.pop( 0 )
+
+
+    def clear( self ):
+        self.entries = []
+
+
+
+def get_history( key, budget_bytes, sparse=True ):
+    """
+    History of the mesh identified by "key". Budget and sparse storage follow
+    the latest settings.
+    """
+    history = _histories.get( key, None )
+    if history is None:
+        history = SolveHistory( budget_bytes, sparse )
+        _histories[key] = history
+
+    history.budget_bytes = budget_bytes
+    history.sparse       = sparse
+    history.trim()
+
+    return history
+
+
+
+def find_history( key ):
+    """
+    History of the mesh identified by "key" as it is or None, for display.
+    """
+    return _histories.get( key, None )
+
+
+
+def set_limits( budget_bytes, sparse=True ):
+    """
+    New budget and storage mode for the histories of all meshes.
+    """
+    for history in _histories.values():
+        history.budget_bytes = budget_bytes
+        history.sparse       = sparse
+        history.trim()
+
+
+
+def drop_history( key ):
+    _histories.pop( key, None )
+
+
+
+
+
+def _compress( data ):
+    # Group bytes by significance. Exponents and high mantissa bytes of
+    # neighbouring values are similar, this helps zlib a lot.
+    data = np.ascontiguousarray( data )
+    itemsize = data.dtype.itemsize
+    shuffled = data.view( np.uint8 ).reshape( (-1, itemsize) ).T.copy()
+    return zlib.compress( shuffled.tobytes(), 1 )
+
+
+
+def _decompress( data, dtype ):
+    itemsize = np.dtype( dtype ).itemsize
+    shuffled = np.frombuffer( zlib.decompress( data ), dtype=np.uint8 )
+    unshuffled = shuffled.reshape( (itemsize, -1) ).T.copy()
+    return unshuffled.view( dtype ).ravel()
@@ -0,0 +1,269 @@
+# Picks the solver backend for a problem before anything is precomputed.
+# Time is modelled per backend as a * n^p in the number of free vertices n,
+# memory from the estimated fill-in of a sparse factorization of the mesh
+# Laplacian, f * n * log2( n ) entries for surface meshes. The cheapest
+# backend whose memory fits in what the machine has available wins.
+# "a", "p" and "f" come from "python benchmark.py backends --calibrate",
+# defaults were measured on a single core with 2.5k to 160k vertices.
+
+import json
+import math
+import os
+
+
+# Name, get_solver() backend and preconditioner.
+STRATEGIES = [ ("IGL",          "IGL",    None),
+               ("DIRECT",       "DIRECT", None),
+               ("CG/JACOBI",    "CG",     "JACOBI"),
+               ("CG/ILU",       "CG",     "ILU"),
+               ("CG/MULTIGRID", "CG",     "MULTIGRID") ]
+
+CALIBRATION_PATH = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "solver_calibration.json" )
+
+DEFAULT_CALIBRATION = { "fill": 5.0,
+                        "time": { "IGL":          [6.9e-6, 1.17],
+                                  "DIRECT":       [7.4e-5, 0.99],
+                                  "CG/JACOBI":    [1.5e-5, 1.26],
+                                  "CG/ILU":       [2.1e-5, 1.17],
+                                  # Not measured, pyamg is near linear.
+                                  "CG/MULTIGRID": [3.0e-5, 1.05] } }
+
+# Factor entries relative to a full LU of the Laplacian. igl.ARAP keeps a
+# Cholesky factor, ILU drops small entries, the others keep none.
+FACTOR_SCALE = { "IGL": 0.5, "DIRECT": 1.0, "CG/JACOBI": 0.0, "CG/ILU": 0.3, "CG/MULTIGRID": 0.0 }
+
+# Everything else per vertex: positions, Laplacian, rotations, work vectors.
+# igl.ARAP additionally keeps its rotation fitting matrix.
+BYTES_PER_VERT = { "IGL": 2000, "DIRECT": 600, "CG/JACOBI": 700, "CG/ILU": 700, "CG/MULTIGRID": 1200 }
+
+# float64 value and int32 index.
+BYTES_PER_NNZ = 12
+
+# Share of the available memory a solve may plan to take.
+MEMORY_SHARE = 0.5
+
+
+_calibration = {}
+
+
+
+class ProblemStats:
+    """
+    What the cost of a solve depends on. "symmetric" means only one half
+    of the mesh is solved.
+    """
+
+    def __init__( self, verts_qty, faces_qty=0, islands_qty=1, constraints_qty=0, symmetric=False ):
+        self.verts_qty       = int( verts_qty )
+        self.faces_qty       = int( faces_qty )
+        self.islands_qty     = max( 1, int( islands_qty ) )
+        self.constraints_qty = int( constraints_qty )
+        self.symmetric       = bool( symmetric )
+
+
+    def free_qty( self ):
+        free_qty = max( 1, self.verts_qty - self.constraints_qty )
+        if self.symmetric:
+            free_qty = max( 1, free_qty // 2 )
+
+        return free_qty
+
+
+    def key( self ):
+        return (self.verts_qty, self.faces_qty, self.islands_qty, self.constraints_qty, self.symmetric)
+
+
+
+class SolvePlan:
+    """
+    A strategy with its estimated time and memory. "options" are keyword
+    arguments of arap_solver.get_solver().
+    """
+
+    def __init__( self, strategy, seconds, memory_bytes, fits=True, automatic=False ):
+        self.strategy     = strategy
+        self.seconds      = seconds
+        self.memory_bytes = memory_bytes
+        self.fits         = fits
+        self.automatic    = automatic
+
+        _, backend, preconditioner = _find_strategy( strategy )
+        self.options = { "backend": backend, "preconditioner": preconditioner or 'JACOBI' }
+
+
+    def describe( self ):
+        return "%s, ~%s, ~%.0f MB" % (self.strategy, _format_seconds( self.seconds ),
+                                     self.memory_bytes / (1024.0 * 1024.0))
+
+
+
+def factor_nnz( stats, calibration ):
+    """
+    Estimated entries of a full LU factor of the Laplacian of the free vertices.
+    Islands are factored independently, they are assumed to be equally big.
+    """
+    n = stats.free_qty()
+    island_size = max( 2.0, float( n ) / stats.islands_qty )
+    return calibration["fill"] * n * math.log2( island_size )
+
+
+
+def estimate( stats, strategy, calibration=None, available_bytes=None ):
+    """
+    SolvePlan of solving a problem with "stats" using "strategy".
+    """
+    if calibration is None:
+        calibration = load_calibration()
+
+    n = stats.free_qty()
+    a, p = calibration["time"][strategy]
+    seconds = a * n**p
+    memory_bytes = BYTES_PER_VERT[strategy] * n + BYTES_PER_NNZ * FACTOR_SCALE[strategy] * factor_nnz( stats, calibration )
+
+    fits = (available_bytes is None) or (memory_bytes <= MEMORY_SHARE * available_bytes)
+    return SolvePlan( strategy, seconds, memory_bytes, fits )
+
+
+
+def plan( stats, calibration=None, available_bytes=None ):
+    """
+    The fastest strategy fitting in memory, the least memory hungry one if
+    none does. By default memory is what the machine has available now.
+    """
+    if calibration is None:
+        calibration = load_calibration()
+    if available_bytes is None:
+        available_bytes = available_memory()
+
+    plans = [ estimate( stats, strategy, calibration, available_bytes ) for strategy in available_strategies( stats ) ]
+    fitting = [ p for p in plans if p.fits ]
+    if fitting:
+        best = min( fitting, key=lambda p: p.seconds )
+    else:
+        best = min( plans, key=lambda p: p.memory_bytes )
+
+    best.automatic = True
+    return best
+
+
+
+def available_strategies( stats ):
+    """
+    igl.ARAP can't solve one half of a mesh, multigrid needs pyamg.
+    """
+    names = [ name for name, _, _ in STRATEGIES ]
+    if stats.symmetric:
+        names.remove( "IGL" )
+
+    try:
+        import pyamg
+    except ImportError:
+        names.remove( "CG/MULTIGRID" )
+
+    return names
+
+
+
+def strategy_name( backend, preconditioner=None ):
+    if backend == 'CG':
+        return "CG/%s" % preconditioner
+    return backend
+
+
+
+def available_memory():
+    """
+    Bytes of memory available to new allocations or None if unknown.
+    """
+    try:
+        with open( "/proc/meminfo" ) as f:
+            for line in f:
+                if line.startswith( "MemAvailable:" ):
+                    return int( line.split()[1] ) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf( "SC_AVPHYS_PAGES" ) * os.sysconf( "SC_PAGE_SIZE" )
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+
+def load_calibration( path=CALIBRATION_PATH ):
+    """
+    Calibration written by the benchmark over the defaults. Reread when the
+    file changes.
+    """
+    try:
+        mtime = os.path.getmtime( path )
+    except OSError:
+        return DEFAULT_CALIBRATION
+
+    cached = _calibration.get( path, None )
+    if (cached is not None) and (cached[0] == mtime):
+        return cached[1]
+
+    calibration = { "fill": DEFAULT_CALIBRATION["fill"], "time": dict( DEFAULT_CALIBRATION["time"] ) }
+    try:
+        with open( path ) as f:
+            data = json.load( f )
+        calibration["fill"] = float( data.get( "fill", calibration["fill"] ) )
+        for strategy, (a, p) in data.get( "time", {} ).items():
+            if strategy in calibration["time"]:
+                calibration["time"][strategy] = [float( a ), float( p )]
+    except (OSError, ValueError, TypeError) as e:
+        print( "Ignoring solver calibration %s: %s" % (path, e) )
+        calibration = DEFAULT_CALIBRATION
+
+    _calibration[path] = (mtime, calibration)
+    return calibration
+
+
+
+def fit_calibration( timings, fills ):
+    """
+    Calibration from benchmark measurements. "timings" maps strategy names to
+    lists of (free_qty, seconds), "fills" lists (free_qty, factor_nnz) of
+    full LU factors. Strategies measured at a single size keep the default
+    exponent.
+    """
+    import numpy as np
+
+    calibration = { "fill": DEFAULT_CALIBRATION["fill"], "time": {} }
+    for strategy, samples in timings.items():
+        n = np.array( [ s[0] for s in samples ], dtype=np.float64 )
+        t = np.array( [ s[1] for s in samples ], dtype=np.float64 )
+        if len( set( n ) ) >= 2:
+            p, log_a = np.polyfit( np.log( n ), np.log( t ), 1 )
+        else:
+            p = DEFAULT_CALIBRATION["time"][strategy][1]
+            log_a = np.mean( np.log( t ) - p * np.log( n ) )
+        calibration["time"][strategy] = [float( np.exp( log_a ) ), float( p )]
+
+    if fills:
+        calibration["fill"] = float( np.mean( [ nnz / (n * math.log2( n )) for n, nnz in fills ] ) )
+
+    return calibration
+
+
+
+def save_calibration( calibration, path=CALIBRATION_PATH ):
+    with open( path, "w" ) as f:
+        json.dump( calibration, f, indent=4 )
+
+
+
+def _find_strategy( name ):
+    for strategy in STRATEGIES:
+        if strategy[0] == name:
+            return strategy
+
+    raise ValueError( "Unknown solver strategy %s" % name )
+
+
+
+def _format_seconds( seconds ):
+    if seconds < 1.0:
+        return "%.0f ms" % (1000.0 * seconds)
+    return "%.1f s" % seconds
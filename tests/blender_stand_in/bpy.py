@@ -0,0 +1,1134 @@
+# Array-backed stand-in for the parts of bpy the add-on touches, enough to
+# run its operators under pytest without Blender. Vertex, edge, polygon,
+# loop, shape key and attribute data live in NumPy arrays and support
+# foreach_get()/foreach_set() with Blender's size checks. Access to single
+# items is counted in "stats", so that tests can tell bulk code paths from
+# per-vertex Python loops.
+#
+# Only what the add-on uses is modelled: there is no depsgraph, no
+# animation evaluation and objects have no parents.
+
+import itertools
+import os
+import types as _types
+
+import numpy as np
+
+import mathutils
+
+
+stats = { "item_access": 0, "foreach_calls": 0 }
+
+_session_uids = itertools.count( 1 )
+
+
+
+# --------------------------------------------------------------------------
+# Properties.
+
+class _Property:
+    """
+    bpy.props.*Property() result. Works as a descriptor once it is a class
+    attribute: register_class() turns annotations into class attributes
+    the way Blender does.
+    """
+
+    def __init__( self, kind, **options ):
+        self.kind      = kind
+        self.options   = options
+        self.attr_name = None
+
+
+    def default_value( self ):
+        if self.kind == 'POINTER':
+            return self.options["type"]()
+
+        default = self.options.get( "default", None )
+        if default is not None:
+            return default
+
+        if self.kind == 'ENUM':
+            return self.options["items"][0][0]
+
+        return { 'BOOL': False, 'INT': 0, 'FLOAT': 0.0, 'STRING': "" }[self.kind]
+
+
+    def __get__( self, obj, owner ):
+        if obj is None:
+            return self
+
+        values = obj.__dict__.setdefault( "_rna_values", {} )
+        if self.attr_name not in values:
+            values[self.attr_name] = self.default_value()
+
+        return values[self.attr_name]
+
+
+    def __set__( self, obj, value ):
+        if self.kind == 'ENUM':
+            valid = [ item[0] for item in self.options["items"] ]
+            if value not in valid:
+                raise TypeError( "enum \"%s\" not found in %s" % (value, valid) )
+
+        obj.__dict__.setdefault( "_rna_values", {} )[self.attr_name] = value
+
+        update = self.options.get( "update", None )
+        if update is not None:
+            update( obj, context )
+
+
+
+class _StructMeta( type ):
+
+    def __setattr__( cls, name, value ):
+        # bpy.types.Scene.settings = bpy.props.PointerProperty( ... )
+        if isinstance( value, _Property ):
+            value.attr_name = name
+        super().__setattr__( name, value )
+
+
+
+class _Struct( metaclass=_StructMeta ):
+    pass
+
+
+
+props = _types.SimpleNamespace(
+    BoolProperty    = lambda **options: _Property( 'BOOL', **options ),
+    IntProperty     = lambda **options: _Property( 'INT', **options ),
+    FloatProperty   = lambda **options: _Property( 'FLOAT', **options ),
+    StringProperty  = lambda **options: _Property( 'STRING', **options ),
+    EnumProperty    = lambda **options: _Property( 'ENUM', **options ),
+    PointerProperty = lambda **options: _Property( 'POINTER', **options ),
+)
+
+
+
+# --------------------------------------------------------------------------
+# Array-backed collections.
+
+class ArrayCollection:
+    """
+    Collection of "length" items whose attributes are rows of NumPy arrays.
+    """
+
+    def __init__( self, length=0, **arrays ):
+        self._length = length
+        self._arrays = arrays
+
+
+    def __len__( self ):
+        return self._length
+
+
+    def __getitem__( self, ind ):
+        if ind < 0:
+            ind += self._length
+        if not (0 <= ind < self._length):
+            raise IndexError( "bpy_prop_collection[index]: index %d out of range" % ind )
+
+        stats["item_access"] += 1
+        return ArrayItem( self, ind )
+
+
+    def __iter__( self ):
+        for ind in range( self._length ):
+            yield self[ind]
+
+
+    def foreach_get( self, attr, seq ):
+        stats["foreach_calls"] += 1
+        values = self._arrays[attr]
+        if len(seq) != values.size:
+            raise RuntimeError( "internal error setting the array" )
+
+        if isinstance( seq, np.ndarray ):
+            np.copyto( seq, values.reshape( seq.shape ), casting='unsafe' )
+        else:
+            seq[:] = values.ravel().tolist()
+
+
+    def foreach_set( self, attr, seq ):
+        stats["foreach_calls"] += 1
+        values = self._arrays[attr]
+        seq = np.asarray( seq )
+        if seq.size != values.size:
+            raise RuntimeError( "internal error setting the array" )
+
+        np.copyto( values, seq.reshape( values.shape ), casting='unsafe' )
+
+
+    def _resize( self, length ):
+        for name, values in self._arrays.items():
+            resized = np.zeros( (length,) + values.shape[1:], dtype=values.dtype )
+            qty = min( length, self._length )
+            resized[:qty] = values[:qty]
+            self._arrays[name] = resized
+        self._length = length
+
+
+
+class ArrayItem:
+
+    __slots__ = ("_collection", "index")
+
+    def __init__( self, collection, index ):
+        object.__setattr__( self, "_collection", collection )
+        object.__setattr__( self, "index", index )
+
+
+    def __getattr__( self, name ):
+        arrays = self._collection._arrays
+        if name not in arrays:
+            raise AttributeError( name )
+
+        value = arrays[name][self.index]
+        if isinstance( value, np.ndarray ):
+            return mathutils.Vector( value )
+        if isinstance( value, np.generic ):
+            return value.item()
+        return value
+
+
+    def __setattr__( self, name, value ):
+        arrays = self._collection._arrays
+        if name not in arrays:
+            raise AttributeError( name )
+        arrays[name][self.index] = value
+
+
+
+# --------------------------------------------------------------------------
+# ID blocks.
+
+class ID( _Struct ):
+
+    def __init__( self, name ):
+        self.name = name
+        self.session_uid = next( _session_uids )
+        self._id_props = {}
+
+
+    def __getitem__( self, key ):
+        return self._id_props[key]
+
+
+    def __setitem__( self, key, value ):
+        self._id_props[key] = value
+
+
+    def __delitem__( self, key ):
+        del self._id_props[key]
+
+
+    def __contains__( self, key ):
+        return key in self._id_props
+
+
+    def get( self, key, default=None ):
+        return self._id_props.get( key, default )
+
+
+    def keys( self ):
+        return self._id_props.keys()
+
+
+    def __repr__( self ):
+        return "<%s \"%s\">" % (type(self).__name__, self.name)
+
+
+
+class Mesh( ID ):
+
+    def __new__( cls, *args, **kwargs ):
+        # bpy.types.Mesh( obj ) wraps an existing struct.
+        if (len(args) == 1) and isinstance( args[0], ID ):
+            return args[0]
+        return super().__new__( cls )
+
+
+    def __init__( self, name ):
+        super().__init__( name )
+        self.vertices = ArrayCollection( 0, co=np.zeros( (0, 3), dtype=np.float32 ),
+                                            normal=np.zeros( (0, 3), dtype=np.float32 ),
+                                            select=np.zeros( 0, dtype=bool ) )
+        self.edges    = ArrayCollection( 0, vertices=np.zeros( (0, 2), dtype=np.int32 ),
+                                            select=np.zeros( 0, dtype=bool ) )
+        self.polygons = ArrayCollection( 0, loop_start=np.zeros( 0, dtype=np.int32 ),
+                                            loop_total=np.zeros( 0, dtype=np.int32 ),
+                                            select=np.zeros( 0, dtype=bool ) )
+        self.loops    = ArrayCollection( 0, vertex_index=np.zeros( 0, dtype=np.int32 ) )
+        self.attributes = Attributes( self )
+        self.shape_keys = None
+        self.users = 0
+
+
+    def from_pydata( self, vertices, edges, faces ):
+        """
+        Polygons as an (faces_qty, corners_qty) array or a list of index lists.
+        """
+        Vs = np.asarray( vertices, dtype=np.float32 ).reshape( (-1, 3) )
+        if isinstance( faces, np.ndarray ):
+            loop_verts  = faces.astype( np.int32 ).ravel()
+            loop_totals = np.full( faces.shape[0], faces.shape[1], dtype=np.int32 )
+        else:
+            loop_verts  = np.array( [ v for face in faces for v in face ], dtype=np.int32 )
+            loop_totals = np.array( [ len(face) for face in faces ], dtype=np.int32 )
+        loop_starts = (np.cumsum( loop_totals ) - loop_totals).astype( np.int32 )
+
+        # Polygon boundary edges, each loop to the next one of its polygon.
+        loops_qty = loop_verts.shape[0]
+        loop_polys = np.repeat( np.arange( loop_totals.shape[0] ), loop_totals )
+        next_loops = np.arange( 1, loops_qty+1 )
+        last = next_loops == (loop_starts + loop_totals)[loop_polys]
+        next_loops[last] = loop_starts[loop_polys[last]]
+        pairs = np.sort( np.stack( (loop_verts, loop_verts[next_loops]), axis=1 ), axis=1 )
+        if len(edges) > 0:
+            pairs = np.concatenate( (pairs, np.sort( np.asarray( edges, dtype=np.int32 ), axis=1 )) )
+        pairs = np.unique( pairs, axis=0 ).astype( np.int32 )
+
+        verts_qty = Vs.shape[0]
+        self.vertices = ArrayCollection( verts_qty, co=Vs.copy(),
+                                         normal=_vertex_normals( Vs, loop_verts, loop_starts, loop_totals ),
+                                         select=np.zeros( verts_qty, dtype=bool ) )
+        self.edges    = ArrayCollection( pairs.shape[0], vertices=pairs,
+                                         select=np.zeros( pairs.shape[0], dtype=bool ) )
+        self.polygons = ArrayCollection( loop_totals.shape[0], loop_start=loop_starts, loop_total=loop_totals,
+                                         select=np.zeros( loop_totals.shape[0], dtype=bool ) )
+        self.loops    = ArrayCollection( loops_qty, vertex_index=loop_verts )
+        self.attributes = Attributes( self )
+        self.shape_keys = None
+
+
+    def update( self ):
+        pass
+
+
+
+def _vertex_normals( Vs, loop_verts, loop_starts, loop_totals ):
+    """
+    Area weighted normals of fan triangulated polygons.
+    """
+    Vs = Vs.astype( np.float64 )
+    tris_qty = np.maximum( loop_totals - 2, 0 )
+    polys = np.repeat( np.arange( loop_totals.shape[0] ), tris_qty )
+    offsets = np.arange( tris_qty.sum() ) - np.repeat( np.cumsum( tris_qty ) - tris_qty, tris_qty )
+    a = loop_verts[loop_starts[polys]]
+    b = loop_verts[loop_starts[polys] + offsets + 1]
+    c = loop_verts[loop_starts[polys] + offsets + 2]
+    face_normals = np.cross( Vs[b] - Vs[a], Vs[c] - Vs[a] )
+
+    normals = np.zeros_like( Vs )
+    for corner in (a, b, c):
+        np.add.at( normals, corner, face_normals )
+    lengths = np.linalg.norm( normals, axis=1 )
+    normals /= np.maximum( lengths, 1.0e-30 )[:, None]
+
+    return normals.astype( np.float32 )
+
+
+
+class Attribute:
+
+    _DTYPES = { 'BOOLEAN': (bool, ()), 'INT': (np.int32, ()), 'FLOAT': (np.float32, ()),
+                'FLOAT_VECTOR': (np.float32, (3,)) }
+
+    def __init__( self, name, data_type, domain, length ):
+        self.name      = name
+        self.data_type = data_type
+        self.domain    = domain
+        dtype, shape = self._DTYPES[data_type]
+        key = "vector" if (data_type == 'FLOAT_VECTOR') else "value"
+        self.data = ArrayCollection( length, **{ key: np.zeros( (length,) + shape, dtype=dtype ) } )
+
+
+
+class Attributes:
+
+    def __init__( self, mesh ):
+        self._mesh = mesh
+        self._attributes = {}
+
+
+    def get( self, name, default=None ):
+        return self._attributes.get( name, default )
+
+
+    def new( self, name, type, domain ):
+        collection = { 'POINT': self._mesh.vertices, 'EDGE': self._mesh.edges,
+                       'FACE': self._mesh.polygons, 'CORNER': self._mesh.loops }[domain]
+        attribute = Attribute( name, type, domain, len(collection) )
+        self._attributes[name] = attribute
+        return attribute
+
+
+    def remove( self, attribute ):
+        del self._attributes[attribute.name]
+
+
+    def __contains__( self, name ):
+        return name in self._attributes
+
+
+    def __len__( self ):
+        return len(self._attributes)
+
+
+
+class KeyBlock:
+
+    def __init__( self, name, co, mesh ):
+        self.name  = name
+        self.value = 0.0
+        self.data  = ArrayCollection( co.shape[0], co=co )
+        self._mesh = mesh
+
+
+    def normals_vertex_get( self ):
+        """
+        Vertex normals of the mesh in this shape as a flat tuple.
+        """
+        polygons = self._mesh.polygons._arrays
+        normals = _vertex_normals( self.data._arrays["co"], self._mesh.loops._arrays["vertex_index"], 
+                                   polygons["loop_start"], polygons["loop_total"] )
+        return tuple( normals.ravel().tolist() )
+
+
+
+class KeyBlocks:
+
+    def __init__( self ):
+        self._blocks = []
+
+
+    def get( self, name, default=None ):
+        for block in self._blocks:
+            if block.name == name:
+                return block
+        return default
+
+
+    def __getitem__( self, key ):
+        if isinstance( key, str ):
+            block = self.get( key )
+            if block is None:
+                raise KeyError( key )
+            return block
+        return self._blocks[key]
+
+
+    def __contains__( self, name ):
+        return self.get( name ) is not None
+
+
+    def __len__( self ):
+        return len(self._blocks)
+
+
+    def __iter__( self ):
+        return iter( self._blocks )
+
+
+
+class Key( ID ):
+
+    def __init__( self, name ):
+        super().__init__( name )
+        self.key_blocks = KeyBlocks()
+        self.animation_data = None
+
+
+    @property
+    def reference_key( self ):
+        return self.key_blocks[0]
+
+
+    def animation_data_create( self ):
+        self.animation_data = AnimData()
+        return self.animation_data
+
+
+
+class AnimData:
+
+    def __init__( self ):
+        self.action = None
+
+
+
+class KeyframePoints( ArrayCollection ):
+
+    def __init__( self ):
+        super().__init__( 0, co=np.zeros( (0, 2), dtype=np.float32 ),
+                             interpolation=np.zeros( 0, dtype=object ) )
+
+
+    def add( self, count=1 ):
+        self._resize( len(self) + count )
+        self._arrays["interpolation"][-count:] = 'BEZIER'
+
+
+    def clear( self ):
+        self._resize( 0 )
+
+
+
+class FCurve:
+
+    def __init__( self, data_path, index=0 ):
+        self.data_path = data_path
+        self.array_index = index
+        self.keyframe_points = KeyframePoints()
+
+
+    def update( self ):
+        pass
+
+
+    def evaluate( self, frame ):
+        """
+        Value at "frame" for constant interpolation, the only kind the add-on uses.
+        """
+        co = np.empty( len(self.keyframe_points)*2, dtype=np.float32 )
+        self.keyframe_points.foreach_get( "co", co )
+        co = co.reshape( (-1, 2) )
+        before = np.flatnonzero( co[:, 0] <= frame )
+        if before.shape[0] == 0:
+            return float( co[0, 1] )
+        return float( co[before[-1], 1] )
+
+
+
+class FCurves:
+
+    def __init__( self ):
+        self._fcurves = []
+
+
+    def find( self, data_path, index=0 ):
+        for fcurve in self._fcurves:
+            if (fcurve.data_path == data_path) and (fcurve.array_index == index):
+                return fcurve
+        return None
+
+
+    def new( self, data_path, index=0, action_group="" ):
+        if self.find( data_path, index ) is not None:
+            raise RuntimeError( "F-Curve \"%s[%d]\" already exists" % (data_path, index) )
+        fcurve = FCurve( data_path, index )
+        self._fcurves.append( fcurve )
+        return fcurve
+
+
+    def __len__( self ):
+        return len(self._fcurves)
+
+
+    def __iter__( self ):
+        return iter( self._fcurves )
+
+
+
+class Action( ID ):
+
+    def __init__( self, name ):
+        super().__init__( name )
+        self.fcurves = FCurves()
+
+
+
+class Object( ID ):
+
+    def __init__( self, name, object_data ):
+        super().__init__( name )
+        self.data = object_data
+        self.type = 'MESH' if isinstance( object_data, Mesh ) else 'EMPTY'
+        self.mode = 'OBJECT'
+        self.empty_display_type = 'PLAIN_AXES'
+        self._matrix   = np.identity( 4 )
+        self._selected = False
+        if object_data is not None:
+            object_data.users += 1
+
+
+    @property
+    def matrix_world( self ):
+        return mathutils.Matrix( self._matrix )
+
+
+    @matrix_world.setter
+    def matrix_world( self, matrix ):
+        self._matrix = np.array( matrix, dtype=np.float64 )
+
+
+    @property
+    def location( self ):
+        return mathutils.Vector( self._matrix[:3, 3] )
+
+
+    @location.setter
+    def location( self, location ):
+        self._matrix[:3, 3] = np.asarray( location, dtype=np.float64 )
+
+
+    @property
+    def scale( self ):
+        return mathutils.Vector( np.linalg.norm( self._matrix[:3, :3], axis=0 ) )
+
+
+    @scale.setter
+    def scale( self, scale ):
+        axes = self._matrix[:3, :3]
+        axes /= np.maximum( np.linalg.norm( axes, axis=0 ), 1.0e-30 )
+        axes *= np.asarray( scale, dtype=np.float64 )
+
+
+    def select_set( self, state ):
+        self._selected = bool( state )
+
+
+    def select_get( self ):
+        return self._selected
+
+
+    def shape_key_add( self, name="Key", from_mix=True ):
+        mesh = self.data
+        co = np.empty( len(mesh.vertices)*3, dtype=np.float32 )
+        if mesh.shape_keys is None:
+            mesh.shape_keys = Key( "Key" )
+            mesh.vertices.foreach_get( "co", co )
+        else:
+            mesh.shape_keys.reference_key.data.foreach_get( "co", co )
+
+        block = KeyBlock( name, co.reshape( (-1, 3) ), mesh )
+        mesh.shape_keys.key_blocks._blocks.append( block )
+        return block
+
+
+
+# Values foreach_get() reads from objects, matrices column by column as Blender does.
+_OBJECT_ARRAYS = { "location":     lambda obj: obj._matrix[:3, 3],
+                   "scale":        lambda obj: np.linalg.norm( obj._matrix[:3, :3], axis=0 ),
+                   "matrix_world": lambda obj: obj._matrix.T.ravel(),
+                   "session_uid":  lambda obj: obj.session_uid,
+                   "select":       lambda obj: obj._selected }
+
+
+
+class ObjectCollection:
+
+    def __init__( self, objects=None ):
+        self._objects = list( objects ) if (objects is not None) else []
+
+
+    def __len__( self ):
+        return len(self._objects)
+
+
+    def __iter__( self ):
+        return iter( list( self._objects ) )
+
+
+    def __getitem__( self, key ):
+        if isinstance( key, str ):
+            obj = self.get( key )
+            if obj is None:
+                raise KeyError( "bpy_prop_collection[key]: key \"%s\" not found" % key )
+            return obj
+        return self._objects[key]
+
+
+    def __contains__( self, key ):
+        if isinstance( key, str ):
+            return self.get( key ) is not None
+        return key in self._objects
+
+
+    def get( self, name, default=None ):
+        for obj in self._objects:
+            if obj.name == name:
+                return obj
+        return default
+
+
+    def link( self, obj ):
+        if obj in self._objects:
+            raise RuntimeError( "Object \"%s\" already in collection" % obj.name )
+        self._objects.append( obj )
+
+
+    def unlink( self, obj ):
+        self._objects.remove( obj )
+
+
+    def foreach_get( self, attr, seq ):
+        stats["foreach_calls"] += 1
+        values = np.array( [ _OBJECT_ARRAYS[attr]( obj ) for obj in self._objects ] ).ravel()
+        if len(seq) != values.size:
+            raise RuntimeError( "internal error setting the array" )
+        if isinstance( seq, np.ndarray ):
+            np.copyto( seq, values.reshape( seq.shape ), casting='unsafe' )
+        else:
+            seq[:] = values.tolist()
+
+
+    def foreach_set( self, attr, seq ):
+        stats["foreach_calls"] += 1
+        values = np.asarray( seq, dtype=np.float64 ).reshape( (len(self._objects), -1) )
+        for obj, value in zip( self._objects, values ):
+            setattr( obj, attr, value )
+
+
+
+class Collection( ID ):
+
+    def __init__( self, name ):
+        super().__init__( name )
+        self.objects  = ObjectCollection()
+        self.children = ObjectCollection()
+
+
+    def all_objects( self ):
+        result = list( self.objects )
+        for child in self.children:
+            result.extend( obj for obj in child.all_objects() if obj not in result )
+        return result
+
+
+
+class Scene( ID ):
+
+    def __init__( self, name ):
+        super().__init__( name )
+        self.collection = Collection( "Scene Collection" )
+        self.frame_current = 1
+
+
+    @property
+    def objects( self ):
+        return ObjectCollection( self.collection.all_objects() )
+
+
+    def frame_set( self, frame ):
+        self.frame_current = frame
+
+
+
+class LayerObjects:
+
+    def __init__( self, scene ):
+        self._scene = scene
+        self.active = None
+
+
+    @property
+    def selected( self ):
+        return [ obj for obj in self._scene.objects if obj._selected ]
+
+
+    def __iter__( self ):
+        return iter( self._scene.objects )
+
+
+    def __len__( self ):
+        return len(self._scene.objects)
+
+
+
+class ViewLayer:
+
+    def __init__( self, scene ):
+        self.objects = LayerObjects( scene )
+
+
+
+# --------------------------------------------------------------------------
+# bpy.data
+
+class _DataObjects( ObjectCollection ):
+
+    def new( self, name, object_data ):
+        obj = Object( _unique_name( self, name ), object_data )
+        self._objects.append( obj )
+        return obj
+
+
+    def remove( self, obj ):
+        _unlink_everywhere( obj )
+        self._objects.remove( obj )
+        if obj.data is not None:
+            obj.data.users -= 1
+
+
+
+class _DataBlocks:
+
+    def __init__( self, id_type ):
+        self._id_type = id_type
+        self._blocks = []
+
+
+    def new( self, name ):
+        block = self._id_type( _unique_name( self, name ) )
+        self._blocks.append( block )
+        return block
+
+
+    def remove( self, block ):
+        self._blocks.remove( block )
+
+
+    def get( self, name, default=None ):
+        for block in self._blocks:
+            if block.name == name:
+                return block
+        return default
+
+
+    def __iter__( self ):
+        return iter( list( self._blocks ) )
+
+
+    def __len__( self ):
+        return len(self._blocks)
+
+
+    def __contains__( self, key ):
+        if isinstance( key, str ):
+            return self.get( key ) is not None
+        return key in self._blocks
+
+
+
+class BlendData:
+
+    def __init__( self ):
+        self.filepath    = ""
+        self.objects     = _DataObjects()
+        self.meshes      = _DataBlocks( Mesh )
+        self.collections = _DataBlocks( Collection )
+        self.actions     = _DataBlocks( Action )
+
+
+    def batch_remove( self, ids ):
+        for block in list( ids ):
+            if isinstance( block, Object ):
+                self.objects.remove( block )
+            elif isinstance( block, Mesh ):
+                self.meshes.remove( block )
+            elif isinstance( block, Collection ):
+                self.collections.remove( block )
+
+
+
+def _unique_name( blocks, name ):
+    if name not in blocks:
+        return name
+
+    for ind in itertools.count( 1 ):
+        candidate = "%s.%03d" % (name, ind)
+        if candidate not in blocks:
+            return candidate
+
+
+
+def _unlink_everywhere( obj ):
+    collections = [ context.scene.collection ] + list( data.collections )
+    for collection in collections:
+        if obj in collection.objects:
+            collection.objects.unlink( obj )
+
+
+
+# --------------------------------------------------------------------------
+# bpy.context, bpy.ops, bpy.utils, bpy.app
+
+class Region:
+
+    def __init__( self, width, height, x=0, y=0 ):
+        self.type   = 'WINDOW'
+        self.width  = width
+        self.height = height
+        self.x = x
+        self.y = y
+
+
+
+class RegionView3D:
+
+    def __init__( self, view_matrix, perspective_matrix, is_perspective ):
+        self.view_matrix        = mathutils.Matrix( view_matrix )
+        self.perspective_matrix = mathutils.Matrix( perspective_matrix )
+        self.is_perspective     = is_perspective
+
+
+
+class Event:
+
+    def __init__( self, type='NONE', value='NOTHING', mouse_x=0, mouse_y=0 ):
+        self.type    = type
+        self.value   = value
+        self.mouse_x = mouse_x
+        self.mouse_y = mouse_y
+
+
+
+class Screen:
+
+    def __init__( self ):
+        self.is_animation_playing = False
+
+
+
+class Window:
+
+    def __init__( self ):
+        self.screen = Screen()
+        # Running modal operators, Blender 4.2 and later.
+        self.modal_operators = []
+
+
+
+class WindowManager:
+
+    def __init__( self ):
+        self.modal_handlers = []
+        self.windows = [ Window() ]
+
+
+    def modal_handler_add( self, operator ):
+        self.modal_handlers.append( operator )
+        return True
+
+
+
+class Context:
+
+    def __init__( self ):
+        self.scene       = Scene( "Scene" )
+        self.view_layer  = ViewLayer( self.scene )
+        self.window_manager = WindowManager()
+        self.area        = None
+        self.region      = None
+        self.region_data = None
+        self.active_operator = None
+
+
+    @property
+    def selected_objects( self ):
+        return self.view_layer.objects.selected
+
+
+    @property
+    def active_object( self ):
+        return self.view_layer.objects.active
+
+
+
+class Operator( _Struct ):
+
+    def __init__( self ):
+        self.reports = []
+
+
+    def report( self, type, message ):
+        self.reports.append( (set( type ), message) )
+        reports.append( (set( type ), message) )
+
+
+
+class Panel( _Struct ):
+    pass
+
+
+
+class PropertyGroup( _Struct ):
+    pass
+
+
+
+class SpaceView3D( _Struct ):
+
+    draw_handlers = []
+
+    @classmethod
+    def draw_handler_add( cls, callback, args, region_type, draw_type ):
+        handle = (callback, args, region_type, draw_type)
+        cls.draw_handlers.append( handle )
+        return handle
+
+
+    @classmethod
+    def draw_handler_remove( cls, handle, region_type ):
+        cls.draw_handlers.remove( handle )
+
+
+
+types = _types.SimpleNamespace( ID=ID, Object=Object, Mesh=Mesh, Scene=Scene, Collection=Collection,
+                                Operator=Operator, Panel=Panel, PropertyGroup=PropertyGroup,
+                                SpaceView3D=SpaceView3D )
+
+
+
+def _register_class( cls ):
+    for klass in reversed( cls.__mro__ ):
+        for name, value in vars( klass ).get( "__annotations__", {} ).items():
+            if isinstance( value, _Property ):
+                setattr( cls, name, value )
+
+    idname = getattr( cls, "bl_idname", None )
+    if idname in _registered:
+        raise ValueError( "register_class(...): already registered as a subclass '%s'" % cls.__name__ )
+    _registered[idname if (idname is not None) else cls.__name__] = cls
+
+
+
+def _unregister_class( cls ):
+    idname = getattr( cls, "bl_idname", None )
+    key = idname if (idname is not None) else cls.__name__
+    if _registered.get( key, None ) is not cls:
+        raise RuntimeError( "unregister_class(...): missing bl_rna attribute from '%s' instance" % cls.__name__ )
+    del _registered[key]
+
+
+
+utils = _types.SimpleNamespace( register_class=_register_class, unregister_class=_unregister_class )
+
+
+
+class _OperatorCaller:
+
+    def __init__( self, idname ):
+        self.idname = idname
+
+
+    def poll( self ):
+        cls = _registered[self.idname]
+        return (not hasattr( cls, "poll" )) or cls.poll( context )
+
+
+    def __call__( self, *args, **kwargs ):
+        execution = args[0] if (len(args) > 0) else 'EXEC_DEFAULT'
+
+        if self.idname in _BUILTIN_OPERATORS:
+            return _BUILTIN_OPERATORS[self.idname]( **kwargs )
+
+        cls = _registered.get( self.idname, None )
+        if cls is None:
+            raise AttributeError( "Calling operator \"bpy.ops.%s\" error, could not be found" % self.idname )
+        if not self.poll():
+            raise RuntimeError( "Operator bpy.ops.%s.poll() failed, context is incorrect" % self.idname )
+
+        operator = cls()
+        for name, value in kwargs.items():
+            setattr( operator, name, value )
+
+        if execution.startswith( 'INVOKE' ) and hasattr( operator, "invoke" ):
+            result = operator.invoke( context, Event() )
+        else:
+            result = operator.execute( context )
+
+        if 'FINISHED' in result:
+            context.active_operator = operator
+        return result
+
+
+
+class _OperatorModule:
+
+    def __init__( self, name ):
+        self._name = name
+
+
+    def __getattr__( self, name ):
+        return _OperatorCaller( self._name + "." + name )
+
+
+
+class _Ops:
+
+    def __getattr__( self, name ):
+        return _OperatorModule( name )
+
+
+
+def _mode_set( mode='OBJECT', toggle=False ):
+    obj = context.active_object
+    if obj is None:
+        raise RuntimeError( "Operator bpy.ops.object.mode_set.poll() failed, context is incorrect" )
+    obj.mode = mode
+    return {'FINISHED'}
+
+
+
+_BUILTIN_OPERATORS = { "object.mode_set": _mode_set }
+
+ops = _Ops()
+
+
+
+class _Timers:
+
+    def __init__( self ):
+        self._functions = {}
+
+
+    def register( self, function, first_interval=0.0, persistent=False ):
+        self._functions[function] = first_interval
+
+
+    def unregister( self, function ):
+        del self._functions[function]
+
+
+    def is_registered( self, function ):
+        return function in self._functions
+
+
+    def run( self ):
+        """
+        Calls every registered function once, the way Blender's event loop
+        would after their intervals pass. Functions returning None are dropped.
+        """
+        for function in list( self._functions ):
+            interval = function()
+            if interval is None:
+                self._functions.pop( function, None )
+            else:
+                self._functions[function] = interval
+
+
+
+def _abspath( path ):
+    if path.startswith( "//" ):
+        return os.path.join( os.path.dirname( data.filepath ), path[2:] )
+    return path
+
+
+
+path = _types.SimpleNamespace( abspath=_abspath )
+
+
+
+# --------------------------------------------------------------------------
+# Module state.
+
+def reset():
+    """
+    Empty file: new data, context, registrations and counters.
+    """
+    global data, context, app, reports, _registered
+
+    data    = BlendData()
+    context = Context()
+    app     = _types.SimpleNamespace( handlers=_types.SimpleNamespace( depsgraph_update_post=[] ),
+                                      timers=_Timers() )
+    reports = []
+    _registered = {}
+    SpaceView3D.draw_handlers = []
+    stats["item_access"]   = 0
+    stats["foreach_calls"] = 0
+
+
+
+reset()
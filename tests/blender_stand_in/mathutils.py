@@ -0,0 +1,142 @@
+# Array-backed stand-in for the parts of Blender's mathutils the add-on uses:
+# 3D vectors and 4x4 matrices. Values are NumPy float64 arrays.
+
+import numpy as np
+
+
+
+class Vector:
+
+    def __init__( self, seq=(0.0, 0.0, 0.0) ):
+        self._v = np.array( seq, dtype=np.float64 ).ravel()
+
+
+    def __array__( self, dtype=None ):
+        return self._v.astype( dtype ) if (dtype is not None) else self._v.copy()
+
+
+    def __len__( self ):
+        return self._v.shape[0]
+
+
+    def __iter__( self ):
+        return iter( self._v.tolist() )
+
+
+    def __getitem__( self, ind ):
+        return float( self._v[ind] )
+
+
+    def __setitem__( self, ind, value ):
+        self._v[ind] = value
+
+
+    def __repr__( self ):
+        return "Vector(%s)" % ", ".join( "%.4f" % v for v in self._v )
+
+
+    def __add__( self, other ):
+        return Vector( self._v + np.asarray( other, dtype=np.float64 ) )
+
+
+    def __sub__( self, other ):
+        return Vector( self._v - np.asarray( other, dtype=np.float64 ) )
+
+
+    def __neg__( self ):
+        return Vector( -self._v )
+
+
+    def __mul__( self, scalar ):
+        return Vector( self._v * scalar )
+
+    __rmul__ = __mul__
+
+
+    def copy( self ):
+        return Vector( self._v )
+
+
+    @property
+    def length( self ):
+        return float( np.linalg.norm( self._v ) )
+
+
+    def _get_axis( ind ):
+        return property( lambda self: float( self._v[ind] ),
+                         lambda self, value: self._v.__setitem__( ind, value ) )
+
+    x = _get_axis( 0 )
+    y = _get_axis( 1 )
+    z = _get_axis( 2 )
+    w = _get_axis( 3 )
+    del _get_axis
+
+
+
+class Matrix:
+    """
+    Square matrix, rows as in Blender: np.array( matrix ) gives the usual
+    row-major layout, m @ v transforms 3D vectors as points.
+    """
+
+    def __init__( self, rows=None ):
+        if rows is None:
+            rows = np.identity( 4 )
+        self._m = np.array( rows, dtype=np.float64 )
+
+
+    @classmethod
+    def Identity( cls, size ):
+        return cls( np.identity( size ) )
+
+
+    @classmethod
+    def Translation( cls, vector ):
+        m = np.identity( 4 )
+        m[:3, 3] = np.asarray( vector, dtype=np.float64 )[:3]
+        return cls( m )
+
+
+    def __array__( self, dtype=None ):
+        return self._m.astype( dtype ) if (dtype is not None) else self._m.copy()
+
+
+    def __len__( self ):
+        return self._m.shape[0]
+
+
+    def __iter__( self ):
+        return iter( [ Vector( row ) for row in self._m ] )
+
+
+    def __getitem__( self, ind ):
+        return Vector( self._m[ind] )
+
+
+    def __repr__( self ):
+        return "Matrix(%s)" % self._m.tolist()
+
+
+    def __matmul__( self, other ):
+        if isinstance( other, Matrix ):
+            return Matrix( self._m @ other._m )
+
+        v = np.asarray( other, dtype=np.float64 )
+        if (v.shape[0] == 3) and (self._m.shape[0] == 4):
+            return Vector( self._m[:3, :3] @ v + self._m[:3, 3] )
+
+        return Vector( self._m @ v )
+
+
+    def inverted( self ):
+        return Matrix( np.linalg.inv( self._m ) )
+
+
+    def copy( self ):
+        return Matrix( self._m )
+
+
+    @property
+    def translation( self ):
+        return Vector( self._m[:3, 3] )
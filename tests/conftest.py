@@ -0,0 +1,116 @@
+# Operators of ui_panel.py run against the array-backed Blender stand-in in
+# blender_stand_in/. Time budgets depend on the machine and its load, they
+# are only checked if ARAP_TEST_BUDGET_SCALE is set, scaled by its value.
+# Memory budgets are peak Python allocations tracked by tracemalloc, which
+# NumPy reports its arrays to, they are always checked.
+
+import contextlib
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+TESTS_DIR = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.insert( 0, os.path.join( TESTS_DIR, "blender_stand_in" ) )
+sys.path.insert( 0, os.path.dirname( TESTS_DIR ) )
+
+import bpy
+import mathutils
+
+
+# None skips time budgets.
+BUDGET_SCALE = os.environ.get( "ARAP_TEST_BUDGET_SCALE", None )
+if BUDGET_SCALE is not None:
+    BUDGET_SCALE = float( BUDGET_SCALE )
+
+
+
+@pytest.fixture
+def blender():
+    """
+    Empty stand-in file with the add-on registered and its caches cleared.
+    """
+    bpy.reset()
+
+    import ui_panel
+    import arap_solver
+    import anchor_registry
+    import solve_history
+    import result_cache
+
+    ui_panel._mesh_cache.clear()
+    arap_solver._solvers.clear()
+    arap_solver._shared_solvers.clear()
+    anchor_registry._vert_inds_cache.clear()
+    solve_history._histories.clear()
+    result_cache._cache = None
+
+    ui_panel.register()
+    yield bpy
+
+
+
+@pytest.fixture
+def add_mesh_object( blender ):
+    """
+    add_mesh_object( name, Vs, Fs, matrix_world=None, select=True ) links
+    a new mesh object to the scene, selects it and makes it active.
+    """
+    def add( name, Vs, Fs, matrix_world=None, select=True ):
+        mesh_data = bpy.data.meshes.new( name )
+        mesh_data.from_pydata( Vs, [], Fs )
+        obj = bpy.data.objects.new( name, mesh_data )
+        if matrix_world is not None:
+            obj.matrix_world = mathutils.Matrix( matrix_world )
+        bpy.context.scene.collection.objects.link( obj )
+
+        if select:
+            for other in bpy.context.selected_objects:
+                other.select_set( False )
+            obj.select_set( True )
+            bpy.context.view_layer.objects.active = obj
+
+        return obj
+
+    return add
+
+
+
+class Usage:
+
+    def __init__( self ):
+        self.seconds      = 0.0
+        self.peak_mb      = 0.0
+        self.item_access  = 0
+
+
+
+@pytest.fixture
+def budget():
+    """
+    with budget( seconds, megabytes ) as usage: fails if the block allocates
+    more at peak, or takes longer if time budgets are checked.
+    """
+    @contextlib.contextmanager
+    def measure( seconds, megabytes ):
+        usage = Usage()
+        item_access = bpy.stats["item_access"]
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            yield usage
+        finally:
+            usage.seconds = time.perf_counter() - t0
+            usage.peak_mb = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+            tracemalloc.stop()
+            usage.item_access = bpy.stats["item_access"] - item_access
+
+        if BUDGET_SCALE is not None:
+            assert usage.seconds <= seconds * BUDGET_SCALE, "took %.3f s, budget %.3f s" % (usage.seconds, seconds * BUDGET_SCALE)
+        assert usage.peak_mb <= megabytes, "peak %.1f MB, budget %.1f MB" % (usage.peak_mb, megabytes)
+
+    return measure
+
@@ -0,0 +1,94 @@
+# The NumPy solvers against igl.ARAP: the same energy, the same result.
+
+import numpy as np
+import scipy.sparse
+
+import arap_solver
+import mesh_topology
+import sample_meshes
+
+
+
+def relative_diff( Vs_a, Vs_b, Vs_rest ):
+    diagonal = np.linalg.norm( np.ptp( Vs_rest, axis=0 ) )
+    return np.abs( Vs_a - Vs_b ).max() / diagonal
+
+
+
+def test_local_global_matches_igl():
+    Vs, Fs = sample_meshes.make_cylinder( 30, 32 )
+    vert_inds, targets = sample_meshes.make_bend_problem( Vs )
+
+    Vs_igl = arap_solver.ArapSolver( Vs, Fs, vert_inds ).solve( targets )
+    Vs_new = arap_solver.LocalGlobalSolver( Vs, Fs, vert_inds ).solve( targets )
+    assert relative_diff( Vs_new, Vs_igl, Vs ) < 1.0e-6
+
+
+
+def test_half_solve_matches_igl():
+    Vs, Fs = sample_meshes.make_cylinder( 30, 32, mirror_faces=True )
+    vert_inds, _ = sample_meshes.make_bend_problem( Vs )
+    targets = Vs[vert_inds].copy()
+    targets[targets[:, 2] > 0.0, 1] += 0.5
+    mirror_inds = mesh_topology.find_mirror_map( Vs, 0 )
+
+    Vs_igl = arap_solver.ArapSolver( Vs, Fs, vert_inds ).solve( targets )
+    Vs_half = arap_solver.SymmetricSolver( Vs, Fs, vert_inds, mirror_inds, 0 ).solve( targets )
+    assert relative_diff( Vs_half, Vs_igl, Vs ) < 1.0e-6
+
+
+
+def test_cg_backend_matches_igl_and_reports_convergence():
+    Vs, Fs = sample_meshes.make_cylinder( 30, 32 )
+    vert_inds, targets = sample_meshes.make_bend_problem( Vs )
+    Vs_igl = arap_solver.ArapSolver( Vs, Fs, vert_inds ).solve( targets )
+
+    solver = arap_solver.LocalGlobalSolver( Vs, Fs, vert_inds, global_step='CG', 
+                                            preconditioner='ILU', tolerance=1.0e-10 )
+    Vs_new = solver.solve( targets )
+    assert solver.converged
+    assert relative_diff( Vs_new, Vs_igl, Vs ) < 1.0e-6
+
+    # Too few iterations to get anywhere near the tolerance.
+    for system in solver.axis_systems:
+        system.max_iter = 1
+    solver.solve( targets )
+    assert not solver.converged
+
+
+
+def test_pcg_flags_iteration_limit():
+    A = mesh_topology.laplacian( 4, np.array( [0, 1, 2] ), np.array( [1, 2, 3] ), np.ones( 3 ) )
+    A = A + 1.0e-3 * scipy.sparse.identity( 4, format="csr" )
+    b = np.array( [1.0, 0.0, 0.0, -1.0] )
+    jacobi = lambda r: r
+
+    x, iterations, converged = arap_solver.pcg( A, b, np.zeros( 4 ), jacobi, 1.0e-12, 100 )
+    assert converged and np.allclose( A @ x, b )
+
+    x, iterations, converged = arap_solver.pcg( A, b, np.zeros( 4 ), jacobi, 1.0e-12, 1 )
+    assert (iterations, converged) == (1, False)
+
+
+
+def test_solver_cache_is_bounded_and_shares_instances( monkeypatch ):
+    monkeypatch.setattr( arap_solver, "_solvers", arap_solver.collections.OrderedDict() )
+    monkeypatch.setattr( arap_solver, "_shared_solvers", arap_solver.collections.OrderedDict() )
+    n = 10
+    Vs, Fs = sample_meshes.make_grid( n )
+    vert_inds = np.array( [0, n*n-1] )
+
+    first = arap_solver.get_solver( "Grid", Vs, Fs, vert_inds )
+    assert not first.shared
+    assert arap_solver.get_solver( "Grid", Vs, Fs, vert_inds ) is first
+    # Other options, another solver.
+    assert arap_solver.get_solver( "Grid", Vs, Fs, vert_inds, backend='DIRECT' ) is not first
+
+    # A moved copy reuses the precomputation.
+    copy = arap_solver.get_solver( "Copy", Vs + 1.0, Fs, vert_inds )
+    assert copy.shared and copy.solver is first
+
+    for ind in range( arap_solver.SOLVERS_MAX_QTY ):
+        arap_solver.get_solver( "Mesh %d" % ind, Vs * (ind + 2.0), Fs, vert_inds[:1] )
+    assert len( arap_solver._solvers ) == arap_solver.SOLVERS_MAX_QTY
+    assert "Grid" not in arap_solver._solvers
@@ -0,0 +1,57 @@
+# Distortion metrics against cases with known answers.
+
+import numpy as np
+
+import distortion
+import sample_meshes
+
+
+
+def rotation( angle ):
+    c, s = np.cos( angle ), np.sin( angle )
+    return np.array( [[c, 0.0, s], [0.0, 1.0, 0.0], [-s, 0.0, c]] )
+
+
+
+def test_rigid_motion_has_no_distortion():
+    Vs, Fs = sample_meshes.make_cylinder( 20, 24 )
+    Vs_new = Vs @ rotation( 0.7 ).T + (1.0, 2.0, 3.0)
+
+    strain, residual, rest_areas = distortion.face_distortion( Vs, Vs_new, Fs )
+    assert strain.max() < 1.0e-12
+    assert residual.max() < 1.0e-6
+    assert np.all( rest_areas > 0.0 )
+
+
+
+def test_stretch_matches_singular_values():
+    Vs, Fs = sample_meshes.make_grid( 20 )
+    Vs_new = Vs * (1.2, 0.9, 1.0)
+
+    strain, residual, rest_areas = distortion.face_distortion( Vs, Vs_new, Fs )
+    # Singular values 1.2 and 0.9 everywhere, axis aligned edges change the most.
+    assert np.allclose( residual, np.hypot( 0.2, 0.1 ) )
+    assert np.allclose( strain, 0.2 )
+
+    stats = distortion.summarize( residual, rest_areas )
+    assert np.isclose( stats["mean"], np.hypot( 0.2, 0.1 ) )
+    assert np.isclose( stats["p95"], stats["max"] )
+
+
+
+def test_vertex_values_average_incident_faces():
+    Vs = np.array( [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0], [5.0, 5.0, 5.0]] )
+    Fs = np.array( [[0, 1, 2], [1, 3, 2]] )
+    values = distortion.vertex_values( np.array( [1.0, 3.0] ), Fs, np.array( [0.5, 0.5] ), 5 )
+
+    assert np.allclose( values, [1.0, 2.0, 2.0, 3.0, 0.0] )
+
+
+
+def test_degenerate_faces_are_ignored():
+    Vs = np.array( [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [2.0, 0.0, 0.0]] )
+    Fs = np.array( [[0, 1, 2]] )
+    strain, residual, rest_areas = distortion.face_distortion( Vs, Vs * 3.0, Fs )
+
+    assert rest_areas[0] == 0.0
+    assert strain[0] == 0.0 and residual[0] == 0.0
@@ -0,0 +1,53 @@
+# Worker and thread counts and the environment workers inherit.
+
+import os
+import sys
+
+import execution_config
+
+
+
+def test_cores_are_split_between_workers( monkeypatch ):
+    monkeypatch.setattr( execution_config, "cpu_count", lambda: 8 )
+
+    assert execution_config.ExecutionConfig( 1 ).threads_per_worker == 8
+    assert execution_config.ExecutionConfig( 3 ).threads_per_worker == 2
+    assert execution_config.ExecutionConfig( 16 ).threads_per_worker == 1
+    assert execution_config.ExecutionConfig( 2, 3 ).threads_per_worker == 3
+
+
+
+def test_auto_config_doesnt_start_idle_workers( monkeypatch ):
+    monkeypatch.setattr( execution_config, "cpu_count", lambda: 8 )
+
+    config = execution_config.auto_config( 2 )
+    assert (config.workers, config.threads_per_worker) == (2, 4)
+
+    config = execution_config.auto_config( 100 )
+    assert (config.workers, config.threads_per_worker) == (8, 1)
+
+    config = execution_config.auto_config( 100, workers=2, threads=1 )
+    assert (config.workers, config.threads_per_worker) == (2, 1)
+
+
+
+def test_thread_env_is_restored( monkeypatch ):
+    monkeypatch.setenv( "OMP_NUM_THREADS", "7" )
+    monkeypatch.delenv( "OPENBLAS_NUM_THREADS", raising=False )
+
+    with execution_config.thread_env( 2 ):
+        assert os.environ["OMP_NUM_THREADS"] == "2"
+        assert os.environ["OPENBLAS_NUM_THREADS"] == "2"
+
+    assert os.environ["OMP_NUM_THREADS"] == "7"
+    assert "OPENBLAS_NUM_THREADS" not in os.environ
+
+
+
+def test_thread_limits_need_threadpoolctl( monkeypatch ):
+    monkeypatch.setitem( sys.modules, "threadpoolctl", None )
+    assert not execution_config.can_limit_threads()
+
+    # Still usable, just without effect on this process.
+    with execution_config.limit_threads( 1 ):
+        pass
@@ -0,0 +1,62 @@
+# Binary PLY faces: fixed size records and mixed polygons.
+
+import numpy as np
+
+import mesh_io
+
+
+
+def write_mixed_ply( file_path, Vs, polygons ):
+    """
+    Binary PLY with an int flag before and a uchar flag after the vertex list 
+    of every face, the way some exporters store materials and selection.
+    """
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              "element vertex %d\nproperty float x\nproperty float y\nproperty float z\n"
+              "element face %d\nproperty int material\nproperty list uchar int vertex_indices\n"
+              "property uchar selected\nend_header\n" % (Vs.shape[0], len(polygons)))
+    with open( file_path, "wb" ) as f:
+        f.write( header.encode( "ascii" ) )
+        f.write( Vs.astype( "<f4" ).tobytes() )
+        for face_ind, polygon in enumerate( polygons ):
+            f.write( np.int32( face_ind ).tobytes() )
+            f.write( np.uint8( len(polygon) ).tobytes() )
+            f.write( np.asarray( polygon, dtype="<i4" ).tobytes() )
+            f.write( np.uint8( 1 ).tobytes() )
+
+
+
+def test_mixed_polygons( tmp_path ):
+    rng = np.random.default_rng( 3 )
+    Vs = rng.random( (50, 3) )
+    # Long runs of quads, single triangles in between, alternation and an n-gon at the end.
+    sizes = [4]*40 + [3] + [4]*100 + [3, 4]*20 + [3]*5 + [5]
+    polygons = [ rng.choice( 50, size, replace=False ) for size in sizes ]
+    file_path = str( tmp_path / "mixed.ply" )
+    write_mixed_ply( file_path, Vs, polygons )
+
+    Vs_read, Fs = mesh_io.read_ply( file_path )
+
+    counts = np.array( sizes )
+    expected = mesh_io.fan_triangulate( np.concatenate( polygons ), np.cumsum( counts ) - counts, counts )
+    assert np.array_equal( Fs, expected )
+    assert np.allclose( Vs_read, Vs.astype( np.float32 ) )
+
+
+
+def test_mapped_mixed_polygons( tmp_path, monkeypatch ):
+    rng = np.random.default_rng( 4 )
+    Vs = rng.random( (200, 3) )
+    sizes = rng.choice( [3, 4, 4, 4, 6], size=3000 )
+    polygons = [ rng.choice( 200, size, replace=False ) for size in sizes ]
+    file_path = str( tmp_path / "mixed.ply" )
+    write_mixed_ply( file_path, Vs, polygons )
+    # Faces span many chunks, records straddle their ends.
+    monkeypatch.setattr( mesh_io, "PLY_FACES_CHUNK_SIZE", 997 )
+
+    Vs_read, Fs = mesh_io.read_ply( file_path, mmap=True )
+
+    counts = np.array( sizes )
+    expected = mesh_io.fan_triangulate( np.concatenate( polygons ), np.cumsum( counts ) - counts, counts )
+    assert np.array_equal( Fs, expected )
+    assert np.allclose( Vs_read, Vs.astype( np.float32 ) )
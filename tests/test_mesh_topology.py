@@ -0,0 +1,57 @@
+# Welding: what gets merged and how welded vertices are numbered.
+
+import numpy as np
+
+import mesh_topology
+import sample_meshes
+
+
+
+def test_weld_merges_pairs_straddling_cell_corners():
+    # Each pair is a few hundredths of the weld distance apart, but one 
+    # coordinate straddles a whole and another a half multiple of it.
+    Vs = np.array( [[0.99, 0.49, 0.0], [1.01, 0.51, 0.0], [5.0, 0.0, 0.0], 
+                    [2.49, 3.0, 2.99], [2.51, 3.0, 3.01], [7.0, 0.0, 0.0]] ) * 1.0e-3
+    Fs = np.array( [[0, 2, 5], [1, 3, 4]] )
+
+    weld = mesh_topology.weld_vertices( Vs, Fs, 1.0e-3 )
+
+    assert np.array_equal( weld.weld_map, [0, 0, 1, 2, 2, 3] )
+    assert np.array_equal( weld.rep_inds, [0, 2, 3, 5] )
+    # The second face collapsed.
+    assert np.array_equal( weld.Fs, [[0, 1, 3]] )
+
+
+
+def test_weld_joins_seams_only():
+    n = 20
+    Vs, Fs = sample_meshes.make_grid( n )
+    # A second copy of the first row, as a UV seam would leave it.
+    Vs = np.concatenate( (Vs, Vs[:n]) )
+    Fs = np.where( Fs < n, Fs + n*n, Fs )
+
+    weld = mesh_topology.weld_vertices( Vs, Fs, 1.0e-6 )
+
+    assert weld.verts_qty == n*n
+    assert np.array_equal( weld.weld_map[n*n:], np.arange( n ) )
+    assert weld.topology.island_labels()[0] == 1
+
+
+
+def test_k_ring_and_laplacians():
+    n = 6
+    Vs, Fs = sample_meshes.make_grid( n )
+    topology = mesh_topology.MeshTopology( Fs, n*n )
+
+    assert np.array_equal( topology.k_ring( [0], 1 ), [0, 1, n, n+1] )
+    assert topology.k_ring( [0], 2*n ).shape[0] == n*n
+
+    L = topology.uniform_laplacian()
+    assert np.array_equal( L.diagonal(), topology.degrees() )
+    assert np.allclose( L @ np.ones( n*n ), 0.0 )
+
+    # Cotangent weights reproduce linear functions away from the border.
+    L = topology.cotangent_laplacian( Vs )
+    inner = np.abs( Vs[:, :2] ).max( axis=1 ) < 0.49
+    assert np.allclose( (L @ Vs)[inner], 0.0 )
+    assert np.allclose( L @ np.ones( n*n ), 0.0 )
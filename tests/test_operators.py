@@ -0,0 +1,518 @@
+# The real operators of ui_panel.py on generated meshes: results and
+# time and memory budgets. Bulk paths must not touch vertices one by one.
+
+import types
+
+import numpy as np
+import pytest
+
+import bpy
+import mathutils
+
+import sample_meshes
+import ui_panel
+import anchor_registry
+
+
+
+def rigid_matrix( angle=0.4, translation=(0.3, -0.2, 1.0) ):
+    c, s = np.cos( angle ), np.sin( angle )
+    m = np.identity( 4 )
+    m[:2, :2] = [[c, -s], [s, c]]
+    m[:3, 3] = translation
+    return m
+
+
+
+def world_positions( obj, key_name=None ):
+    """
+    World space positions of a shape key, or of the vertices.
+    """
+    data = obj.data.vertices
+    if key_name is not None:
+        data = obj.data.shape_keys.key_blocks[key_name].data
+    co = np.empty( len(data)*3, dtype=np.float32 )
+    data.foreach_get( "co", co )
+    m = np.array( obj.matrix_world )
+    return co.reshape( (-1, 3) ).astype( np.float64 ) @ m[:3, :3].T + m[:3, 3]
+
+
+
+def pick( obj ):
+    obj.select_set( True )
+    bpy.context.view_layer.objects.active = obj
+    assert bpy.ops.mesh.igl_pick_meshes() == {'FINISHED'}
+
+
+
+def two_grids( n ):
+    Vs, Fs = sample_meshes.make_grid( n )
+    Vs = np.concatenate( (Vs, Vs + (2.0, 0.0, 0.0)) )
+    Fs = np.concatenate( (Fs, Fs + n*n) )
+    return Vs, Fs
+
+
+
+def test_register_unregister( blender ):
+    ui_panel.unregister()
+    assert len( bpy.app.handlers.depsgraph_update_post ) == 0
+    ui_panel.register()
+    assert bpy.context.scene.panel_settings.mode_enum == 'MESH_SELECT'
+
+
+
+def test_pick_mesh( add_mesh_object, budget ):
+    Vs, Fs = two_grids( 150 )
+    obj = add_mesh_object( "Grid", Vs, Fs, rigid_matrix() )
+
+    with budget( 3.0, 80.0 ) as usage:
+        pick( obj )
+
+    assert usage.item_access == 0
+    assert ui_panel.get_selected_mesh() is obj
+    assert obj.data.shape_keys.reference_key.name == "Basis"
+    assert len( obj["faces"] ) == Fs.size
+
+    Fs_picked, labels, island_defaults = ui_panel.get_mesh_islands( obj )
+    assert np.array_equal( Fs_picked, Fs )
+    assert labels.max() == 1
+    assert island_defaults.shape == (2, 3)
+
+
+
+def test_apply_transform_translates_rigidly( add_mesh_object, budget ):
+    n = 200
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs, rigid_matrix() )
+    pick( obj )
+
+    rest = world_positions( obj )
+    offset = np.array( [0.1, -0.25, 0.5] )
+    corners = np.array( [0, n-1, n*n-1] )
+    anchor_registry.add_anchors( obj, rest[corners] + offset, corners )
+
+    with budget( 6.0, 40.0 ) as usage:
+        result = bpy.ops.mesh.igl_apply_transform()
+
+    assert result == {'FINISHED'}
+    assert usage.item_access == 0
+    solved = world_positions( obj, ui_panel.ARAP_SHAPE_KEY )
+    assert np.abs( solved[corners] - (rest[corners] + offset) ).max() < 1.0e-5
+    # A fixed number of iterations, close to rigid but not exactly.
+    assert np.abs( solved - (rest + offset) ).max() < 1.0e-2
+    assert obj.data.shape_keys.key_blocks[ui_panel.ARAP_SHAPE_KEY].value == 1.0
+    assert len( ui_panel.get_solve_history( obj ).entries ) == 1
+
+    # Distortion was measured for the panel and written in one bulk call.
+    attribute = obj.data.attributes.get( ui_panel.DISTORTION_ATTRIBUTE )
+    assert attribute.domain == 'POINT'
+    distortion = np.empty( n*n, dtype=np.float32 )
+    attribute.data.foreach_get( "value", distortion )
+    assert distortion.max() < 0.05
+    stats = ui_panel.get_mesh_cache( obj )["distortion"]
+    assert stats["residual"]["max"] >= stats["residual"]["p95"] >= 0.0
+
+
+
+def test_apply_transform_keeps_fixed_vertices( add_mesh_object ):
+    n = 40
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+
+    fixed = np.zeros( n*n, dtype=bool )
+    fixed[:n] = True
+    ui_panel.set_fixed_mask( obj, fixed )
+
+    rest = world_positions( obj )
+    anchor_registry.add_anchors( obj, rest[[n*n-1]] + (0.0, 0.0, 0.3), [n*n-1] )
+    bpy.ops.mesh.igl_apply_transform()
+
+    solved = world_positions( obj, ui_panel.ARAP_SHAPE_KEY )
+    assert np.abs( solved[fixed] - rest[fixed] ).max() < 1.0e-5
+    assert abs( solved[n*n-1, 2] - 0.3 ) < 1.0e-4
+
+
+
+def top_view( context, size=800 ):
+    """
+    Orthographic view looking down -Z, region coordinates = size/2 * (1 + x, 1 + y).
+    """
+    context.region = bpy.Region( size, size, x=20, y=30 )
+    context.region_data = bpy.RegionView3D( np.identity( 4 ), np.diag( [1.0, 1.0, -0.1, 1.0] ), False )
+    return lambda p: (context.region.x + 0.5*size*(1.0 + p[0]), context.region.y + 0.5*size*(1.0 + p[1]))
+
+
+
+@pytest.mark.parametrize( "symmetry", ['NONE', 'X'] )
+def test_create_anchor_under_mouse( add_mesh_object, budget, symmetry ):
+    n = 201
+    Vs, Fs = sample_meshes.make_grid( n, size=1.5 )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    bpy.context.scene.panel_settings.symmetry_enum = symmetry
+    to_region = top_view( bpy.context )
+
+    operator = ui_panel.MyMouseOperator()
+    operator.invoke( bpy.context, bpy.Event() )
+
+    vert_ind = 57*n + 23
+    x, y = to_region( Vs[vert_ind] )
+    with budget( 0.5, 20.0 ) as usage:
+        operator.create_anchor( bpy.context, bpy.Event( 'LEFTMOUSE', 'RELEASE', x + 0.3, y - 0.2 ) )
+
+    # One vertex read for the anchor location, nothing per vertex.
+    assert usage.item_access <= 2
+
+    anchors = anchor_registry.get_anchors( obj )
+    inds = anchor_registry.get_anchor_vert_inds( obj )
+    assert inds[0] == vert_ind
+    assert np.allclose( np.array( anchors[0].location ), Vs[vert_ind], atol=1.0e-6 )
+
+    if symmetry == 'X':
+        mirror_ind = 57*n + (n-1-23)
+        assert list( inds ) == [vert_ind, mirror_ind]
+        assert anchors[0]['mirror'] is anchors[1]
+        assert anchors[1]['mirror'] is anchors[0]
+    else:
+        assert len( anchors ) == 1
+
+    assert operator.modal( bpy.context, bpy.Event( 'ESC', 'PRESS' ) ) == {'CANCELLED'}
+    assert len( bpy.types.SpaceView3D.draw_handlers ) == 0
+
+
+
+def test_pick_uses_displayed_normals( add_mesh_object ):
+    n = 41
+    Vs, Fs = sample_meshes.make_grid( n, size=1.5 )
+    # Faces away from the top view until the ARAP shape turns it over.
+    obj = add_mesh_object( "Grid", Vs, Fs[:, ::-1] )
+    pick( obj )
+    ui_panel.apply_to_mesh( obj, Vs * (1.0, -1.0, -1.0) )
+    to_region = top_view( bpy.context )
+
+    operator = ui_panel.MyMouseOperator()
+    operator.invoke( bpy.context, bpy.Event() )
+    vert_ind = 12*n + 30
+    x, y = to_region( Vs[vert_ind] * (1.0, -1.0, -1.0) )
+    assert operator.find_closest_vertex( bpy.context, bpy.Event( 'MOUSEMOVE', 'NOTHING', x, y ) ) == vert_ind
+
+    # Every way out removes the highlight.
+    operator.cancel( bpy.context )
+    assert len( bpy.types.SpaceView3D.draw_handlers ) == 0
+    assert bpy.context.scene.panel_settings.mode_enum != 'PICK_VERTICES'
+
+    bpy.context.scene.panel_settings.mode_enum = 'PICK_VERTICES'
+    operator.invoke( bpy.context, bpy.Event() )
+    assert bpy.ops.mesh.igl_reset() == {'FINISHED'}
+    assert operator.modal( bpy.context, bpy.Event( 'MOUSEMOVE', 'NOTHING', x, y ) ) == {'CANCELLED'}
+    assert len( bpy.types.SpaceView3D.draw_handlers ) == 0
+    assert bpy.context.scene.panel_settings.mode_enum == 'MESH_SELECT'
+
+
+
+def test_apply_to_mesh_round_trip( add_mesh_object, budget ):
+    Vs, Fs = sample_meshes.make_cylinder( 200, 200 )
+    obj = add_mesh_object( "Cylinder", Vs, Fs, rigid_matrix( 1.1, (3.0, 2.0, -1.0) ) )
+    pick( obj )
+
+    rest = ui_panel.get_rest_positions( obj, np.float64 )
+    Vs_new = rest * 1.5
+    with budget( 0.2, 10.0 ) as usage:
+        ui_panel.apply_to_mesh( obj, Vs_new )
+
+    assert usage.item_access == 0
+    assert np.abs( world_positions( obj, ui_panel.ARAP_SHAPE_KEY ) - Vs_new ).max() < 1.0e-4
+    # The rest pose is never modified.
+    assert np.abs( ui_panel.get_rest_positions( obj, np.float64 ) - rest ).max() == 0.0
+
+    assert bpy.ops.mesh.igl_apply_default_shape() == {'FINISHED'}
+    assert np.abs( ui_panel.get_displayed_positions( obj ) - Vs ).max() < 1.0e-5
+
+
+
+def test_bake_shape_keys( add_mesh_object ):
+    n = 30
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    anchor_registry.add_anchors( obj, Vs[[0, n*n-1]] + (0.0, 0.0, 0.2), [0, n*n-1] )
+
+    result = bpy.ops.mesh.igl_bake_animation( frame_start=1, frame_end=3, output_enum='SHAPE_KEYS' )
+    assert result == {'FINISHED'}
+
+    key_blocks = obj.data.shape_keys.key_blocks
+    fcurves = obj.data.shape_keys.animation_data.action.fcurves
+    for frame in (1, 2, 3):
+        name = "ARAP_bake_%04d" % frame
+        assert name in key_blocks
+        fcurve = fcurves.find( 'key_blocks["%s"].value' % name )
+        assert fcurve.evaluate( frame ) == 1.0
+        assert fcurve.evaluate( frame+1 ) == 0.0
+
+
+
+def test_weld_seams_join_islands( add_mesh_object ):
+    n = 30
+    Vs, Fs = sample_meshes.make_grid( n )
+    # Split the grid along x = 0 into two strips with duplicated seam vertices.
+    left = Vs[:, 0] <= 1.0e-9
+    dup = np.flatnonzero( left )
+    remap = np.arange( n*n )
+    remap[dup] = n*n + np.arange( dup.shape[0] )
+    Fs = Fs.copy()
+    left_faces = left[Fs].all( axis=1 )
+    Fs[left_faces] = remap[Fs[left_faces]]
+    Vs = np.concatenate( (Vs, Vs[dup]) )
+
+    obj = add_mesh_object( "Seams", Vs, Fs )
+    pick( obj )
+    assert ui_panel.get_mesh_islands( obj )[1].max() > 0
+
+    bpy.context.scene.panel_settings.weld_seams = True
+    assert ui_panel.get_mesh_islands( obj )[1].max() == 0
+
+    anchor_registry.add_anchors( obj, Vs[[0, n*n-1]] + (0.0, 0.0, 0.3), [0, n*n-1] )
+    bpy.ops.mesh.igl_apply_transform()
+    solved = world_positions( obj, ui_panel.ARAP_SHAPE_KEY )
+    assert np.abs( solved[dup] - solved[n*n:] ).max() < 1.0e-6
+    # Both strips moved with the anchors, none was held by island defaults.
+    assert solved[:, 2].min() > 0.2
+
+
+
+def test_cage_drives_bound_mesh( add_mesh_object, budget ):
+    cage_Vs, cage_Fs = sample_meshes.make_grid( 12, size=1.2 )
+    dense_Vs, dense_Fs = sample_meshes.make_grid( 300 )
+    dense_Vs[:, 2] = 0.02 * np.sin( 9.0 * dense_Vs[:, 0] )
+
+    dense = add_mesh_object( "Dense", dense_Vs, dense_Fs )
+    cage = add_mesh_object( "Cage", cage_Vs, cage_Fs )
+    pick( cage )
+
+    dense.select_set( True )
+    assert bpy.ops.mesh.igl_bind_targets() == {'FINISHED'}
+    assert ui_panel.get_cage_targets( cage ) == [dense]
+
+    offset = np.array( [0.0, 0.2, 0.4] )
+    corners = np.array( [0, 11, 143] )
+    anchor_registry.add_anchors( cage, cage_Vs[corners] + offset, corners )
+
+    with budget( 2.0, 30.0 ) as usage:
+        bpy.ops.mesh.igl_apply_transform()
+
+    assert usage.item_access == 0
+    solved = world_positions( dense, ui_panel.ARAP_SHAPE_KEY )
+    cage_solved = world_positions( cage, ui_panel.ARAP_SHAPE_KEY )
+    binding = ui_panel.get_cage_binding( cage, dense )
+    assert np.abs( solved - binding.deform( cage_solved ) ).max() < 1.0e-4
+    # Bound vertices are off no more than the cage is.
+    cage_error = np.abs( cage_solved - (cage_Vs + offset) ).max()
+    assert np.abs( solved - (dense_Vs + offset) ).max() < cage_error + 1.0e-3
+
+    # Kept while the bound mesh stays where it is, bound again once it moves.
+    assert ui_panel.get_cage_binding( cage, dense ) is binding
+    dense.matrix_world = mathutils.Matrix( rigid_matrix( 0.0, (0.1, 0.0, 0.0) ).tolist() )
+    moved = ui_panel.get_cage_binding( cage, dense )
+    assert moved is not binding
+    assert np.abs( moved.deform( cage_Vs ) - (dense_Vs + (0.1, 0.0, 0.0)) ).max() < 1.0e-3
+
+    assert bpy.ops.mesh.igl_unbind_targets() == {'FINISHED'}
+    assert ui_panel.get_cage_targets( cage ) == []
+
+
+
+def test_revisited_configuration_reuses_result( add_mesh_object, budget ):
+    n = 150
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+
+    corners = np.array( [0, n-1, n*n-1] )
+    anchor_registry.add_anchors( obj, Vs[corners] + (0.0, 0.0, 0.3), corners )
+    bpy.ops.mesh.igl_apply_transform()
+    first = world_positions( obj, ui_panel.ARAP_SHAPE_KEY )
+
+    ui_panel.apply_to_mesh( obj, Vs )
+    with budget( 0.5, 30.0 ) as usage:
+        assert bpy.ops.mesh.igl_apply_transform() == {'FINISHED'}
+
+    assert usage.item_access == 0
+    assert "Reused the result of an earlier solve" in [ text for _, text in bpy.reports ]
+    assert np.array_equal( world_positions( obj, ui_panel.ARAP_SHAPE_KEY ), first )
+    assert ui_panel.get_result_cache().hits == 1
+
+
+
+def test_automatic_backend_is_planned( add_mesh_object ):
+    n = 40
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    anchor_registry.add_anchors( obj, Vs[[0, n*n-1]] + (0.0, 0.0, 0.2), [0, n*n-1] )
+
+    settings = bpy.context.scene.panel_settings
+    # Automatic choice is opt-in, libigl's energy is the reference.
+    assert settings.backend_enum == 'IGL'
+    settings.backend_enum = 'AUTO'
+    plan = ui_panel.get_solve_plan( obj, 'AUTO', settings.preconditioner_enum )
+    assert plan.automatic and plan.seconds > 0.0 and plan.memory_bytes > 0.0
+    # Anchors and the island default are constrained.
+    assert ui_panel.get_problem_stats( obj ).free_qty() == n*n - 3
+
+    assert bpy.ops.mesh.igl_apply_transform( backend_enum='AUTO' ) == {'FINISHED'}
+    assert "Solving with %s" % plan.describe() in [ text for _, text in bpy.reports ]
+    assert ui_panel.get_solver_options( obj )["backend"] == plan.options["backend"]
+
+    # Solved before, nothing is planned for the cache hit.
+    del bpy.reports[:]
+    assert bpy.ops.mesh.igl_apply_transform( backend_enum='AUTO' ) == {'FINISHED'}
+    assert not any( text.startswith( "Solving with" ) for _, text in bpy.reports )
+
+    # Stats are kept until anchors or fixed vertices change.
+    stats = ui_panel.get_problem_stats( obj )
+    assert ui_panel.get_problem_stats( obj ) is stats
+    anchor_registry.add_anchors( obj, Vs[[n-1]], [n-1] )
+    assert ui_panel.get_problem_stats( obj ).free_qty() == n*n - 4
+    mask = np.zeros( n*n, dtype=bool )
+    mask[:n] = True
+    ui_panel.set_fixed_mask( obj, mask )
+    assert ui_panel.get_problem_stats( obj ).free_qty() == n*n - 4 - n
+
+    # A manual choice is only estimated.
+    manual = ui_panel.get_solve_plan( obj, 'CG', 'JACOBI' )
+    assert (manual.strategy, manual.automatic) == ("CG/JACOBI", False)
+
+
+
+def test_pick_builds_no_mirror_maps( add_mesh_object ):
+    Vs, Fs = sample_meshes.make_grid( 30 )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+
+    cache = ui_panel.get_mesh_cache( obj )
+    assert not any( key.startswith( "mirror_map_" ) for key in cache )
+
+    assert ui_panel.get_mirror_map( obj, 0 ) is not None
+    assert list( key for key in cache if key.startswith( "mirror_map_" ) ) == ["mirror_map_0"]
+
+
+
+def test_drag_is_solved_when_transform_ends( add_mesh_object ):
+    n = 30
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    corners = np.array( [0, n*n-1] )
+    anchor_registry.add_anchors( obj, Vs[corners] + (0.0, 0.0, 0.2), corners )
+
+    window = bpy.context.window_manager.windows[0]
+    history = ui_panel.get_solve_history( obj )
+    timers = bpy.app.timers
+
+    # Held still in the middle of a grab, no solve yet.
+    grab = types.SimpleNamespace( bl_idname="TRANSFORM_OT_translate" )
+    window.modal_operators.append( grab )
+    ui_panel.update_drag_preview( obj )
+    timers.run()
+    assert timers.is_registered( ui_panel.finish_drag ) and len( history.entries ) == 0
+
+    window.modal_operators.remove( grab )
+    timers.run()
+    assert not timers.is_registered( ui_panel.finish_drag ) and len( history.entries ) == 1
+
+    # A grab nobody ends is solved after the timeout.
+    window.modal_operators.append( grab )
+    ui_panel.update_drag_preview( obj )
+    ui_panel.finish_drag.moved_at -= ui_panel.DRAG_TIMEOUT
+    timers.run()
+    assert not timers.is_registered( ui_panel.finish_drag ) and len( history.entries ) == 2
+    window.modal_operators.remove( grab )
+
+    # Playback moving anchors isn't a drag.
+    window.screen.is_animation_playing = True
+    ui_panel.update_drag_preview( obj )
+    timers.run()
+    assert not timers.is_registered( ui_panel.finish_drag ) and len( history.entries ) == 2
+    window.screen.is_animation_playing = False
+
+
+
+def test_drag_is_solved_when_anchors_settle( add_mesh_object ):
+    n = 30
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    corners = np.array( [0, n*n-1] )
+    anchor_registry.add_anchors( obj, Vs[corners] + (0.0, 0.0, 0.2), corners )
+
+    # Blender before 4.2 doesn't list modal operators.
+    window = bpy.context.window_manager.windows[0]
+    del window.modal_operators
+
+    ui_panel.update_drag_preview( obj )
+    bpy.app.timers.run()
+    assert bpy.app.timers.is_registered( ui_panel.finish_drag )
+
+    ui_panel.finish_drag.moved_at -= ui_panel.DRAG_SETTLE_SECONDS
+    bpy.app.timers.run()
+    assert not bpy.app.timers.is_registered( ui_panel.finish_drag )
+    assert len( ui_panel.get_solve_history( obj ).entries ) == 1
+
+
+
+def test_distortion_follows_the_shape_shown( add_mesh_object ):
+    n = 30
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    corners = np.array( [0, n-1, n*n-1] )
+    anchor_registry.add_anchors( obj, Vs[corners] + (0.0, 0.0, 0.3), corners )
+    assert bpy.ops.mesh.igl_apply_transform() == {'FINISHED'}
+
+    def measured():
+        stats = ui_panel.get_mesh_cache( obj ).get( "distortion", None )
+        has_attribute = obj.data.attributes.get( ui_panel.DISTORTION_ATTRIBUTE ) is not None
+        assert (stats is not None) == has_attribute
+        return stats
+
+    solved = measured()
+    assert solved["residual"]["max"] > 0.0
+
+    assert bpy.ops.mesh.igl_apply_default_shape() == {'FINISHED'}
+    assert measured() is None
+    assert bpy.ops.mesh.igl_apply_default_shape() == {'FINISHED'}
+    assert measured()["residual"]["max"] == pytest.approx( solved["residual"]["max"], rel=1.0e-4 )
+
+    # A preview, or anything else written to the shape key, isn't measured.
+    ui_panel.apply_to_mesh( obj, Vs )
+    assert measured() is None
+    assert bpy.ops.mesh.igl_restore_solve( entry_ind=0 ) == {'FINISHED'}
+    assert measured()["residual"]["max"] == pytest.approx( solved["residual"]["max"], rel=1.0e-4 )
+
+    assert bpy.ops.mesh.igl_reset() == {'FINISHED'}
+    assert measured() is None
+
+
+
+def test_budget_changes_apply_right_away( add_mesh_object ):
+    n = 30
+    Vs, Fs = sample_meshes.make_grid( n )
+    obj = add_mesh_object( "Grid", Vs, Fs )
+    pick( obj )
+    corners = np.array( [0, n*n-1] )
+    anchor_registry.add_anchors( obj, Vs[corners] + (0.0, 0.0, 0.2), corners )
+    assert bpy.ops.mesh.igl_apply_transform() == {'FINISHED'}
+    anchor_registry.get_anchors( obj )[0].location = (0.0, 0.0, 0.4)
+    assert bpy.ops.mesh.igl_apply_transform() == {'FINISHED'}
+
+    import solve_history
+    import result_cache
+
+    settings = bpy.context.scene.panel_settings
+    assert len( solve_history.find_history( obj.name ).entries ) == 2
+    settings.history_budget_mb = 0.0
+    # The latest solve is always kept.
+    assert len( solve_history.find_history( obj.name ).entries ) == 1
+    settings.result_cache_mb = 0.0
+    assert len( result_cache.find_cache().entries ) == 0
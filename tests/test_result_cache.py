@@ -0,0 +1,55 @@
+# Result cache keys and the memory budget.
+
+import numpy as np
+
+import result_cache
+import sample_meshes
+
+
+
+def test_nearby_targets_share_a_key():
+    Vs, Fs = sample_meshes.make_grid( 20 )
+    inds = np.array( [0, 399] )
+    targets = Vs[inds] + (0.0, 0.0, 0.5)
+
+    key = result_cache.make_key( "Grid", Vs, inds, targets )
+    assert result_cache.make_key( "Grid", Vs, inds, targets + 1.0e-9 ) == key
+    assert result_cache.make_key( "Grid", Vs, inds, targets + 1.0e-3 ) != key
+    assert result_cache.make_key( "Grid", Vs, inds[::-1], targets ) != key
+    assert result_cache.make_key( "Grid", Vs * 2.0, inds, targets ) != key
+    assert result_cache.make_key( "Grid", Vs, inds, targets, ('CG',) ) != key
+
+
+
+def test_least_recently_used_poses_go_first():
+    pose_bytes = 100 * 3 * 8
+    cache = result_cache.ResultCache( 2 * pose_bytes )
+    poses = [ np.full( (100, 3), float(i) ) for i in range(3) ]
+
+    cache.put( "a", poses[0] )
+    cache.put( "b", poses[1] )
+    assert cache.get( "a" ) is poses[0]
+    cache.put( "c", poses[2] )
+
+    assert cache.get( "b" ) is None
+    assert cache.get( "a" ) is poses[0]
+    assert cache.nbytes() == 2 * pose_bytes
+    assert not cache.get( "c" ).flags.writeable
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # Too big to keep at all.
+    cache.put( "d", np.zeros( (1000, 3) ) )
+    assert cache.get( "d" ) is None
+    assert len( cache.entries ) == 2
+
+
+
+def test_drop_mesh():
+    cache = result_cache.ResultCache( 1 << 20 )
+    Vs = np.zeros( (10, 3) )
+    cache.put( ("Grid", 1), Vs )
+    cache.put( ("Cube", 1), Vs.copy() )
+
+    cache.drop( "Grid" )
+    assert list( cache.entries ) == [("Cube", 1)]
+    assert cache.nbytes() == Vs.nbytes
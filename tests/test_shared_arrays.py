@@ -0,0 +1,78 @@
+# Shared memory arrays: round trips, unlinking after errors and frames
+# solved by worker processes in place.
+
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+
+import arap_solver
+import sample_meshes
+import shared_arrays
+
+
+
+def test_share_and_attach_round_trip():
+    Vs = np.random.default_rng( 1 ).random( (5000, 3) )
+    small = np.arange( 4, dtype=np.int32 )
+
+    with shared_arrays.SharedArrays() as shared:
+        args = shared.share( (Vs, ("IGL", small), 0.5) )
+        assert isinstance( args[0], shared_arrays.SharedArray )
+        # Small arrays and anything else stay as they are.
+        assert args[1][1] is small
+        assert args[2] == 0.5
+
+        with shared_arrays.attached( args ) as views:
+            assert np.array_equal( views[0], Vs )
+            views[0][0] = -1.0
+            del views
+
+        # A single handle attaches as well.
+        with shared_arrays.attached( args[0] ) as view:
+            assert view[0, 0] == -1.0
+            del view
+
+    with pytest.raises( FileNotFoundError ):
+        shared_memory.SharedMemory( name=args[0].name )
+
+
+
+def test_blocks_are_unlinked_when_solve_fails():
+    with pytest.raises( RuntimeError ):
+        with shared_arrays.SharedArrays() as shared:
+            handle, result = shared.empty( (10, 3), np.float32 )
+            raise RuntimeError( "cancelled" )
+
+    with pytest.raises( FileNotFoundError ):
+        shared_memory.SharedMemory( name=handle.name )
+
+
+
+def test_released_blocks_are_unlinked():
+    shared = shared_arrays.SharedArrays()
+    handles = (shared.put( np.ones( 100 ) ), shared.put( np.zeros( 3 ) ))
+    shared.release( handles )
+
+    for handle in handles:
+        with pytest.raises( FileNotFoundError ):
+            shared_memory.SharedMemory( name=handle.name )
+    shared.close()
+
+
+
+def test_workers_write_frames_in_place():
+    n = 20
+    Vs, Fs = sample_meshes.make_grid( n )
+    vert_inds = np.array( [0, n-1, n*n-1] )
+    lift = np.linspace( 0.0, 0.3, 6 )[:, None, None] * (0.0, 0.0, 1.0)
+    targets = Vs[vert_inds][None] + lift
+
+    solver = arap_solver.ArapSolver( Vs, Fs, vert_inds )
+    frames, converged = arap_solver.solve_frames( solver, targets, chunks=2 )
+    assert converged
+
+    assert frames.shape == (6, n*n, 3)
+    # Every chunk starts from the rest pose, so each frame matches its own solve.
+    for frame_ind in (0, 3):
+        assert np.abs( frames[frame_ind] - solver.solve( targets[frame_ind] ) ).max() < 1.0e-6
+    assert np.abs( frames[:, vert_inds] - targets ).max() < 1.0e-5
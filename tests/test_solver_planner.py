@@ -0,0 +1,79 @@
+# Solver planner choices and calibration from benchmark timings.
+
+import json
+
+import numpy as np
+
+import solver_planner
+
+
+# Direct backends faster than iterative ones, as on most machines.
+CALIBRATION = { "fill": 5.0,
+                "time": { "IGL":          [1.0e-6, 1.1],
+                          "DIRECT":       [2.0e-6, 1.1],
+                          "CG/JACOBI":    [1.0e-5, 1.3],
+                          "CG/ILU":       [5.0e-6, 1.2],
+                          "CG/MULTIGRID": [2.0e-5, 1.0] } }
+
+
+
+def test_fastest_backend_that_fits_wins():
+    stats = solver_planner.ProblemStats( 1000000, 2000000, 1, 10 )
+
+    unlimited = solver_planner.plan( stats, CALIBRATION, available_bytes=1 << 50 )
+    assert unlimited.strategy == "IGL"
+    assert unlimited.automatic
+
+    tight = solver_planner.plan( stats, CALIBRATION, available_bytes=2 << 30 )
+    assert tight.strategy.startswith( "CG/" )
+    assert tight.memory_bytes <= solver_planner.MEMORY_SHARE * (2 << 30)
+    assert tight.options["backend"] == "CG"
+
+    # Nothing fits, the least memory wins.
+    starved = solver_planner.plan( stats, CALIBRATION, available_bytes=1 << 20 )
+    assert not starved.fits
+    assert starved.strategy == "CG/JACOBI"
+
+
+
+def test_half_solves_cant_use_igl():
+    stats = solver_planner.ProblemStats( 1000, symmetric=True )
+    assert "IGL" not in solver_planner.available_strategies( stats )
+    assert solver_planner.plan( stats, CALIBRATION, available_bytes=1 << 40 ).strategy == "DIRECT"
+    assert stats.free_qty() == 500
+
+
+
+def test_islands_reduce_fill_in():
+    calibration = solver_planner.DEFAULT_CALIBRATION
+    one   = solver_planner.ProblemStats( 100000, islands_qty=1 )
+    split = solver_planner.ProblemStats( 100000, islands_qty=100 )
+    assert solver_planner.factor_nnz( split, calibration ) < solver_planner.factor_nnz( one, calibration )
+
+
+
+def test_calibration_from_benchmark_timings( tmp_path ):
+    timings = { "IGL": [ (1000, 2.0e-3), (10000, 2.0e-2), (100000, 0.2) ],
+                "CG/ILU": [ (1000, 5.0e-3) ] }
+    fills = [ (1000, 4.0 * 1000 * np.log2( 1000 )), (4000, 6.0 * 4000 * np.log2( 4000 )) ]
+    calibration = solver_planner.fit_calibration( timings, fills )
+
+    assert np.allclose( calibration["time"]["IGL"], [2.0e-6, 1.0] )
+    # A single size keeps the default exponent.
+    p = solver_planner.DEFAULT_CALIBRATION["time"]["CG/ILU"][1]
+    assert np.isclose( calibration["time"]["CG/ILU"][1], p )
+    assert np.isclose( calibration["fill"], 5.0 )
+
+    path = str( tmp_path / "calibration.json" )
+    solver_planner.save_calibration( calibration, path )
+    loaded = solver_planner.load_calibration( path )
+    assert np.allclose( loaded["time"]["IGL"], calibration["time"]["IGL"] )
+    # Strategies the benchmark didn't measure keep their defaults.
+    assert loaded["time"]["DIRECT"] == solver_planner.DEFAULT_CALIBRATION["time"]["DIRECT"]
+
+    stats = solver_planner.ProblemStats( 100000 )
+    assert np.isclose( solver_planner.estimate( stats, "IGL", loaded ).seconds, 0.2, rtol=1.0e-6 )
+
+    with open( path, "w" ) as f:
+        f.write( "not json" )
+    assert solver_planner.load_calibration( path ) is solver_planner.DEFAULT_CALIBRATION
@@ -12,14 +12,12 @@ bl_info = {
 
 
 import bpy
-import bmesh
 import mathutils
-from bpy_extras.view3d_utils import location_3d_to_region_2d
-from bpy_extras.view3d_utils import region_2d_to_vector_3d
 
 
 import sys
 import os
+import contextlib
 
 dir = os.path.dirname(bpy.data.filepath)
 if not dir in sys.path:
@@ -28,6 +26,44 @@ if not dir in sys.path:
 import install_needed_packages
 
 
+SOLVER_BACKEND_ITEMS = [("IGL", "libigl", "igl.ARAP with a direct sparse factorization"), 
+                        ("DIRECT", "direct", "NumPy ARAP with a SciPy sparse factorization"), 
+                        ("CG", "CG", "Preconditioned conjugate gradients, memory linear in the mesh size"), 
+                        ("AUTO", "automatic", "The backend estimated to be the fastest for this mesh which fits in memory. "
+                                              "Results may differ slightly from libigl's")]
+
+NOT_CONVERGED_MESSAGE = "Conjugate gradients stopped at the iteration limit, the result may be off. Try another preconditioner or a direct solver"
+
+PRECONDITIONER_ITEMS = [("JACOBI", "Jacobi", "Diagonal preconditioner, the least memory"), 
+                        ("ILU", "ILU", "Incomplete factorization, the fewest iterations"), 
+                        ("MULTIGRID", "multigrid", "Algebraic multigrid, needs the pyamg package")]
+
+
+def on_weld_changed( self, context ):
+    """
+    Islands, mirror maps and previews are built on the welded mesh, 
+    they are stale once welding changes.
+    """
+    for cache in _mesh_cache.values():
+        for key in list( cache.keys() ):
+            if key in ("islands", "drag_preview", "problem_stats") or key.startswith( "mirror_map_" ):
+                del cache[key]
+
+
+
+def on_history_settings_changed( self, context ):
+    import solve_history
+
+    solve_history.set_limits( int( self.history_budget_mb * 1024.0 * 1024.0 ), self.history_sparse )
+
+
+def on_result_cache_changed( self, context ):
+    import result_cache
+
+    result_cache.set_budget( int( self.result_cache_mb * 1024.0 * 1024.0 ) )
+
+
+
 class PanelSettings(bpy.types.PropertyGroup):
     mode_enum : bpy.props.EnumProperty(
         name = "PanelMode", 
@@ -53,6 +89,200 @@ class PanelSettings(bpy.types.PropertyGroup):
         description="The name of the selected mesh"
     )
 
+    symmetric_solve : bpy.props.BoolProperty(
+        name="Solve one half", 
+        description="With symmetry enabled solve only one half of a mirror symmetric mesh and mirror the result", 
+        default=False
+    )
+
+    backend_enum : bpy.props.EnumProperty(
+        name = "Solver", 
+        description="Global step solver", 
+        items = SOLVER_BACKEND_ITEMS, 
+        default='IGL'
+    )
+
+    preconditioner_enum : bpy.props.EnumProperty(
+        name = "Preconditioner", 
+        description="Preconditioner for conjugate gradients", 
+        items = PRECONDITIONER_ITEMS, 
+        default='ILU'
+    )
+
+    cg_tolerance : bpy.props.FloatProperty(
+        name="Tolerance", 
+        description="Conjugate gradients stop when the residual drops below this fraction of the right hand side", 
+        default=1.0e-6, 
+        min=1.0e-12, 
+        precision=8
+    )
+
+    solver_threads : bpy.props.IntProperty(
+        name="Threads", 
+        description="Native BLAS/OpenMP threads per solving process, 0 uses all cores. Parallel bakes split the cores between chunks", 
+        default=0, 
+        min=0
+    )
+
+    precision_enum : bpy.props.EnumProperty(
+        name = "Precision", 
+        description="Precision vertex positions are kept in. Only the sparse solve itself runs in double precision", 
+        items = [("FLOAT32", "float32", "Single precision, the same as Blender stores meshes in. Half the memory"), 
+                 ("FLOAT64", "float64", "Double precision everywhere")], 
+        default='FLOAT64'
+    )
+
+    history_budget_mb: bpy.props.FloatProperty(
+        name="History budget, MB", 
+        description="Memory solve history may take, the oldest solves are dropped first", 
+        default=64.0, 
+        min=0.0, 
+        update=on_history_settings_changed
+    )
+
+    history_sparse: bpy.props.BoolProperty(
+        name="Sparse history", 
+        description="Store only vertices moved by a solve", 
+        default=True, 
+        update=on_history_settings_changed
+    )
+
+    result_cache_mb: bpy.props.FloatProperty(
+        name="Result cache, MB", 
+        description="Memory results of earlier solves may take. Solving an anchor configuration again applies its result right away, 0 disables", 
+        default=128.0, 
+        min=0.0, 
+        update=on_result_cache_changed
+    )
+
+    drag_preview: bpy.props.BoolProperty(
+        name="Preview while dragging", 
+        description="Show a fast harmonic blend while anchors are moved and solve when the move is done", 
+        default=False
+    )
+
+    measure_distortion: bpy.props.BoolProperty(
+        name="Measure distortion", 
+        description="After each solve write how far faces are from rigid to the \"arap_distortion\" attribute and show statistics", 
+        default=True
+    )
+
+    weld_seams: bpy.props.BoolProperty(
+        name="Weld seams", 
+        description="Solve as if coincident vertices split by UV or normal seams were merged, so the seams don't fall apart into islands", 
+        default=False, 
+        update=on_weld_changed
+    )
+
+    weld_distance: bpy.props.FloatProperty(
+        name="Weld distance", 
+        description="Vertices closer than this are merged for solving", 
+        default=1.0e-5, 
+        min=0.0, 
+        precision=6, 
+        update=on_weld_changed
+    )
+
+
+# Data derived from picked meshes which is too big or too slow to keep in 
+# ID properties. It is rebuilt on demand, for example, after Blender restarts.
+_mesh_cache = {}
+
+
+def get_mesh_cache( mesh ):
+    cache = _mesh_cache.setdefault( mesh.name, {} )
+    return cache
+
+
+def get_mirror_map( mesh, axis ):
+    """
+    For every vertex the index of its mirror vertex with respect to the world 
+    plane "axis" = 0 or None if the mesh isn't symmetric. Built on first use, 
+    only for the axes symmetry is actually used with.
+    """
+    import numpy as np
+
+    cache = get_mesh_cache( mesh )
+    key = "mirror_map_%d" % axis
+    if key not in cache:
+        Vs = get_solve_positions( mesh, np.float64 )
+        cache[key] = get_solve_topology( mesh ).mirror_map( Vs, axis )
+
+    return cache[key]
+
+
+def get_mesh_topology( mesh, Fs=None ):
+    """
+    Vertex adjacency and vertex to face index of the picked mesh.
+    """
+    import mesh_topology
+
+    cache = get_mesh_cache( mesh )
+    if "topology" not in cache:
+        if Fs is None:
+            Fs = faces_to_2d_array( mesh["faces"] )
+        cache["topology"] = mesh_topology.MeshTopology( Fs, len(mesh.data.vertices) )
+
+    return cache["topology"]
+
+
+def get_weld( mesh ):
+    """
+    mesh_topology.WeldMap the mesh is solved with if "Weld seams" is on, 
+    otherwise None.
+    """
+    import numpy as np
+    import mesh_topology
+
+    settings = bpy.context.scene.panel_settings
+    if not settings.weld_seams:
+        return None
+
+    distance = settings.weld_distance
+    cache = get_mesh_cache( mesh )
+    cached = cache.get( "weld", None )
+    if (cached is None) or (cached[0] != distance):
+        Vs = get_rest_positions( mesh, np.float64 )
+        weld = mesh_topology.weld_vertices( Vs, get_mesh_topology( mesh ).Fs, distance )
+        cached = (distance, weld)
+        cache["weld"] = cached
+
+    return cached[1]
+
+
+def get_solve_topology( mesh ):
+    """
+    Topology of the mesh the solver sees, welded or not.
+    """
+    weld = get_weld( mesh )
+    if weld is None:
+        return get_mesh_topology( mesh )
+
+    return weld.topology
+
+
+def get_solve_positions( mesh, dtype=None ):
+    """
+    Rest positions of the vertices the solver sees.
+    """
+    Vs = get_rest_positions( mesh, dtype )
+    weld = get_weld( mesh )
+    if weld is None:
+        return Vs
+
+    return weld.weld_positions( Vs )
+
+
+def unweld_positions( mesh, Vs ):
+    """
+    Solver results for every vertex of the mesh, "Vs" may also be a stack of frames.
+    """
+    weld = get_weld( mesh )
+    if weld is None:
+        return Vs
+
+    return weld.unweld_positions( Vs )
+
 
 def get_selected_mesh():
     name = bpy.context.scene.panel_settings.mesh_name
@@ -73,26 +303,111 @@ def set_selected_mesh( mesh ):
     bpy.context.scene.panel_settings.mesh_name = name
 
 
-def get_fixed_verts( mesh ):
-    fixed_verts = set( () )
+# Boolean point attribute marking fixed vertices.
+FIXED_ATTRIBUTE = "arap_fixed"
+
+
+def get_fixed_mask( mesh ):
+    """
+    Boolean array, True for fixed vertices. Read with a single bulk call.
+    In edit mode the attribute is only up to date after switching to object mode.
+    """
+    import numpy as np
+
+    verts_qty = len(mesh.data.vertices)
+    mask = np.zeros( verts_qty, dtype=bool )
+
+    attribute = mesh.data.attributes.get( FIXED_ATTRIBUTE, None )
+    if attribute is not None:
+        attribute.data.foreach_get( "value", mask )
+
+    # Older versions kept indices as a list of floats.
+    elif 'fixed_verts' in mesh:
+        inds = np.array( mesh['fixed_verts'], dtype=np.int64 )
+        mask[inds[inds < verts_qty]] = True
+
+    return mask
+
+
+def set_fixed_mask( mesh, mask ):
+    """
+    Stores the fixed vertex mask in the mesh. Needs object mode.
+    """
+    import numpy as np
+
+    attributes = mesh.data.attributes
+    attribute = attributes.get( FIXED_ATTRIBUTE, None )
+    if (attribute is not None) and ((attribute.data_type != 'BOOLEAN') or (attribute.domain != 'POINT')):
+        attributes.remove( attribute )
+        attribute = None
+
+    if attribute is None:
+        attribute = attributes.new( name=FIXED_ATTRIBUTE, type='BOOLEAN', domain='POINT' )
+
+    attribute.data.foreach_set( "value", np.ascontiguousarray( mask, dtype=bool ) )
 
     if 'fixed_verts' in mesh:
-        fixed_verts_float = mesh['fixed_verts']
-        for vert_ind in fixed_verts_float:
-            vert_ind = int( vert_ind )
-            fixed_verts.add( vert_ind )
+        del mesh['fixed_verts']
+
+    # The planner's constraint count includes fixed vertices.
+    get_mesh_cache( mesh ).pop( "problem_stats", None )
+
+
+def get_fixed_verts( mesh ):
+    """
+    Sorted indices of fixed vertices.
+    """
+    import numpy as np
+
+    return np.flatnonzero( get_fixed_mask( mesh ) )
+
+
+def get_vertex_selection( mesh ):
+    import numpy as np
 
-    return fixed_verts
+    mask = np.empty( len(mesh.data.vertices), dtype=bool )
+    mesh.data.vertices.foreach_get( "select", mask )
+    return mask
 
 
-def set_fixed_verts( mesh, fixed_verts ):
-    # Convert to float and store in the mesh.
-    fixed_verts_float = []
-    for vert_ind in fixed_verts:
-        vert_ind = float( vert_ind )
-        fixed_verts_float.append( vert_ind )
+def set_vertex_selection( mesh, mask ):
+    """
+    Selects exactly the vertices in "mask", edges and faces follow their vertices.
+    Needs object mode.
+    """
+    import numpy as np
+
+    data = mesh.data
+    data.vertices.foreach_set( "select", mask )
+
+    edge_verts = np.empty( len(data.edges)*2, dtype=np.int32 )
+    data.edges.foreach_get( "vertices", edge_verts )
+    data.edges.foreach_set( "select", mask[edge_verts].reshape( (-1, 2) ).all( axis=1 ) )
+
+    polygons_qty = len(data.polygons)
+    if polygons_qty > 0:
+        loop_starts = np.empty( polygons_qty, dtype=np.int32 )
+        loop_verts  = np.empty( len(data.loops), dtype=np.int32 )
+        data.polygons.foreach_get( "loop_start", loop_starts )
+        data.loops.foreach_get( "vertex_index", loop_verts )
+        data.polygons.foreach_set( "select", np.logical_and.reduceat( mask[loop_verts], loop_starts ) )
+
+
+@contextlib.contextmanager
+def object_mode_data( mesh ):
+    """
+    Mesh data can only be read and written in bulk in object mode, 
+    edit mode keeps its own copy. Switches to object mode and back.
+    """
+    in_edit_mode = (mesh.mode == 'EDIT')
+    if in_edit_mode:
+        bpy.ops.object.mode_set( mode='OBJECT' )
 
-    mesh['fixed_verts'] = fixed_verts_float
+    try:
+        yield mesh.data
+    finally:
+        if in_edit_mode:
+            bpy.ops.object.mode_set( mode='EDIT' )
 
 
 
@@ -190,6 +505,8 @@ class VIEW3D_PT_igl_panel(bpy.types.Panel):
 
 
     def _ui_adding_ref_points( self, context ):
+        import execution_config
+
         layout = self.layout
     
         layout.operator( "mesh.igl_reset", text="Back to picking a mesh" )
@@ -201,26 +518,129 @@ class VIEW3D_PT_igl_panel(bpy.types.Panel):
         row = layout.row()
         panel_settings = bpy.context.scene.panel_settings
         row.prop(panel_settings, 'symmetry_enum', expand=True)
+        layout.prop( panel_settings, 'symmetric_solve' )
         
         layout.label( text="Click to add anchors" )
         layout.operator( "mesh.igl_create_anchor", text="Add an anchor(s)" )
+        layout.operator( "mesh.igl_import_anchors", text="Import anchors" )
         
         layout.separator()
+        layout.prop( panel_settings, 'precision_enum', expand=True )
         # Create a simple row.
         layout.label( text="Apply transform" )
-        layout.operator( "mesh.igl_apply_transform", text="Apply" )
+        layout.prop( panel_settings, 'backend_enum' )
+        plan = get_solve_plan( get_selected_mesh(), panel_settings.backend_enum, panel_settings.preconditioner_enum )
+        if plan is not None:
+            layout.label( text=("Chosen: %s" if plan.automatic else "Estimate: %s") % plan.describe() )
+            if not plan.fits:
+                layout.label( text="May not fit in the memory available", icon='ERROR' )
+        if panel_settings.backend_enum == 'AUTO':
+            layout.label( text="Results may differ slightly from libigl's", icon='INFO' )
+        if panel_settings.backend_enum == 'CG':
+            layout.prop( panel_settings, 'preconditioner_enum' )
+        if panel_settings.backend_enum in ('CG', 'AUTO'):
+            layout.prop( panel_settings, 'cg_tolerance' )
+        layout.prop( panel_settings, 'solver_threads' )
+        if not execution_config.can_limit_threads():
+            layout.label( text="Only parallel bakes are limited without threadpoolctl", icon='INFO' )
+        op = layout.operator( "mesh.igl_apply_transform", text="Apply" )
+        op.backend_enum        = panel_settings.backend_enum
+        op.preconditioner_enum = panel_settings.preconditioner_enum
+        op.cg_tolerance        = panel_settings.cg_tolerance
+        layout.prop( panel_settings, 'drag_preview' )
+        layout.prop( panel_settings, 'weld_seams' )
+        if panel_settings.weld_seams:
+            layout.prop( panel_settings, 'weld_distance' )
+
+        layout.separator()
+        targets_qty = len( get_cage_targets( get_selected_mesh() ) )
+        layout.label( text="Meshes driven by this one: %d" % targets_qty )
+        row = layout.row()
+        row.operator( "mesh.igl_bind_targets", text="Bind selected" )
+        row.operator( "mesh.igl_unbind_targets", text="Unbind" )
 
         layout.separator()
         # Create a simple row.
-        layout.label( text="Show original shape" )
+        mesh = get_selected_mesh()
+        key_block = get_arap_shape_key( mesh ) if (mesh is not None) else None
+        if (key_block is not None) and (key_block.value <= 0.0):
+            layout.label( text="Show deformed shape" )
+        
+        else:
+            layout.label( text="Show original shape" )
         layout.operator( "mesh.igl_apply_default_shape", text="Show" )
 
+        self._ui_distortion( context )
+        self._ui_solve_history( context )
+
+        layout.separator()
+        layout.label( text="Bake anchor animation" )
+        layout.operator( "mesh.igl_bake_animation", text="Bake" )
+
         #layout.label( text="Or return back" )
         #layout.label( text="to picking meshes" )
         #layout.operator( "mesh.igl_switch_to_editing", text="To editing" )
 
 
 
+    def _ui_distortion( self, context ):
+        layout = self.layout
+
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return
+
+        layout.separator()
+        panel_settings = bpy.context.scene.panel_settings
+        layout.prop( panel_settings, 'measure_distortion' )
+
+        stats = get_mesh_cache( mesh ).get( "distortion", None )
+        if (stats is None) or (not panel_settings.measure_distortion):
+            return
+
+        for name, label in (("residual", "Rotation residual"), ("strain", "Edge strain")):
+            values = stats[name]
+            layout.label( text="%s: mean %.3g, 95%% %.3g, max %.3g" % 
+                               (label, values["mean"], values["p95"], values["max"]) )
+
+
+
+    def _ui_solve_history( self, context ):
+        import solve_history
+        import result_cache
+
+        layout = self.layout
+
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return
+
+        layout.separator()
+        layout.label( text="Solve history" )
+        panel_settings = bpy.context.scene.panel_settings
+        layout.prop( panel_settings, 'history_budget_mb' )
+        layout.prop( panel_settings, 'history_sparse' )
+
+        # Drawing only looks, budgets are applied when they are changed.
+        history = solve_history.find_history( mesh.name )
+        entries = history.entries if (history is not None) else []
+        used_mb = float( history.nbytes() if (history is not None) else 0 ) / (1024.0 * 1024.0)
+        layout.label( text="Used %.2f MB" % used_mb )
+
+        # The latest solves first.
+        for entry_ind in reversed( range( len(entries) ) ):
+            op = layout.operator( "mesh.igl_restore_solve", text=entries[entry_ind].label )
+            op.entry_ind = entry_ind
+
+        layout.separator()
+        layout.prop( panel_settings, 'result_cache_mb' )
+        results = result_cache.find_cache()
+        if results is not None:
+            used_mb = float( results.nbytes() ) / (1024.0 * 1024.0)
+            layout.label( text="%d results, %.2f MB, %d reused" % (len( results.entries ), used_mb, results.hits) )
+
+
+
     def _ui_picking_vertices( self, context ):
         layout = self.layout
 
@@ -232,11 +652,11 @@ class VIEW3D_PT_igl_panel(bpy.types.Panel):
 class MESH_OT_install_python_modules( bpy.types.Operator ):
     """
     Install needed binary modules. Currently they are 
-    numpy, scipy, libigl
+    numpy, scipy, libigl and optional threadpoolctl
     """
     
     bl_idname = "mesh.igl_install_python_modules"
-    bl_label  = "Install needed python modules: numpy, scipy, libigl"
+    bl_label  = "Install needed python modules: numpy, scipy, libigl, threadpoolctl"
     
     def execute( self, context ):
         install_needed_packages.install_needed_packages()
@@ -264,6 +684,11 @@ class MESH_OT_pick_selected_meshes( bpy.types.Operator ):
 
     
     def execute( self, context ):
+        import arap_solver
+        import solve_history
+        import result_cache
+        import anchor_registry
+
         selected_meshes = [obj for obj in bpy.context.selected_objects if obj.type == 'MESH']
             
         selected_mesh = bpy.types.Mesh( selected_meshes[0] )
@@ -275,15 +700,40 @@ class MESH_OT_pick_selected_meshes( bpy.types.Operator ):
         #import pdb
         #pdb.set_trace()
 
-        islands_qty, island_inds, island_default_inds = enum_isolated_islands( selected_mesh )
-        Vs, Fs = mesh_2_array( selected_mesh )
-        Vs, Fs = to_1d_arrays( Vs, Fs )
+        Fs = mesh_2_faces( selected_mesh )
         
-        selected_mesh["verts"] = Vs
-        selected_mesh["faces"] = Fs
-        selected_mesh["islands_qty"] = islands_qty
-        selected_mesh["island_inds"] = island_inds
-        selected_mesh["island_default_inds"] = island_default_inds
+        selected_mesh["faces"] = faces_to_1d_array( Fs )
+
+        # Islands are derived from faces when needed, older versions stored them.
+        for key in ("islands_qty", "island_inds", "island_default_inds"):
+            if key in selected_mesh:
+                del selected_mesh[key]
+
+        # The rest pose lives in the reference shape key, ARAP results go to 
+        # a separate one. Older versions kept a copy of it in "verts".
+        if selected_mesh.data.shape_keys is None:
+            selected_mesh.shape_key_add( name="Basis", from_mix=False )
+
+        if "verts" in selected_mesh:
+            del selected_mesh["verts"]
+
+        # Rest pose might have changed, precompute again on the next solve.
+        # Solves stored relative to the old rest pose are meaningless now.
+        arap_solver.invalidate( selected_mesh.name )
+        solve_history.drop_history( selected_mesh.name )
+        result_cache.drop_mesh( selected_mesh.name )
+        _mesh_cache.pop( selected_mesh.name, None )
+        # Cages it is bound to bind it again from its current rest pose.
+        for cache in _mesh_cache.values():
+            cache.get( "cage_bindings", {} ).pop( selected_mesh.name, None )
+
+        # Anchors live in a collection of the mesh, older files keep a list in the mesh.
+        anchor_registry.get_anchor_collection( selected_mesh )
+        anchor_registry.invalidate( selected_mesh )
+
+        # Connectivity is built once and shared by island labelling and mirror maps.
+        get_mesh_topology( selected_mesh, Fs )
+        get_mesh_islands( selected_mesh )
 
         return {"FINISHED"}
 
@@ -320,17 +770,11 @@ class MESH_OT_add_selected_to_fixed( bpy.types.Operator ):
     
     def execute( self, context ):
         mesh = get_selected_mesh()
-        bm = bmesh.from_edit_mesh(mesh.data)
-    
-        # Get the indices of selected vertices
-        selected_verts = [v.index for v in bm.verts if v.select]
 
-        fixed_verts = get_fixed_verts( mesh )
-
-        for selected_ind in selected_verts:
-            fixed_verts.add( selected_ind )
-
-        set_fixed_verts( mesh, fixed_verts )
+        with object_mode_data( mesh ):
+            mask = get_fixed_mask( mesh )
+            mask |= get_vertex_selection( mesh )
+            set_fixed_mask( mesh, mask )
 
         return {"FINISHED"}
 
@@ -365,17 +809,11 @@ class MESH_OT_remove_selected_from_fixed( bpy.types.Operator ):
     
     def execute( self, context ):
         mesh = get_selected_mesh()
-        bm = bmesh.from_edit_mesh(mesh.data)
-    
-        # Get the indices of selected vertices
-        selected_verts = [v.index for v in bm.verts if v.select]
-
-        fixed_verts = get_fixed_verts( mesh )
 
-        for selected_ind in selected_verts:
-            fixed_verts.discard( selected_ind )
-
-        set_fixed_verts( mesh, fixed_verts )
+        with object_mode_data( mesh ):
+            mask = get_fixed_mask( mesh )
+            mask &= ~get_vertex_selection( mesh )
+            set_fixed_mask( mesh, mask )
 
         return {"FINISHED"}
 
@@ -409,20 +847,10 @@ class MESH_OT_select_fixed( bpy.types.Operator ):
     
     def execute( self, context ):
         mesh = get_selected_mesh()
-        bm = bmesh.from_edit_mesh(mesh.data)
-    
-        fixed_verts = get_fixed_verts( mesh )
-
-        print( "fixed_verts: ", fixed_verts )
-
-        #mesh.select_all(action='DESELECT')
 
-        for v in bm.verts:
-            index = v.index
-            v.select = (index in fixed_verts)
-
-        # Update the mesh to reflect the changes
-        bmesh.update_edit_mesh( mesh.data )
+        # Selection is written in object mode and picked up by edit mode on return.
+        with object_mode_data( mesh ):
+            set_vertex_selection( mesh, get_fixed_mask( mesh ) )
 
         return {"FINISHED"}
 
@@ -471,108 +899,79 @@ class MESH_OT_create_anchor( bpy.types.Operator ):
 
 
 
-class MESH_OT_apply_transform( bpy.types.Operator ):
+class MESH_OT_import_anchors( bpy.types.Operator ):
     """
-    Move anchor points around and apply the transform by clicking this button.
+    Create anchors from a file of vertex index to target position 
+    correspondences, for example landmarks found by an external tool.
     """
     
-    bl_idname = "mesh.igl_apply_transform"
-    bl_label  = "Apply transform to the meshes selected."
+    bl_idname = "mesh.igl_import_anchors"
+    bl_label  = "Import anchors from a landmark file."
+
+    filepath : bpy.props.StringProperty(
+        name="Landmark file", 
+        subtype='FILE_PATH'
+    )
+
+    filter_glob : bpy.props.StringProperty(
+        default="*.json;*.npz;*.csv;*.txt", 
+        options={'HIDDEN'}
+    )
+
+    space_enum : bpy.props.EnumProperty(
+        name="Targets in", 
+        items = [("WORLD", "World space", "Target positions are world coordinates"), 
+                 ("OBJECT", "Object space", "Target positions are coordinates of the mesh object")], 
+        default='WORLD'
+    )
+
+    replace : bpy.props.BoolProperty(
+        name="Replace existing anchors", 
+        default=False
+    )
+    
+    @classmethod
+    def poll( cls, context ):
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return False
+
+        return True
+
+
+    def invoke( self, context, event ):
+        context.window_manager.fileselect_add( self )
+        return {'RUNNING_MODAL'}
+
     
     def execute( self, context ):
         import numpy as np
-        import igl
-        
-        #import pdb
-        #pdb.set_trace()
-        
-        state = bpy.context.scene.panel_settings
+        import mesh_io
+        import anchor_registry
+
         mesh = get_selected_mesh()
-        anchors = mesh["anchors"]
-        # Before adding validate that it still exists.
-        existing_anchors = []
-        for anchor in anchors:
-            if (anchor is not None) and (anchor.name in bpy.context.scene.objects):
-                existing_anchors.append( anchor )
-        anchors = existing_anchors
-        mesh['anchors'] = existing_anchors
-        
-        Vs = mesh["verts"]
-        Fs = mesh["faces"]
-        islands_qty = mesh["islands_qty"]
-        island_inds_b = list( mesh["island_inds"] )
-        island_default_inds_b = list( mesh["island_default_inds"] )
-
-        island_inds = []
-        for v in island_inds_b:
-            island_inds.append( int(v) )
-
-        island_default_inds = []
-        for v in island_default_inds_b:
-            island_default_inds.append( int(v) )
-
-
-        # Get fixed vertex indices.
-        fixed_vertices = get_fixed_verts( mesh )
-
-        # Obtain vertex indices from anchors.
-        vert_inds = []
-        for anchor in anchors:
-            vert_ind = anchor["vert_ind"]
-            if vert_ind not in fixed_vertices:
-                vert_inds.append( vert_ind )
-
-        # Check which islands are involved.
-        selected_islands = set(())
-        for vert_ind in vert_inds:
-            island_ind = island_inds[vert_ind]
-            selected_islands.add( island_ind )
-        
-        # Go over all islands and if not involved, add default vert inds for this island.
-        vert_inds_default = []
-        for island_ind in range(islands_qty):
-  
-            if island_ind not in selected_islands:
-                base_ind = island_ind * 3
-                for i in range(3):
-                    vert_ind_in_array = base_ind + i
-                    vert_ind = island_default_inds[vert_ind_in_array]
-                    if vert_ind not in fixed_vertices:
-                        vert_inds_default.append( vert_ind )
-
-        # Aslo add all fixed vertices to the same list.
-        for vert_ind in fixed_vertices:
-            vert_inds_default.append( vert_ind )
 
-            
-        Vs, Fs = to_2d_arrays( Vs, Fs )
-        
-       
-        target_positions = []
+        try:
+            vert_inds, targets = mesh_io.read_landmarks( bpy.path.abspath( self.filepath ) )
+        except (OSError, ValueError, KeyError) as e:
+            self.report( {'ERROR'}, "Can't read landmarks: %s" % e )
+            return {"CANCELLED"}
 
-        # First, go over real anchors.
-        for anchor in anchors:
-            at = anchor.matrix_world.translation
-            target_positions.append( at )
+        verts_qty = len(mesh.data.vertices)
+        outside_qty = np.count_nonzero( (vert_inds < 0) | (vert_inds >= verts_qty) )
+        if outside_qty > 0:
+            self.report( {'ERROR'}, "%d landmarks refer to vertices the mesh doesn't have" % outside_qty )
+            return {"CANCELLED"}
 
-        # Then, go over default positions so that isolated islands do not deform.
-        for vert_ind in vert_inds_default:
-            v = Vs[vert_ind]
-            target_positions.append( mathutils.Vector( v ) )
-            vert_inds.append( vert_ind )
-        
-        target_positions = np.array( target_positions )
+        if self.space_enum == 'OBJECT':
+            mat = np.array( mesh.matrix_world )
+            targets = targets @ mat[:3, :3].T + mat[:3, 3]
 
-        #import pdb
-        #pdb.set_trace()
-        
-        # IGL precomputation
-        arap = igl.ARAP( Vs, Fs, 3, vert_inds )
-        # IGL solve
-        Vs_new = arap.solve( target_positions, Vs )
-        
-        # Apply modified vertex coordinates to meshes.
-        apply_to_mesh( mesh, Vs_new )
+        if self.replace:
+            anchor_registry.remove_anchors( mesh )
+
+        qty = anchor_registry.add_anchors( mesh, targets, vert_inds )
+        self.report( {'INFO'}, "Imported %d anchors" % qty )
         
         return {"FINISHED"}
 
@@ -583,29 +982,91 @@ class MESH_OT_apply_transform( bpy.types.Operator ):
 
 
 
-class MESH_OT_apply_default_shape( bpy.types.Operator ):
+class MESH_OT_apply_transform( bpy.types.Operator ):
     """
-    Apply saved transform the mesh had before applying ARAP.
+    Move anchor points around and apply the transform by clicking this button.
     """
     
-    bl_idname = "mesh.igl_apply_default_shape"
+    bl_idname = "mesh.igl_apply_transform"
     bl_label  = "Apply transform to the meshes selected."
+
+    backend_enum : bpy.props.EnumProperty(
+        name = "Solver", 
+        items = SOLVER_BACKEND_ITEMS, 
+        default='IGL'
+    )
+
+    preconditioner_enum : bpy.props.EnumProperty(
+        name = "Preconditioner", 
+        items = PRECONDITIONER_ITEMS, 
+        default='ILU'
+    )
+
+    cg_tolerance : bpy.props.FloatProperty(
+        name="Tolerance", 
+        default=1.0e-6, 
+        min=1.0e-12, 
+        precision=8
+    )
     
     def execute( self, context ):
         import numpy as np
-        import igl
+        import execution_config
         
-        #import pdb
-        #pdb.set_trace()
-
         mesh = get_selected_mesh()
-       
-        Vs = mesh["verts"]
-        Fs = mesh["faces"]
-        Vs, Fs = to_2d_arrays( Vs, Fs )
+        Vs, Fs, anchor_sel, vert_inds, default_positions = get_arap_constraints( mesh )
+
+        # First, go over real anchors.
+        # Then, go over default positions so that isolated islands do not deform.
+        anchor_positions = get_anchor_positions( mesh, anchor_sel )
+        target_positions = np.concatenate( (anchor_positions, default_positions), axis=0 )
+
+        # Precomputation is done only once per constraint set.
+        options = { "backend": self.backend_enum, 
+                    "preconditioner": self.preconditioner_enum, 
+                    "tolerance": self.cg_tolerance }
+        plan = None
+        if self.backend_enum == 'AUTO':
+            plan = get_solve_plan( mesh, 'AUTO', self.preconditioner_enum, vert_inds.shape[0] )
+            options.update( plan.options )
+
+        # Configurations solved before are applied right away.
+        results = get_result_cache()
+        result_key = get_result_key( mesh, Vs, vert_inds, target_positions, options )
+        Vs_new = results.get( result_key )
+        if Vs_new is not None:
+            self.report( {'INFO'}, "Reused the result of an earlier solve" )
+
+        else:
+            if plan is not None:
+                self.report( {'INFO'}, "Solving with %s" % plan.describe() )
+            config = get_execution_config()
+            with execution_config.limit_threads( config.threads_per_worker ):
+                arap = get_mesh_solver( mesh, Vs, Fs, vert_inds, self.report, options )
+                if arap.shared:
+                    self.report( {'INFO'}, "Reused precomputation of a mesh with the same topology" )
+                # Solve
+                Vs_new = arap.solve( target_positions, Vs )
+            if arap.converged:
+                results.put( result_key, Vs_new )
+            else:
+                self.report( {'WARNING'}, NOT_CONVERGED_MESSAGE )
+        # Welded vertices back to all vertices.
+        Vs     = unweld_positions( mesh, Vs )
+        Vs_new = unweld_positions( mesh, Vs_new )
         
         # Apply modified vertex coordinates to meshes.
-        apply_to_mesh( mesh, Vs )
+        apply_to_mesh( mesh, Vs_new )
+
+        # Remember the result so that it can be restored later.
+        history = get_solve_history( mesh )
+        label = "Solve %d, %d anchors" % (history.pushed_qty+1, len(anchor_sel))
+        history.push( Vs, Vs_new, label )
+
+        if bpy.context.scene.panel_settings.measure_distortion:
+            stats = update_distortion( mesh, Vs, Vs_new )
+            self.report( {'INFO'}, "Rotation residual mean %.3g, max %.3g" % 
+                                   (stats["residual"]["mean"], stats["residual"]["max"]) )
         
         return {"FINISHED"}
 
@@ -615,287 +1076,896 @@ class MESH_OT_apply_default_shape( bpy.types.Operator ):
 
 
 
-def enum_isolated_islands( mesh ):
+
+class MESH_OT_apply_default_shape( bpy.types.Operator ):
     """
-    Needs bmesh obtained from a normal mesh in edit mode by doing
-    bm = bmesh.new()
-    bm.from_mesh(selected_mesh.data)
+    Toggle between the original shape and the ARAP result. 
+    Only the ARAP shape key value changes, vertex data is not touched.
     """
+    
+    bl_idname = "mesh.igl_apply_default_shape"
+    bl_label  = "Toggle between the original and the deformed shape."
+    
+    @classmethod
+    def poll( cls, context ):
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return False
 
-    bm = bmesh.new()
-    bm.from_mesh(mesh.data)
-    bm.faces.ensure_lookup_table()
-    bm.verts.ensure_lookup_table()
- 
-    verts_qty = len(bm.verts)
- 
-    vertex_islands = []
-    apprehended_verts=set(())
+        key_block = get_arap_shape_key( mesh )
+        if key_block is None:
+            return False
 
-    current_vert_ind = 0
+        return True
+
+
+    def execute( self, context ):
+        mesh = get_selected_mesh()
+        key_block = get_arap_shape_key( mesh )
+
+        if key_block.value > 0.0:
+            key_block.value = 0.0
+
+        else:
+            key_block.value = 1.0
 
-    while True:
+        for target in get_cage_targets( mesh ):
+            target_key_block = get_arap_shape_key( target )
+            if target_key_block is not None:
+                target_key_block.value = key_block.value
+
+        # Distortion describes the shape shown.
+        clear_distortion( mesh )
+        if (key_block.value > 0.0) and bpy.context.scene.panel_settings.measure_distortion:
+            import numpy as np
+
+            mat = np.array( mesh.matrix_world )
+            Vs_new = get_displayed_positions( mesh ) @ mat[:3, :3].T + mat[:3, 3]
+            update_distortion( mesh, get_rest_positions( mesh, np.float64 ), Vs_new )
         
-        is_apprehended = current_vert_ind in apprehended_verts
-        if is_apprehended:
-            current_vert_ind += 1
-            if current_vert_ind >= verts_qty:
-                break
+        return {"FINISHED"}
 
-            continue
 
-        connected_vert_inds = find_connected_vert_inds( bm, current_vert_ind )
-        apprehended_verts = apprehended_verts.union( connected_vert_inds )
-        vertex_islands.append( connected_vert_inds )
 
-    # Convert islands to lists.
-    vertex_island_lists = []
-    for island_set in vertex_islands:
-        island_list = list( island_set )
-        vertex_island_lists.append( island_list )
 
-    # For each island find 3 the most distant points.
-    island_default_inds = []
-    for island_list in vertex_island_lists:
-        inds = find_the_most_distant_point( mesh, island_list, [0] )
-        inds = inds[1:]
-        inds = find_the_most_distant_point( mesh, island_list, inds )
-        inds = find_the_most_distant_point( mesh, island_list, inds )
-        island_default_inds.extend( inds )
 
-    # Number of vertex islands.
-    islands_qty = len( vertex_islands )
 
 
-    # Correspondence of a vertex to its island
-    island_inds = [i for i in range(verts_qty)]
-    for island_ind, island_vert_inds in enumerate(vertex_island_lists):
-        for vert_ind in island_vert_inds:
-            island_inds[vert_ind] = island_ind
+class MESH_OT_bind_targets( bpy.types.Operator ):
+    """
+    Bind selected meshes to the picked one. ARAP is then solved on the 
+    picked mesh only and the bound meshes follow it, however dense they are.
+    """
+    
+    bl_idname = "mesh.igl_bind_targets"
+    bl_label  = "Make selected meshes follow the picked one."
+
+    @classmethod
+    def poll( cls, context ):
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return False
 
+        return any( (obj.type == 'MESH') and (obj != mesh) for obj in context.selected_objects )
 
-    # Convert indices to float, Blender converts integer arrayy to something peculiar.
-    for i, v in enumerate(island_inds):
-        island_inds[i] = float(v)
 
-    for i, v in enumerate(island_default_inds):
-        island_default_inds[i] = float(v)
+    def execute( self, context ):
+        mesh = get_selected_mesh()
+        targets = get_cage_targets( mesh )
+        for obj in context.selected_objects:
+            if (obj.type == 'MESH') and (obj != mesh) and (obj not in targets):
+                targets.append( obj )
+        mesh['cage_targets'] = targets
+
+        # Bind right away rather than on the first solve.
+        verts_qty = 0
+        for target in targets:
+            if target.data.shape_keys is None:
+                target.shape_key_add( name="Basis", from_mix=False )
+            verts_qty += get_cage_binding( mesh, target ).verts_qty
+
+        self.report( {'INFO'}, "%d meshes, %d vertices bound" % (len(targets), verts_qty) )
+        return {"FINISHED"}
 
-    return (islands_qty, island_inds, island_default_inds)
 
 
 
- 
 
 
 
-def find_connected_vert_inds( bm, vert_ind ):
+class MESH_OT_unbind_targets( bpy.types.Operator ):
     """
-    Needs bmesh obtained from a normal mesh in edit mode by doing
-    bm = bmesh.new()
-    bm.from_mesh(selected_mesh.data)
+    Stop driving other meshes by the picked one. Their ARAP shape keys stay.
     """
     
-    #import pdb
-    #pdb.set_trace()
-    
-    selected_verts=set(())
-    vert_inds_to_add = [vert_ind]
-    added_data = True
+    bl_idname = "mesh.igl_unbind_targets"
+    bl_label  = "Stop driving other meshes by the picked one."
+
+    @classmethod
+    def poll( cls, context ):
+        return len( get_cage_targets( get_selected_mesh() ) ) > 0
+
+
+    def execute( self, context ):
+        mesh = get_selected_mesh()
+        if 'cage_targets' in mesh:
+            del mesh['cage_targets']
+        get_mesh_cache( mesh ).pop( "cage_bindings", None )
+
+        return {"FINISHED"}
+
+
+
+
+
+
+
+class MESH_OT_bake_animation( bpy.types.Operator ):
+    """
+    Solve ARAP for every frame of a frame range following animated anchors. 
+    Results are stored either as shape keys keyed to their frames or as 
+    a PC2 point cache file which can be read by the "Mesh Cache" modifier.
+    """
     
-    while added_data:
-        added_data = False
-        
-        for vert_ind in vert_inds_to_add:
-            if vert_ind not in selected_verts:    
-                selected_verts.add( vert_ind )
-                added_data = True
-        
-        if not added_data:
-            break
-        
-        new_vert_inds_to_add = set(())
-        for vert_ind in vert_inds_to_add:
-            vertex = bm.verts[vert_ind]
+    bl_idname = "mesh.igl_bake_animation"
+    bl_label  = "Bake ARAP deformation over a frame range."
+
+    frame_start : bpy.props.IntProperty(
+        name="Start frame", 
+        default=1
+    )
+
+    frame_end : bpy.props.IntProperty(
+        name="End frame", 
+        default=250
+    )
+
+    output_enum : bpy.props.EnumProperty(
+        name="Output", 
+        description="Where to put the baked deformation", 
+        items = [("SHAPE_KEYS", "Shape keys", "One shape key per frame"), 
+                 ("POINT_CACHE", "Point cache", "PC2 file for the Mesh Cache modifier")], 
+        default='SHAPE_KEYS'
+    )
+
+    filepath : bpy.props.StringProperty(
+        name="Point cache file", 
+        subtype='FILE_PATH', 
+        default="//arap_bake.pc2"
+    )
+
+    chunks_qty : bpy.props.IntProperty(
+        name="Parallel chunks", 
+        description="Split the frame range into this many chunks solved in parallel. "
+                    "Each extra chunk costs one more precomputation", 
+        default=1, 
+        min=1
+    )
     
-            # Get all edges connected to the vertex
-            connected_edges = vertex.link_edges
+    @classmethod
+    def poll( cls, context ):
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return False
+
+        return True
+
+
+    def invoke( self, context, event ):
+        scene = context.scene
+        self.frame_start = scene.frame_start
+        self.frame_end   = scene.frame_end
+        return context.window_manager.invoke_props_dialog( self )
+
     
-            connected_vertices = [edge.other_vert(vertex) for edge in connected_edges]
-            connected_vert_inds = [ vert.index for vert in connected_vertices ]
-            
-            for vert_ind in connected_vert_inds:
-                if vert_ind not in new_vert_inds_to_add:
-                    new_vert_inds_to_add.add( vert_ind )
-        
-        vert_inds_to_add = new_vert_inds_to_add
+    def execute( self, context ):
+        import numpy as np
+        import arap_solver
+        import mesh_io
+
+        mesh = get_selected_mesh()
+        scene = context.scene
+
+        frames = list( range( self.frame_start, self.frame_end+1 ) )
+        if len(frames) == 0:
+            self.report( {'ERROR'}, "Empty frame range" )
+            return {"CANCELLED"}
+
+        Vs, Fs, anchor_sel, vert_inds, default_positions = get_arap_constraints( mesh )
+
+        # Only anchors move from frame to frame. Gather their positions first, 
+        # solving doesn't need the scene anymore.
+        anchors_qty = len(anchor_sel)
+        targets = np.empty( (len(frames), len(vert_inds), 3), dtype=Vs.dtype )
+        targets[:, anchors_qty:] = default_positions
+
+        current_frame = scene.frame_current
+        for frame_ind, frame in enumerate(frames):
+            scene.frame_set( frame )
+            targets[frame_ind, :anchors_qty] = get_anchor_positions( mesh, anchor_sel )
+        scene.frame_set( current_frame )
+
+        # Precompute once for the whole frame range.
+        arap = get_mesh_solver( mesh, Vs, Fs, vert_inds, self.report )
+        config = get_execution_config( self.chunks_qty )
+        results, converged = arap_solver.solve_frames( arap, targets, config.workers, config.threads_per_worker )
+        if not converged:
+            self.report( {'WARNING'}, NOT_CONVERGED_MESSAGE )
+        results = unweld_positions( mesh, results )
+
+        if self.output_enum == 'POINT_CACHE':
+            file_path = bpy.path.abspath( self.filepath )
+            Vs_local = world_to_local( mesh, results )
+            mesh_io.write_pc2( file_path, Vs_local, start_frame=float(frames[0]) )
+
+        else:
+            # Baked shape keys carry the whole deformation. 
+            key_block = get_arap_shape_key( mesh )
+            if key_block is not None:
+                key_block.value = 0.0
+            clear_distortion( mesh )
+
+            for frame_ind, frame in enumerate(frames):
+                key_block = write_shape_key( mesh, "ARAP_bake_%04d" % frame, results[frame_ind] )
+                key_shape_key_to_frame( mesh, key_block, frame )
+
+            # Driven meshes get their shape keys too, the cage is what was solved.
+            for target in get_cage_targets( mesh ):
+                binding = get_cage_binding( mesh, target )
+                key_block = get_arap_shape_key( target )
+                if key_block is not None:
+                    key_block.value = 0.0
+
+                for frame_ind, frame in enumerate(frames):
+                    key_block = write_shape_key( target, "ARAP_bake_%04d" % frame, binding.deform( results[frame_ind] ) )
+                    key_shape_key_to_frame( target, key_block, frame )
+
+        self.report( {'INFO'}, "Baked %d frames" % len(frames) )
+        return {"FINISHED"}
+
+
+
+
+
+
+
+class MESH_OT_restore_solve( bpy.types.Operator ):
+    """
+    Show one of the previous solves again. It is restored from the solve 
+    history, nothing is solved.
+    """
     
-    #selected_verts = list(selected_verts)
+    bl_idname = "mesh.igl_restore_solve"
+    bl_label  = "Restore a previous solve."
+
+    entry_ind : bpy.props.IntProperty(
+        name="Entry index", 
+        default=0, 
+        min=0
+    )
     
-    return selected_verts
+    @classmethod
+    def poll( cls, context ):
+        mesh = get_selected_mesh()
+        if mesh is None:
+            return False
+
+        return True
+
+
+    def execute( self, context ):
+        mesh = get_selected_mesh()
+        history = get_solve_history( mesh )
+        if self.entry_ind >= len(history.entries):
+            self.report( {'ERROR'}, "No such solve in the history" )
+            return {"CANCELLED"}
+
+        Vs_rest = get_rest_positions( mesh )
+        Vs = history.restore( Vs_rest, self.entry_ind )
+        apply_to_mesh( mesh, Vs )
+
+        if bpy.context.scene.panel_settings.measure_distortion:
+            update_distortion( mesh, Vs_rest, Vs )
+
+        return {"FINISHED"}
+
+
 
 
 
-def find_the_most_distant_point( mesh, island_inds, selected_vert_inds=None ):
+
+
+def get_solver_options( mesh ):
     """
-    This one looks for the point the most distance from the list of  provided points.
-    It appends the list with its index and returns it.
+    Solver backend options selected in the panel, the planned ones for 
+    the mesh if the backend is automatic.
     """
-    verts = mesh.data.vertices
+    settings = bpy.context.scene.panel_settings
+    options = { "backend": settings.backend_enum, 
+                "preconditioner": settings.preconditioner_enum, 
+                "tolerance": settings.cg_tolerance }
+    if settings.backend_enum == 'AUTO':
+        options.update( get_solve_plan( mesh, 'AUTO', settings.preconditioner_enum ).options )
+    return options
+
+
+
+def get_problem_stats( mesh, constraints_qty=None ):
+    """
+    Size of the solve of the picked mesh for the solver planner. Without 
+    "constraints_qty" it is estimated from anchors, fixed vertices and islands.
+    The estimate is kept until anchors are added or deleted, fixed vertices 
+    or symmetry settings change.
+    """
+    import solver_planner
+    import anchor_registry
+
+    settings = bpy.context.scene.panel_settings
+    cache = get_mesh_cache( mesh )
+    key = (anchor_registry.get_anchors_qty( mesh ), settings.symmetry_enum, settings.symmetric_solve)
+    cached = cache.get( "problem_stats", None )
+    if (cached is None) or (cached[0] != key):
+        topology = get_solve_topology( mesh )
+        islands_qty = get_mesh_islands( mesh )[2].shape[0]
+        estimated_qty = key[0] + int( get_fixed_mask( mesh ).sum() ) + islands_qty
+
+        symmetry = settings.symmetry_enum
+        symmetric = False
+        if settings.symmetric_solve and (symmetry in ['X', 'Y', 'Z']):
+            symmetric = get_mirror_map( mesh, 'XYZ'.index( symmetry ) ) is not None
+
+        stats = solver_planner.ProblemStats( topology.verts_qty, topology.Fs.shape[0], islands_qty, 
+                                             estimated_qty, symmetric )
+        cached = (key, stats)
+        cache["problem_stats"] = cached
+
+    stats = cached[1]
+    if constraints_qty is None:
+        return stats
+
+    return solver_planner.ProblemStats( stats.verts_qty, stats.faces_qty, stats.islands_qty, 
+                                        constraints_qty, stats.symmetric )
+
 
-    best_dist = 0.0
-    best_ind  = None
-    
-    for sel_vert_ind in island_inds:
-        vert = verts[sel_vert_ind]
-        sel_co = vert.co
 
-        if selected_vert_inds is None:
-            selected_vert_inds = [sel_vert_ind]
-            return selected_vert_inds
+def get_solve_plan( mesh, backend, preconditioner, constraints_qty=None ):
+    """
+    solver_planner.SolvePlan for the picked mesh: the planner's choice if 
+    "backend" is 'AUTO', the estimate of the backend given otherwise. 
+    None if no mesh is picked.
+    """
+    import solver_planner
+
+    if mesh is None:
+        return None
+
+    stats = get_problem_stats( mesh, constraints_qty )
+    calibration = solver_planner.load_calibration()
+
+    # Drawing the panel asks for the plan on every redraw.
+    cache = get_mesh_cache( mesh )
+    key = (stats.key(), backend, preconditioner, id( calibration ))
+    cached = cache.get( "plan", None )
+    if (cached is not None) and (cached[0] == key):
+        return cached[1]
+
+    if backend == 'AUTO':
+        plan = solver_planner.plan( stats, calibration )
+    else:
+        strategy = solver_planner.strategy_name( backend, preconditioner )
+        plan = solver_planner.estimate( stats, strategy, calibration, solver_planner.available_memory() )
+
+    cache["plan"] = (key, plan)
+    return plan
+
+
+
+def get_execution_config( workers=1 ):
+    """
+    "workers" solving processes with the thread count set in the panel, 
+    by default the cores split between them.
+    """
+    import execution_config
+
+    settings = bpy.context.scene.panel_settings
+    return execution_config.ExecutionConfig( workers, settings.solver_threads )
+
+
+
+def get_mesh_solver( mesh, Vs, Fs, vert_inds, report, options=None ):
+    """
+    Cached solver for the mesh picked. If "Solve one half" is enabled and the mesh 
+    is symmetric with respect to the selected symmetry plane, only one half 
+    of it is solved. Otherwise the whole mesh is.
+    "options" are keyword arguments of arap_solver.get_solver() selecting 
+    the backend, by default the ones from the panel.
+    """
+    import arap_solver
+
+    settings = bpy.context.scene.panel_settings
+    symmetry = settings.symmetry_enum
+    if options is None:
+        options = get_solver_options( mesh )
+
+    if settings.symmetric_solve and (symmetry in ['X', 'Y', 'Z']):
+        axis = 'XYZ'.index( symmetry )
+        mirror_inds = get_mirror_map( mesh, axis )
+        if mirror_inds is None:
+            report( {'WARNING'}, "The mesh isn't symmetric, solving all of it" )
+
+        else:
+            try:
+                return arap_solver.get_solver( mesh.name, Vs, Fs, vert_inds, (axis, mirror_inds), **options )
+            except ValueError as e:
+                report( {'WARNING'}, str(e) + ", solving all of the mesh" )
+
+    return arap_solver.get_solver( mesh.name, Vs, Fs, vert_inds, **options )
+
+
+
+def get_result_cache():
+    """
+    Solved poses of all meshes with the budget set in the panel.
+    """
+    import result_cache
+
+    settings = bpy.context.scene.panel_settings
+    budget_bytes = int( settings.result_cache_mb * 1024.0 * 1024.0 )
+    return result_cache.get_cache( budget_bytes )
+
+
+
+def get_result_key( mesh, Vs, vert_inds, target_positions, options=None ):
+    """
+    Result cache key of solving the picked mesh with rest pose "Vs" 
+    and vertices "vert_inds" moved to "target_positions". Panel settings 
+    the result depends on are part of it.
+    """
+    import result_cache
+
+    settings = bpy.context.scene.panel_settings
+    if options is None:
+        options = get_solver_options( mesh )
+
+    symmetry = settings.symmetry_enum if settings.symmetric_solve else 'NONE'
+    mode = tuple( sorted( options.items() ) ) + (symmetry,)
+    return result_cache.make_key( mesh.name, Vs, vert_inds, target_positions, mode )
+
+
+
+def get_solve_history( mesh ):
+    """
+    Solve history of the mesh with the budget set in the panel.
+    """
+    import solve_history
+
+    settings = bpy.context.scene.panel_settings
+    budget_bytes = int( settings.history_budget_mb * 1024.0 * 1024.0 )
+    history = solve_history.get_history( mesh.name, budget_bytes, settings.history_sparse )
+    return history
 
-        accum_dist = 0.0
-        for vert_ind in selected_vert_inds:
-            vert = verts[vert_ind]
-            co = vert.co
 
-            dist = (co - sel_co).length
-            accum_dist += dist
 
-        if dist > best_dist:
-            best_dist = accum_dist
-            best_ind = sel_vert_ind
 
-    selected_vert_inds.append( best_ind )
-    return selected_vert_inds
 
 
 
-def mesh_2_array( selected_mesh ):
+def get_precision_dtype():
+    """
+    NumPy dtype vertex positions are kept in, as selected in the panel.
+    """
     import numpy as np
-    
-    bm = bmesh.new()
-    bm.from_mesh(selected_mesh.data)
-    bm.faces.ensure_lookup_table()
-    bm.verts.ensure_lookup_table()
-    
-    #import pdb
-    #pdb.set_trace()
 
-    all_verts = []
-    all_faces = []
-    
-    # only add faces     
-    for f in bm.faces:
-        face = [v.index for v in f.verts]
+    precision = bpy.context.scene.panel_settings.precision_enum
+    if precision == 'FLOAT32':
+        return np.float32
 
-        verts_per_face = len(face)
-        if verts_per_face == 3:
-            sel_face = [ face[0], face[1], face[2]]
-            all_faces.append( sel_face )
+    return np.float64
 
-        elif verts_per_face == 4:
-            sel_face = [ face[0], face[1], face[2]]
-            all_faces.append( sel_face )
-            sel_face = [ face[0], face[2], face[3]]
-            all_faces.append( sel_face )
 
-    bm.free()
-    
-    mat   = selected_mesh.matrix_world
-    verts = selected_mesh.data.vertices
-    verts_qty = len(verts)
-    for vert_ind in range(verts_qty):
-        vert = verts[vert_ind]
-        co = vert.co
-        co = mat @ co
-        co = [co.x, co.y, co.z]
-        all_verts.append( co )
-    
-    
-    # Convert to numpy arrays
-    all_verts = np.array( all_verts )
-    all_faces = np.array( all_faces )
-    
-    return (all_verts, all_faces)
 
+def mesh_2_faces( selected_mesh ):
+    """
+    Triangles of the mesh as (faces_qty, 3) int32 array. Polygons are 
+    triangulated as fans: (0, 1, 2), (0, 2, 3), ... 
+    Everything is read with bulk foreach_get calls.
+    """
+    import numpy as np
+    import mesh_io
 
+    polygons = selected_mesh.data.polygons
+    loops    = selected_mesh.data.loops
+    polys_qty = len(polygons)
+    loops_qty = len(loops)
 
+    loop_starts = np.empty( polys_qty, dtype=np.int32 )
+    loop_totals = np.empty( polys_qty, dtype=np.int32 )
+    loop_verts  = np.empty( loops_qty, dtype=np.int32 )
+    polygons.foreach_get( "loop_start", loop_starts )
+    polygons.foreach_get( "loop_total", loop_totals )
+    loops.foreach_get( "vertex_index", loop_verts )
 
-def to_1d_arrays( Vs, Fs ):
-    verts_qty = Vs.shape[0]
-    faces_qty = Fs.shape[0]
-    
-    vert_coords = []
-    for ind in range(verts_qty):
-        x, y, z = Vs[ind, 0], Vs[ind, 1], Vs[ind, 2]
-        vert_coords.append( x )
-        vert_coords.append( y )
-        vert_coords.append( z )
-    
-    face_vert_inds = []
-    for ind in range(faces_qty):
-        x, y, z = float(Fs[ind, 0]), float(Fs[ind, 1]), float(Fs[ind, 2])
-        face_vert_inds.append( x )
-        face_vert_inds.append( y )
-        face_vert_inds.append( z )
-    
-    return (vert_coords, face_vert_inds)
+    return mesh_io.fan_triangulate( loop_verts, loop_starts, loop_totals )
+
+
+
+
+def faces_to_1d_array( Fs ):
+    """
+    Blender converts integer arrays to something peculiar, 
+    so face indices are stored in ID properties as floats.
+    """
+    import numpy as np
+
+    return Fs.astype( np.float64 ).ravel().tolist()
 
 
 
 
 
-def to_2d_arrays( Vs, Fs ):
+def faces_to_2d_array( Fs ):
     import numpy as np
-    
-    verts_sz = len(Vs)
-    verts = []
-    for ind in range( 0, verts_sz, 3 ):
-        x = Vs[ind]
-        y = Vs[ind+1]
-        z = Vs[ind+2]
-        
-        verts.append( [x, y, z] )
-    
-    verts = np.array( verts )
-    
-    
-    faces_sz = len(Fs)
-    faces = []
-    for ind in range( 0, faces_sz, 3 ):
-        x = int(Fs[ind])
-        y = int(Fs[ind+1])
-        z = int(Fs[ind+2])
-        
-        faces.append( [x, y, z] )
-    
-    faces = np.array( faces )
-    
-    return (verts, faces)
-        
+
+    return np.array( Fs, dtype=np.int32 ).reshape( (-1, 3) )
+
 
 
 
 
+# Shape key ARAP results are written to. "Basis" keeps the original shape.
+ARAP_SHAPE_KEY = "ARAP"
+
+
 def apply_to_mesh( mesh, Vs_new ):
-    verts = mesh.data.vertices
-    verts_qty = Vs_new.shape[0]
-    
-    #import pdb
-    #pdb.set_trace()
-    
-    mat   = mesh.matrix_world
-    inv_mat = mat.inverted()
+    """
+    Writes world space vertex positions "Vs_new" into the ARAP shape key 
+    and makes it fully visible. Base vertex coordinates are never modified.
+    Distortion measured for the previous shape is dropped.
+    """
+    key_block = write_shape_key( mesh, ARAP_SHAPE_KEY, Vs_new )
+    key_block.value = 1.0
+    clear_distortion( mesh )
+
+    # Meshes bound to this one follow it.
+    for target in get_cage_targets( mesh ):
+        binding = get_cage_binding( mesh, target )
+        key_block = write_shape_key( target, ARAP_SHAPE_KEY, binding.deform( Vs_new ) )
+        key_block.value = 1.0
+
+
+
+# Float point attribute with per vertex distortion of the last solve.
+DISTORTION_ATTRIBUTE = "arap_distortion"
+
+
+def update_distortion( mesh, Vs_rest, Vs_new ):
+    """
+    Measures how far the solve "Vs_new" is from rigid. Per vertex rotation 
+    residuals go to the distortion attribute with one bulk write, summary 
+    statistics are kept for the panel and returned.
+    """
+    import numpy as np
+    import distortion
+
+    Fs = get_mesh_topology( mesh ).Fs
+    strain, residual, rest_areas = distortion.face_distortion( Vs_rest, Vs_new, Fs )
+    values = distortion.vertex_values( residual, Fs, rest_areas, Vs_rest.shape[0] )
+
+    with object_mode_data( mesh ) as data:
+        attributes = data.attributes
+        attribute = attributes.get( DISTORTION_ATTRIBUTE, None )
+        if (attribute is not None) and ((attribute.data_type != 'FLOAT') or (attribute.domain != 'POINT')):
+            attributes.remove( attribute )
+            attribute = None
+
+        if attribute is None:
+            attribute = attributes.new( name=DISTORTION_ATTRIBUTE, type='FLOAT', domain='POINT' )
+
+        attribute.data.foreach_set( "value", values.astype( np.float32 ) )
+
+    stats = { "residual": distortion.summarize( residual, rest_areas ), 
+              "strain":   distortion.summarize( strain, rest_areas ) }
+    get_mesh_cache( mesh )["distortion"] = stats
+
+    return stats
+
+
+
+def clear_distortion( mesh ):
+    """
+    Drops the distortion attribute and statistics of a shape no longer shown.
+    """
+    get_mesh_cache( mesh ).pop( "distortion", None )
+    if mesh.data.attributes.get( DISTORTION_ATTRIBUTE, None ) is None:
+        return
+
+    with object_mode_data( mesh ) as data:
+        attribute = data.attributes.get( DISTORTION_ATTRIBUTE, None )
+        if attribute is not None:
+            data.attributes.remove( attribute )
+
+
+
+def get_cage_targets( mesh ):
+    """
+    Meshes bound to "mesh", which then works as a cage for them.
+    Deleted ones are skipped.
+    """
+    if (mesh is None) or ('cage_targets' not in mesh):
+        return []
+
+    scene_objects = bpy.context.scene.objects
+    targets = [ target for target in mesh['cage_targets'] 
+                if (target is not None) and (target.name in scene_objects) ]
+    return targets
+
+
+
+def get_cage_binding( mesh, target ):
+    """
+    cage_binding.CageBinding of "target" to "mesh", computed from both rest 
+    poses on first use. Kept until the cage is picked again or the rest pose 
+    or placement of "target" changes.
+    """
+    import numpy as np
+    import cage_binding
+
+    bindings = get_mesh_cache( mesh ).setdefault( "cage_bindings", {} )
+    digest = get_rest_digest( target )
+    cached = bindings.get( target.name, None )
+    if (cached is None) or (cached[0] != digest):
+        binding = cage_binding.bind( get_rest_positions( mesh, np.float64 ), 
+                                     get_mesh_topology( mesh ).Fs, 
+                                     get_rest_positions( target, np.float64 ) )
+        cached = (digest, binding)
+        bindings[target.name] = cached
+
+    return cached[1]
+
+
+
+def get_rest_digest( mesh ):
+    """
+    Hash of the object space rest pose and the world matrix of the mesh.
+    """
+    import hashlib
+    import numpy as np
+
+    shape_keys = mesh.data.shape_keys
+    data = mesh.data.vertices if (shape_keys is None) else shape_keys.reference_key.data
+    co = np.empty( len( mesh.data.vertices )*3, dtype=np.float32 )
+    data.foreach_get( "co", co )
+
+    h = hashlib.blake2b( digest_size=16 )
+    h.update( co.tobytes() )
+    h.update( np.array( mesh.matrix_world, dtype=np.float64 ).tobytes() )
+    return h.hexdigest()
+
+
+
+def get_arap_shape_key( mesh ):
+    """
+    Returns the shape key ARAP results are written to or None if there 
+    were no solves yet.
+    """
+    shape_keys = mesh.data.shape_keys
+    if shape_keys is None:
+        return None
+
+    key_block = shape_keys.key_blocks.get( ARAP_SHAPE_KEY )
+    return key_block
+
+
+
+def get_rest_positions( mesh, dtype=None ):
+    """
+    World space rest pose as (verts_qty, 3) array. It is read from the 
+    reference shape key with a single bulk read. ARAP never modifies it.
+    By default the precision selected in the panel is used.
+    """
+    import numpy as np
+
+    if dtype is None:
+        dtype = get_precision_dtype()
+
+    shape_keys = mesh.data.shape_keys
+    if shape_keys is None:
+        data = mesh.data.vertices
     
-    for vert_ind in range(verts_qty):
-        target_at = Vs_new[vert_ind]
-        vert = verts[vert_ind]
-        co = vert.co
-        co.x, co.y, co.z = target_at[0], target_at[1], target_at[2]
-        co = inv_mat @ co
-        vert.co = co
-        #verts[i] = vert
+    else:
+        data = shape_keys.reference_key.data
+
+    verts_qty = len( mesh.data.vertices )
+    co = np.empty( verts_qty*3, dtype=np.float32 )
+    data.foreach_get( "co", co )
+    co = co.reshape( (-1, 3) ).astype( dtype, copy=False )
+
+    mat = np.array( mesh.matrix_world, dtype=dtype )
+    Vs = co @ mat[:3, :3].T
+    Vs += mat[:3, 3]
+    return Vs
+
+
+
+def get_displayed_verts( mesh ):
+    """
+    Vertex data the mesh is shown with: the ARAP shape key if it is visible, 
+    original vertices otherwise. Items have "co" in object space.
+    """
+    key_block = get_arap_shape_key( mesh )
+    if (key_block is not None) and (key_block.value > 0.0):
+        return key_block.data
+
+    return mesh.data.vertices
+
+
+
+def get_displayed_positions( mesh ):
+    """
+    Object space positions of get_displayed_verts() as (verts_qty, 3) float64 array.
+    """
+    import numpy as np
+
+    verts = get_displayed_verts( mesh )
+    Vs = np.empty( len(verts)*3, dtype=np.float64 )
+    verts.foreach_get( "co", Vs )
+    return Vs.reshape( (-1, 3) )
+
+
+
+def get_displayed_normals( mesh ):
+    """
+    Object space vertex normals of the shape get_displayed_verts() holds 
+    as (verts_qty, 3) float64 array.
+    """
+    import numpy as np
+
+    key_block = get_arap_shape_key( mesh )
+    if (key_block is not None) and (key_block.value > 0.0):
+        return np.array( key_block.normals_vertex_get(), dtype=np.float64 ).reshape( (-1, 3) )
+
+    verts = mesh.data.vertices
+    normals = np.empty( len(verts)*3, dtype=np.float64 )
+    verts.foreach_get( "normal", normals )
+    return normals.reshape( (-1, 3) )
+
+
+
+def world_to_local( mesh, Vs ):
+    """
+    Converts world space coordinates "Vs" of shape (..., 3) to the mesh object space.
+    """
+    import numpy as np
+
+    inv_mat = np.array( mesh.matrix_world.inverted(), dtype=Vs.dtype )
+    Vs_local = Vs @ inv_mat[:3, :3].T
+    Vs_local += inv_mat[:3, 3]
+    return Vs_local
+
+
+
+def write_shape_key( mesh, name, Vs ):
+    """
+    Stores world space vertex positions "Vs" in the shape key "name" using 
+    a single bulk write. Creates "Basis" and the shape key itself if needed.
+    """
+    import numpy as np
+
+    if mesh.data.shape_keys is None:
+        mesh.shape_key_add( name="Basis", from_mix=False )
+
+    key_block = mesh.data.shape_keys.key_blocks.get( name )
+    if key_block is None:
+        key_block = mesh.shape_key_add( name=name, from_mix=False )
+
+    Vs_local = world_to_local( mesh, Vs ).astype( np.float32 )
+    key_block.data.foreach_set( "co", Vs_local.ravel() )
+    mesh.data.update()
+
+    return key_block
+
+
+
+def key_shape_key_to_frame( mesh, key_block, frame ):
+    """
+    Animates the shape key value so that it is 1 at "frame" and 0 at 
+    neighbouring frames.
+    """
+    shape_keys = mesh.data.shape_keys
+    if shape_keys.animation_data is None:
+        shape_keys.animation_data_create()
+
+    animation_data = shape_keys.animation_data
+    if animation_data.action is None:
+        animation_data.action = bpy.data.actions.new( name=mesh.name + "_arap_bake" )
+
+    fcurves = animation_data.action.fcurves
+    data_path = 'key_blocks["%s"].value' % key_block.name
+    fcurve = fcurves.find( data_path )
+    if fcurve is None:
+        fcurve = fcurves.new( data_path )
+
+    points = fcurve.keyframe_points
+    points.clear()
+    points.add( 3 )
+    points.foreach_set( "co", [frame-1, 0.0, frame, 1.0, frame+1, 0.0] )
+    for point in points:
+        point.interpolation = 'CONSTANT'
+
+    fcurve.update()
+
+
+
+def get_anchor_positions( mesh, anchor_sel=None ):
+    """
+    World space positions of the mesh anchors as (anchors_qty, 3) array,
+    read with one bulk call. "anchor_sel" selects anchors by index.
+    """
+    import anchor_registry
+
+    positions = anchor_registry.get_anchor_positions( mesh, get_precision_dtype() )
+    if anchor_sel is not None:
+        positions = positions[anchor_sel]
+
+    return positions
+
+
+
+def get_arap_constraints( mesh ):
+    """
+    Collects everything ARAP needs for the mesh picked.
+    Returns (Vs, Fs, anchor_sel, vert_inds, default_positions). If "Weld seams" 
+    is on, all of them refer to the welded mesh, unweld_positions() maps 
+    results back. "vert_inds" lists 
+    anchor vertices first, "anchor_sel" are indices of these anchors in 
+    get_anchor_positions(). They are followed by vertices which should stay 
+    at their rest positions "default_positions": default vertices of islands 
+    without anchors and all fixed vertices.
+    Everything is done with index arrays, nothing loops over vertices.
+    """
+    import arap_solver
+    import anchor_registry
+
+    import numpy as np
+
+    Vs = get_solve_positions( mesh )
+    Fs, labels, island_defaults = get_mesh_islands( mesh )
+
+    anchor_inds = anchor_registry.get_anchor_vert_inds( mesh )
+    fixed_inds  = get_fixed_verts( mesh )
+    weld = get_weld( mesh )
+    if weld is not None:
+        # Anchors on seam twins collapse, the first one wins.
+        anchor_inds = weld.weld_inds( anchor_inds )
+        fixed_inds  = np.unique( weld.weld_inds( fixed_inds ) )
+
+    anchor_sel, vert_inds = arap_solver.assemble_constraint_inds( labels, island_defaults, 
+                                                                  anchor_inds, fixed_inds )
+    default_positions = Vs[vert_inds[anchor_sel.shape[0]:]]
+
+    return (Vs, Fs, anchor_sel, vert_inds, default_positions)
+
+
+
+def get_mesh_islands( mesh ):
+    """
+    (Fs, island label per vertex, (islands_qty, 3) default vertices) as arrays.
+    Default vertices are three vertices far from each other which keep 
+    islands without anchors in place.
+    """
+    import numpy as np
+    import arap_solver
+
+    cache = get_mesh_cache( mesh )
+    if "islands" not in cache:
+        topology = get_solve_topology( mesh )
+        islands_qty, labels = topology.island_labels()
+        Vs = get_solve_positions( mesh, np.float64 )
+        island_defaults = arap_solver.island_default_inds( Vs, labels, islands_qty )
+        cache["islands"] = (topology.Fs, labels, island_defaults)
+
+    return cache["islands"]
+
 
 
 
@@ -911,6 +1981,10 @@ class MESH_OT_reset( bpy.types.Operator ):
         #import pdb
         #pdb.set_trace()
         
+        mesh = get_selected_mesh()
+        if mesh is not None:
+            clear_distortion( mesh )
+
         s = bpy.context.scene.panel_settings
         s.mode_enum = 'MESH_SELECT'
         set_selected_mesh( None )
@@ -928,6 +2002,15 @@ class MyMouseOperator(bpy.types.Operator):
 
     def modal(self, context, event):
         #print( "Entered SimpleMouseOperator" )
+        # Picking was left through the panel or the mesh is gone.
+        state = bpy.context.scene.panel_settings
+        if (state.mode_enum != 'PICK_VERTICES') or (get_selected_mesh() is None):
+            return self.finish( context )
+
+        if event.type == 'MOUSEMOVE':
+            self.update_hover( context, event )
+            return {'RUNNING_MODAL'}
+
         if event.type == 'LEFTMOUSE':  # If we've clicked the left mouse button
             if event.value == 'PRESS':
                 print('Left mouse button pressed')
@@ -942,14 +2025,47 @@ class MyMouseOperator(bpy.types.Operator):
         
         elif event.type == 'ESC':  # If we've pressed the ESC key
             print( "Returning back to normal UI" )
-            state = bpy.context.scene.panel_settings
+            return self.finish( context )
+
+        return {'RUNNING_MODAL'}
+
+
+    def cancel( self, context ):
+        # Blender ends modal operators this way, e.g. when a file is loaded.
+        self.finish( context )
+
+
+    def finish( self, context ):
+        """
+        The only way out: removes the hover highlight and goes back to 
+        adding anchors unless the panel already went elsewhere.
+        """
+        if self.draw_handle is not None:
+            bpy.types.SpaceView3D.draw_handler_remove( self.draw_handle, 'WINDOW' )
+            self.draw_handle = None
+
+        state = bpy.context.scene.panel_settings
+        if state.mode_enum == 'PICK_VERTICES':
             state.mode_enum = 'CREATE_ANCHORS'
 
-            return {'CANCELLED'}
+        if context.area is not None:
+            context.area.tag_redraw()
 
-        return {'RUNNING_MODAL'}
+        return {'CANCELLED'}
 
     def invoke(self, context, event):
+        import screen_pick
+
+        mesh = get_selected_mesh()
+        abs_inds = mesh['abs_vert_inds'] if ('abs_vert_inds' in mesh) else None
+
+        # Vertices are projected once per view change, not on every pick.
+        self.pick_cache = screen_pick.ProjectionCache()
+        self.pick_cache.set_geometry( get_displayed_positions( mesh ), get_displayed_normals( mesh ), abs_inds )
+        self.hover_vert_ind = -1
+        self.hover_co = None
+        self.draw_handle = bpy.types.SpaceView3D.draw_handler_add( draw_hover_vertex, (self,), 'WINDOW', 'POST_VIEW' )
+
         context.window_manager.modal_handler_add(self)
         return {'RUNNING_MODAL'}
     
@@ -969,49 +2085,25 @@ class MyMouseOperator(bpy.types.Operator):
             return
         
         
-        if 'anchors' in mesh:
-            anchors = mesh['anchors']
-            anchors = list(anchors)
-        
-        else:
-            anchors = []
-        
-        # Filter out deleted anchors.
-        existing_anchors = []
-        for anchor in anchors:
-            if (anchor is not None) and (anchor.name in bpy.context.scene.objects):
-                existing_anchors.append( anchor )
-        anchors = existing_anchors
-        
+        import anchor_registry
+
         # If there are existing anchors and absolute vertex indices in the mesh, 
         # make sure that the closest selected vertex is in that list. Otherwise, 
         # different anchors are connected to isolated islands. ARAP algorithm is 
         # going to destroy the mesh in that case.
-        anchors_qty = len(anchors)
+        anchors_qty = anchor_registry.get_anchors_qty( mesh )
         has_abs_inds = 'abs_vert_inds' in mesh
         if (anchors_qty > 0) and has_abs_inds:
             if closest_vert_ind not in abs_inds:
                 return
 
-        vert = mesh.data.vertices[closest_vert_ind]
-        
-        v = vert.co
+        v = get_displayed_verts( mesh )[closest_vert_ind].co
         mat = mesh.matrix_world
         loc = mat @ v
         print( "Creating an anchor at ", loc )
         
-        ret = bpy.ops.object.empty_add( type='PLAIN_AXES', align='WORLD', location=(loc.x, loc.y, loc.z) )
-        anchor = bpy.context.active_object
-        anchor.scale = (0.01, 0.01, 0.01)
-        
-        anchor['mirror'] = None
-        anchor['symmetry'] = 'NONE'
-        # Store vertex index in the anchor object.
-        anchor['vert_ind'] = closest_vert_ind
-        
-                
-        # Add the anchor created to the list of anchors ind store it in the mesh object.
-        anchors.append( anchor )
+        # The anchor goes to the anchor collection of the mesh.
+        anchor = anchor_registry.add_anchor( mesh, loc, closest_vert_ind )
 
         # Check symmetry.
         symmetry = bpy.context.scene.panel_settings.symmetry_enum
@@ -1030,200 +2122,307 @@ class MyMouseOperator(bpy.types.Operator):
             best_vert_ind, world_pos = self.find_closest_vertex_to_a_point( mesh, pos )
             # Make sure that we don't address one and the same vertex.
             if best_vert_ind != closest_vert_ind:
-                ret = bpy.ops.object.empty_add( type='PLAIN_AXES', align='WORLD', location=(pos.x, pos.y, pos.z) )
-                mirror_anchor = bpy.context.active_object
-                mirror_anchor.scale = (0.01, 0.01, 0.01)
-                # Store vertex index in the anchor object.
-                mirror_anchor['vert_ind'] = best_vert_ind
+                mirror_anchor = anchor_registry.add_anchor( mesh, pos, best_vert_ind )
                 mirror_anchor['mirror'] = anchor
                 mirror_anchor['symmetry'] = symmetry
 
                 anchor['mirror'] = mirror_anchor
                 anchor['symmetry'] = symmetry
 
-                anchors.append( mirror_anchor )
-
-        
-        mesh["anchors"] = anchors
-
 
 
     
     
     def find_closest_vertex( self, context, event, abs_inds=None ):
-        # Get the 3D view region
-        region = context.region
-        rv3d = context.region_data
-
-        # Get the mouse position
-        coord = mathutils.Vector( (event.mouse_region_x, event.mouse_region_y) )
+        """
+        Index of the vertex under the mouse or -1. Only vertices in "abs_inds" 
+        given to the projection cache can be picked.
+        """
+        region, rv3d = get_view_region( context )
+        if rv3d is None:
+            return -1
 
-        # Initialize the minimum distance and the closest vertex
-        min_dist = float('inf')
-        closest_vertex = None
-
-        state  = bpy.context.scene.panel_settings
-
-        #import pdb
-        #pdb.set_trace()
         mesh = get_selected_mesh()
-        
-        last_best_dist = float('inf')
-        
-        mouse_ray = self.get_mouse_ray( context, event )
-        
-        best_vert_ind, best_dist = self.find_closest_vertex_in_a_mesh( region, rv3d, mesh, last_best_dist, coord, mouse_ray, abs_inds )
+        self.pick_cache.update( mesh.matrix_world, rv3d.perspective_matrix, rv3d.view_matrix, 
+                                rv3d.is_perspective, (region.width, region.height) )
+
+        x = event.mouse_x - region.x
+        y = event.mouse_y - region.y
+        best_vert_ind, best_dist = self.pick_cache.find_closest( x, y )
         
         return best_vert_ind
     
     
     
-    def find_closest_vertex_in_a_mesh( self, region, rv3d, mesh, last_best_dist, mouse_at_2d, mouse_ray, abs_inds ):
-        
-        best_dist = last_best_dist
-        best_vert_ind = -1
-        
-        matrix_world = mesh.matrix_world
-        
-        inv_matrix_world = matrix_world.to_3x3().transposed()
-        mouse_ray_local = inv_matrix_world @ mouse_ray
-        
-        # If provided, search only within allower vertices.
-        if abs_inds is not None:
-            vertex_inds = abs_inds
-        
-        else:
-            
-            vertex_inds = [ vert_ind for vert_ind, vertex in enumerate( mesh.data.vertices ) ]
-            
-        # Iterate over all the vertices in the mesh
-        for vert_ind in vertex_inds:
-            vertex = mesh.data.vertices[vert_ind]            
-            # Transform the vertex coordinates to 2D
-            norm = vertex.normal
-            
-            # Check if normal is towards the camera.
-            # Dot product should be negative.
-            d = norm.dot( mouse_ray_local )
-            if d >= 0.0:
-                continue
-            
-            loc3d = matrix_world @ vertex.co
-            loc2d = location_3d_to_region_2d( region, rv3d, loc3d )
-            # It can return None, if the vertex is behind the camera.
-            # And it indeed may happen because I iterate over all vertices here.
-            if loc2d is None:
-                continue
-
-            # Calculate the distance to the mouse position
-            dist = ( loc2d - mouse_at_2d ).length
-
-            # If this vertex is closer, update the minimum distance and the closest vertex
-            if dist < best_dist:
-                best_dist     = dist
-                best_vert_ind = vert_ind
-        
-        return best_vert_ind, best_dist
-    
-    
-    
-    def get_mouse_ray( self, context, event ):
-        # Get the 3D view region
-        region = context.region
-        rv3d   = context.region_data
+    def update_hover( self, context, event ):
+        """
+        Highlights the vertex a click would pick.
+        """
+        import numpy as np
 
-        # Get the mouse position
-        coord = event.mouse_region_x, event.mouse_region_y
+        vert_ind = self.find_closest_vertex( context, event )
+        if vert_ind == self.hover_vert_ind:
+            return
 
-        # Calculate the 3D vector
-        ray_vector = region_2d_to_vector_3d( region, rv3d, coord )
-        
-        ray_vector = ray_vector.normalized()
+        self.hover_vert_ind = vert_ind
+        if vert_ind < 0:
+            self.hover_co = None
+        else:
+            mesh = get_selected_mesh()
+            mat = np.array( mesh.matrix_world )
+            self.hover_co = tuple( mat[:3, :3] @ self.pick_cache.Vs[vert_ind] + mat[:3, 3] )
 
-        return ray_vector
+        if context.area is not None:
+            context.area.tag_redraw()
     
     
     
     def find_closest_vertex_to_a_point( self, mesh, point ):
-    
+        """
+        Displayed vertex closest to the world space "point". 
+        Returns (vert_ind, world space vertex position).
+        """
+        import numpy as np
+
         matrix_world = mesh.matrix_world
-        
-        inv_matrix_world = matrix_world.inverted()
-        point_local = inv_matrix_world @ point
-        
-        last_best_dist = float('inf')
-        last_best_ind  = -1
-        world_pos = None
+        point_local = np.array( matrix_world.inverted() @ point )
 
-        vertex_inds = [ vert_ind for vert_ind, vertex in enumerate( mesh.data.vertices ) ]
-            
-        # Iterate over all the vertices in the mesh
-        for vert_ind in vertex_inds:
-            vertex = mesh.data.vertices[vert_ind]
-            vertex_pos = vertex.co
-
-            # Calculate the distance to the mouse position
-            dist = ( vertex_pos - point_local ).length
-
-            # If this vertex is closer, update the minimum distance and the closest vertex
-            if dist < last_best_dist:
-                last_best_dist = dist
-                last_best_ind  = vert_ind
-                world_pos = matrix_world @ vertex_pos
-        
-        return last_best_ind, world_pos
+        Vs = get_displayed_positions( mesh )
+        dists = np.einsum( 'ij,ij->i', Vs - point_local, Vs - point_local )
+        best_ind = int( np.argmin( dists ) )
+        world_pos = matrix_world @ mathutils.Vector( Vs[best_ind] )
 
+        return best_ind, world_pos
 
 
 
-def on_transform_completed(obj, scene):
-    if (obj.type != 'EMPTY'):
-        return
 
-    has_mirror = 'mirror' in obj
-    if not has_mirror:
+def draw_hover_vertex( operator ):
+    """
+    3D view draw callback showing the vertex the mouse operator would pick.
+    """
+    if operator.hover_co is None:
         return
 
-    mirror = obj['mirror']
+    import gpu
+    from gpu_extras.batch import batch_for_shader
+
+    shader = gpu.shader.from_builtin( 'UNIFORM_COLOR' )
+    batch = batch_for_shader( shader, 'POINTS', {"pos": [operator.hover_co]} )
+    gpu.state.point_size_set( 10.0 )
+    shader.uniform_float( "color", (1.0, 0.5, 0.0, 1.0) )
+    batch.draw( shader )
+    gpu.state.point_size_set( 1.0 )
+
+
+
+def get_view_region( context ):
+    """
+    The 3D view main region and its view data. Operators started from the 
+    sidebar have the sidebar region in the context.
+    """
+    area = context.area
+    if (area is None) or (area.type != 'VIEW_3D'):
+        return (context.region, context.region_data)
+
+    for region in area.regions:
+        if region.type == 'WINDOW':
+            return (region, area.spaces.active.region_3d)
+
+    return (context.region, context.region_data)
+
+
+
+
+def get_mirrored_location( anchor, anchor_objects ):
+    """
+    For an anchor with a mirror returns (mirror, location the mirror should have).
+    Returns None if there is nothing to do. A mirror which doesn't exist 
+    anymore is forgotten.
+    """
+    if (anchor.type != 'EMPTY') or ('mirror' not in anchor):
+        return None
+
+    mirror = anchor['mirror']
     
-    if mirror is None:
-        obj[symmetry] = 'NONE'
-        return
+    if (mirror is None) or (mirror.name not in anchor_objects):
+        if (mirror is not None) or (anchor.get( 'symmetry', 'NONE' ) != 'NONE'):
+            anchor['mirror'] = None
+            anchor['symmetry'] = 'NONE'
+        return None
     
-    symmetry = obj['symmetry']
+    symmetry = anchor['symmetry']
 
-    loc = obj.location.copy()
+    loc = anchor.location.copy()
     if symmetry == 'X':
         loc.x = -loc.x
     elif symmetry == 'Y':
         loc.y = -loc.y
     elif symmetry == 'Z':
         loc.z = -loc.z
-    mirror.location = loc
+    else:
+        return None
+
+    return (mirror, loc)
+
 
-    print("Transform Completed")
 
 def on_depsgraph_update(scene, depsgraph):
-    if on_depsgraph_update.operator is None:
-        on_depsgraph_update.operator = bpy.context.active_operator
+    """
+    Keeps mirrored anchors of the mesh being edited symmetric. Only looks at 
+    objects whose transform the update changed, so it costs next to nothing 
+    while other parts of the scene are edited.
+    """
+    import anchor_registry
+
+    mesh = get_selected_mesh()
+    if mesh is None:
+        return
+
+    collection = anchor_registry.get_anchor_collection( mesh, create=False )
+    if collection is None:
         return
+    anchor_objects = collection.objects
+
+    moved = []
+    for update in depsgraph.updates:
+        if not update.is_updated_transform:
+            continue
+
+        obj = update.id.original
+        if isinstance( obj, bpy.types.Object ) and (obj.name in anchor_objects):
+            moved.append( obj )
 
-    if on_depsgraph_update.operator == bpy.context.active_operator:
+    if len(moved) == 0:
         return
 
-    on_depsgraph_update.operator = None  # Reset now to not trigger recursion in next step in case it triggers a depsgraph update
-    obj = bpy.context.active_object
-    on_transform_completed(obj, scene)
+    # If both anchors of a pair are moved together, neither of them follows the other.
+    moved_names = set( [ obj.name for obj in moved ] )
+    mirror_locations = []
+    for anchor in moved:
+        mirrored = get_mirrored_location( anchor, anchor_objects )
+        if (mirrored is not None) and (mirrored[0].name not in moved_names):
+            mirror_locations.append( mirrored )
+
+    # All mirrors are written at once and cause a single depsgraph update. 
+    # The mirrors come back in it, but their mirrors are already in place, 
+    # so nothing is written again.
+    for mirror, loc in mirror_locations:
+        if (mirror.location - loc).length > 1.0e-6:
+            mirror.location = loc
+
+    if scene.panel_settings.drag_preview and not is_animation_playing():
+        update_drag_preview( mesh )
+
+
+
+# Seconds between checks for the end of a drag, without moves for which 
+# anchors count as settled, and after which a drag is solved regardless.
+DRAG_POLL_INTERVAL  = 0.1
+DRAG_SETTLE_SECONDS = 0.5
+DRAG_TIMEOUT        = 30.0
+
+
+def get_drag_preview( mesh ):
+    """
+    Returns (anchor_sel, preview) for the current anchors and fixed vertices. 
+    Harmonic weights are computed on the first drag after constraints change.
+    """
+    import numpy as np
+    import arap_solver
+    import anchor_registry
+
+    constraints_key = (anchor_registry.get_anchor_vert_inds( mesh ).tobytes(), 
+                       np.packbits( get_fixed_mask( mesh ) ).tobytes())
+
+    cache = get_mesh_cache( mesh )
+    cached = cache.get( "drag_preview", None )
+    if (cached is not None) and (cached[0] == constraints_key):
+        return cached[1:]
+
+    Vs, Fs, anchor_sel, vert_inds, default_positions = get_arap_constraints( mesh )
+    preview = arap_solver.HarmonicPreview( Vs, Fs, vert_inds, len(anchor_sel) )
+    cache["drag_preview"] = (constraints_key, anchor_sel, preview)
+
+    return (anchor_sel, preview)
+
+
+
+def update_drag_preview( mesh ):
+    """
+    Shows the preview for the current anchor positions and makes sure a full 
+    solve runs once the anchors stop moving.
+    """
+    import time
+
+    anchor_sel, preview = get_drag_preview( mesh )
+    Vs_new = preview.deform( get_anchor_positions( mesh, anchor_sel ) )
+    apply_to_mesh( mesh, unweld_positions( mesh, Vs_new ) )
+
+    finish_drag.moved_at = time.monotonic()
+    if not bpy.app.timers.is_registered( finish_drag ):
+        bpy.app.timers.register( finish_drag, first_interval=DRAG_POLL_INTERVAL )
+
 
 
+def is_animation_playing():
+    return any( window.screen.is_animation_playing for window in bpy.context.window_manager.windows )
 
 
 
+def is_transform_running():
+    """
+    True while a modal transform runs in any window, None if Blender can't 
+    tell. Window.modal_operators is new in Blender 4.2.
+    """
+    known = False
+    for window in bpy.context.window_manager.windows:
+        operators = getattr( window, "modal_operators", None )
+        if operators is None:
+            continue
+
+        known = True
+        if any( operator.bl_idname.startswith( "TRANSFORM_OT_" ) for operator in operators ):
+            return True
 
+    if not known:
+        return None
+
+    return False
 
 
 
+def finish_drag():
+    """
+    Timer polling for the end of a drag, then the full solve replaces the preview. 
+    A drag is over when the modal transform moving anchors ended, or where that 
+    can't be told, when anchors haven't moved for DRAG_SETTLE_SECONDS. After 
+    DRAG_TIMEOUT seconds without a move it is solved anyway. Animation playback 
+    moving anchors isn't a drag, nothing is solved.
+    """
+    import time
+
+    if is_animation_playing():
+        return None
+
+    still = time.monotonic() - finish_drag.moved_at
+    transforming = is_transform_running()
+    if transforming is None:
+        transforming = (still < DRAG_SETTLE_SECONDS)
+
+    if transforming and (still < DRAG_TIMEOUT):
+        return DRAG_POLL_INTERVAL
+
+    mesh = get_selected_mesh()
+    if mesh is not None:
+        s = bpy.context.scene.panel_settings
+        bpy.ops.mesh.igl_apply_transform( backend_enum=s.backend_enum, 
+                                          preconditioner_enum=s.preconditioner_enum, 
+                                          cg_tolerance=s.cg_tolerance )
+
+    return None
 
+finish_drag.moved_at = 0.0
 
 
 
@@ -1238,13 +2437,17 @@ def register():
     bpy.utils.register_class(MESH_OT_remove_selected_from_fixed)
     bpy.utils.register_class(MESH_OT_select_fixed)
     bpy.utils.register_class(MESH_OT_create_anchor)
+    bpy.utils.register_class(MESH_OT_import_anchors)
     bpy.utils.register_class(MESH_OT_apply_transform)
     bpy.utils.register_class(MESH_OT_apply_default_shape)
+    bpy.utils.register_class(MESH_OT_bind_targets)
+    bpy.utils.register_class(MESH_OT_unbind_targets)
+    bpy.utils.register_class(MESH_OT_bake_animation)
+    bpy.utils.register_class(MESH_OT_restore_solve)
     bpy.utils.register_class(MESH_OT_reset)
     
     # Make blender call on_depsgraph_update after each
     # update of Blender's internal dependency graph
-    on_depsgraph_update.operator = None
     bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update)
     
     bpy.utils.register_class(MyMouseOperator)
@@ -1252,10 +2455,10 @@ def register():
 
 
 def unregister():
-    bpy.utils.unregister_class(SimpleMouseOperator)
+    bpy.utils.unregister_class(MyMouseOperator)
     # Make blender call on_depsgraph_update after each
     # update of Blender's internal dependency graph
-    bpy.app.handlers.depsgraph_update_post.erase(on_depsgraph_update)
+    bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update)
 
     bpy.utils.unregister_class(MESH_OT_install_python_modules)
     bpy.utils.unregister_class(MESH_OT_pick_selected_meshes)
@@ -1263,13 +2466,19 @@ def unregister():
     bpy.utils.unregister_class(MESH_OT_remove_selected_from_fixed)
     bpy.utils.unregister_class(MESH_OT_select_fixed)
     bpy.utils.unregister_class(MESH_OT_create_anchor)
+    bpy.utils.unregister_class(MESH_OT_import_anchors)
     bpy.utils.unregister_class(MESH_OT_apply_transform)
     bpy.utils.unregister_class(MESH_OT_apply_default_shape)
+    bpy.utils.unregister_class(MESH_OT_bind_targets)
+    bpy.utils.unregister_class(MESH_OT_unbind_targets)
+    bpy.utils.unregister_class(MESH_OT_bake_animation)
+    bpy.utils.unregister_class(MESH_OT_restore_solve)
     bpy.utils.unregister_class(MESH_OT_reset)
     
     bpy.utils.unregister_class(VIEW3D_PT_igl_panel)
     
-    bpy.utils.unregister_class(AnchorSymmetry)
+    del bpy.types.Scene.panel_settings
+    bpy.utils.unregister_class(PanelSettings)
     
 
 